@@ -0,0 +1,159 @@
+"""
+Benchmark di `bootstrap` rispetto a un bootstrap con un ciclo Python per ricampionamento
+(copiato qui sotto, come si scriverebbe in un notebook).
+
+- WER di corpus da conteggi S, D, I, N sintetici per 30 episodi x 5 modelli (per episodio e
+  per finestre di 60 s ricampionate per episodio), intervalli e test appaiati, anche
+  stratificati per Tipologia.
+- SubER, BLEURT, EER e WER per episodio dai CSV di `raw_results`, con le correlazioni tra
+  metriche di correlations.ipynb.
+
+Verifica che la matrice di pesi riproduca esattamente le statistiche calcolate ricampionamento
+per ricampionamento con gli stessi indici, e che gli intervalli coincidano (entro l'errore
+Monte Carlo) con quelli del ciclo Python.
+
+Uso:
+    python metrics/benchmark_bootstrap.py --resamples 10000
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from metrics import bootstrap  # noqa: E402
+from utils.names import get_file_names  # noqa: E402
+
+MODELS = ["parakeet", "whisper_large", "whisperx", "assemblyai", "whisperx_reviewer"]
+METRICS = {"wer": "wer_results.csv", "suber": "suber_results.csv", "bleurt": "bleurt_results.csv",
+           "eer": "entity_error_rate.csv"}
+CSV_MODELS = ["parakeet", "whisper_large", "whisperx", "assemblyai"]
+
+
+# --- Ciclo Python per ricampionamento ---
+
+def legacy_bootstrap(num, den, n_resamples, seed=0):
+    rng = np.random.default_rng(seed)
+    n = len(num)
+    samples = np.empty((n_resamples, num.shape[1]))
+    for b in range(n_resamples):
+        idx = rng.integers(0, n, n)
+        for m in range(num.shape[1]):
+            samples[b, m] = sum(num[i, m] for i in idx) / sum(den[i, m] for i in idx)
+    return samples
+
+
+# --- Conteggi sintetici ---
+
+def synthetic_counts(files, seed=0, window_words=150):
+    """Conteggi per finestra: WER di base per modello e per episodio, parole per finestra ~ Poisson."""
+    rng = np.random.default_rng(seed)
+    base = {"parakeet": 0.27, "whisper_large": 0.22, "whisperx": 0.21, "assemblyai": 0.215, "whisperx_reviewer": 0.205}
+    rows = []
+    for file in files:
+        difficulty = rng.normal(0, 0.05)
+        n_windows = rng.integers(250, 600)
+        n = rng.poisson(window_words, n_windows)
+        for model, rate in base.items():
+            p = np.clip(rate + difficulty + rng.normal(0, 0.02), 0.02, 0.9)
+            errors = rng.binomial(n, p)
+            s = rng.binomial(errors, 0.5)
+            d = rng.binomial(errors - s, 0.6)
+            meta = {"file": file, **bootstrap.program_metadata(file), "model": model}
+            rows.append(pd.DataFrame({**meta, "start": np.arange(n_windows) * 60.0, "S": s, "D": d,
+                                      "I": errors - s - d, "N": n}))
+    return pd.concat(rows, ignore_index=True)
+
+
+def timed(label, fn):
+    t0 = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - t0
+    print(f"  {label:<58} {elapsed:7.3f} s")
+    return elapsed, result
+
+
+def run(n_resamples, legacy_resamples):
+    files = get_file_names()
+    counts = synthetic_counts(files)
+    num, den, meta = bootstrap.count_matrices(counts, MODELS)
+    print(f"[INFO] {len(files)} episodi, {len(counts) // len(MODELS)} finestre, {len(MODELS)} modelli, "
+          f"{n_resamples} ricampionamenti")
+
+    # Pesi = stessi indici del ciclo: le statistiche devono coincidere esattamente
+    check = 200
+    idx = np.random.default_rng(7).integers(0, len(num), size=(check, len(num)))
+    weights = np.stack([np.bincount(row, minlength=len(num)) for row in idx]).astype(np.float64)
+    expected = np.array([num[row].sum(axis=0) / den[row].sum(axis=0) for row in idx])
+    assert np.allclose((weights @ num) / (weights @ den), expected, rtol=1e-12)
+    first = next(bootstrap.resample_weights(len(num), check, seed=7))
+    assert np.array_equal(first, weights), "la matrice di pesi non corrisponde agli indici estratti"
+
+    t_legacy, legacy = timed(f"ciclo Python ({legacy_resamples} ricampionamenti)",
+                             lambda: legacy_bootstrap(num, den, legacy_resamples))
+    t_new, samples = timed("matrice di indici: WER di corpus per episodio",
+                           lambda: bootstrap.bootstrap_samples(num, den, n_resamples))
+    per_resample = (t_legacy / legacy_resamples) / (t_new / n_resamples)
+    print(f"  speedup per ricampionamento x{per_resample:.0f}")
+    se = samples.std(axis=0)
+    for q in (0.025, 0.5, 0.975):
+        diff = np.abs(np.quantile(legacy, q, axis=0) - np.quantile(samples, q, axis=0))
+        assert np.all(diff < 0.3 * se), (q, diff, se)  # errore Monte Carlo dei quantili
+
+    _, intervals = timed("intervalli + test appaiati (stessi campioni)", lambda: (
+        bootstrap.confidence_intervals(num, den, MODELS, samples=samples),
+        bootstrap.paired_tests(num, den, MODELS, samples=samples)))
+    _, stratified = timed("stratificato per Tipologia", lambda: bootstrap.confidence_intervals(
+        num, den, MODELS, n_resamples, strata=meta["Tipologia"]))
+    _, by_group = timed("per Tipologia (intervalli e test per gruppo)", lambda: (
+        bootstrap.grouped(bootstrap.confidence_intervals, num, den, meta["Tipologia"], MODELS,
+                          n_resamples=n_resamples),
+        bootstrap.grouped(bootstrap.paired_tests, num, den, meta["Tipologia"], MODELS, n_resamples=n_resamples)))
+
+    # Ricampionando le finestre come se fossero indipendenti l'intervallo risulta troppo stretto
+    w_num, w_den, _ = bootstrap.count_matrices(counts.assign(window=counts["file"] + "@" + counts["start"].astype(str)),
+                                               MODELS, cluster="window")
+    _, windows = timed(f"finestre come unità indipendenti ({len(w_num)} unità)", lambda: bootstrap.confidence_intervals(
+        w_num, w_den, MODELS, n_resamples))
+
+    results_dir = os.path.join(ROOT, "raw_results")
+    frames = {name: pd.read_csv(os.path.join(results_dir, path)) for name, path in METRICS.items()}
+    scores = {name: bootstrap.score_matrix(frame, CSV_MODELS) for name, frame in frames.items()}
+    _, score_intervals = timed("media per episodio di 4 metriche dai CSV", lambda: {
+        name: bootstrap.confidence_intervals(matrix, None, CSV_MODELS, n_resamples) for name, matrix in scores.items()})
+    _, correlations = timed("correlazioni wer-bleurt, wer-suber, wer-eer", lambda: {
+        other: bootstrap.correlation_intervals(scores["wer"], scores[other], CSV_MODELS, n_resamples)
+        for other in ("bleurt", "suber", "eer")})
+    for other, frame in correlations.items():
+        expected = [np.corrcoef(scores["wer"][:, k], scores[other][:, k])[0, 1] for k in range(len(CSV_MODELS))]
+        assert np.allclose(frame["corr"], expected)
+        assert np.all((frame["low"] <= frame["corr"] + 1e-9) | frame["low"].isna())
+
+    pd.set_option("display.width", 160)
+    print("[INFO] WER di corpus (episodi):")
+    print(intervals[0].round(4).to_string(index=False))
+    print("[INFO] Test appaiati:")
+    print(intervals[1].round(4).to_string(index=False))
+    print("[INFO] Ampiezza dell'intervallo: episodi "
+          f"{(intervals[0]['high'] - intervals[0]['low']).mean():.4f}, stratificato "
+          f"{(stratified['high'] - stratified['low']).mean():.4f}, finestre indipendenti "
+          f"{(windows['high'] - windows['low']).mean():.4f}")
+    print("[INFO] Test appaiati significativi per Tipologia:")
+    print(by_group[1][by_group[1]["significant"]].groupby("group").size().to_string())
+    print("[INFO] SubER medio dai CSV:")
+    print(score_intervals["suber"].round(3).to_string(index=False))
+    print("[INFO] Correlazione WER-BLEURT dai CSV:")
+    print(correlations["bleurt"].round(3).to_string(index=False))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--resamples", type=int, default=bootstrap.DEFAULT_RESAMPLES)
+    parser.add_argument("--legacy-resamples", type=int, default=1000)
+    args = parser.parse_args()
+    run(args.resamples, args.legacy_resamples)
@@ -0,0 +1,93 @@
+"""
+Benchmark di `edit_distance` rispetto al `compute_wer` originale di sliding_window.ipynb
+(matrice (r+1)x(h+1) riempita con due cicli Python), su finestre sintetiche da 60 s con hop
+da 10 s. Verifica anche che le distanze coincidano.
+
+Uso:
+    python metrics/benchmark_edit_distance.py --minutes 30
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from metrics import edit_distance  # noqa: E402
+
+WORDS = ["allora", "città", "perché", "governo", "anno", "roma", "sì", "è", "stato", "detto", "che", "non"]
+WORDS_PER_SECOND = 2.5
+
+
+def legacy_compute_wer(ref_tokens, hyp_tokens):
+    """Copia del `compute_wer` originale."""
+    r_len = len(ref_tokens)
+    h_len = len(hyp_tokens)
+    d = np.zeros((r_len + 1, h_len + 1), dtype=int)
+    for i in range(r_len + 1):
+        d[i][0] = i
+    for j in range(h_len + 1):
+        d[0][j] = j
+    for i in range(1, r_len + 1):
+        for j in range(1, h_len + 1):
+            cost = 0 if ref_tokens[i - 1] == hyp_tokens[j - 1] else 1
+            d[i][j] = min(d[i - 1][j] + 1, d[i][j - 1] + 1, d[i - 1][j - 1] + cost)
+    return d[r_len][h_len], r_len
+
+
+def synthetic_windows(minutes, window=60, hop=10, error_rate=0.15, seed=0):
+    """Coppie (reference, ipotesi) per ogni finestra, con errori casuali sull'ipotesi."""
+    rng = random.Random(seed)
+    ref = [rng.choice(WORDS) for _ in range(int(minutes * 60 * WORDS_PER_SECOND))]
+    hyp = []
+    for word in ref:
+        p = rng.random()
+        if p < error_rate / 3:
+            continue
+        if p < 2 * error_rate / 3:
+            hyp.append(rng.choice(WORDS))
+        elif p < error_rate:
+            hyp.extend([word, rng.choice(WORDS)])
+        else:
+            hyp.append(word)
+    ratio = len(hyp) / len(ref)
+    pairs = []
+    for start in range(0, minutes * 60, hop):
+        a, b = int(start * WORDS_PER_SECOND), int((start + window) * WORDS_PER_SECOND)
+        pairs.append((ref[a:b], hyp[int(a * ratio):int(b * ratio)]))
+    return pairs
+
+
+def run(minutes, band):
+    pairs = synthetic_windows(minutes)
+    print(f"[INFO] {len(pairs)} finestre, ~{int(60 * WORDS_PER_SECOND)} parole per finestra")
+
+    t0 = time.perf_counter()
+    legacy = [legacy_compute_wer(ref, hyp)[0] for ref, hyp in pairs]
+    t_legacy = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    counts = edit_distance.batch_edit_counts(pairs)
+    t_batch = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    banded = edit_distance.batch_edit_counts(pairs, band=band)
+    t_banded = time.perf_counter() - t0
+
+    exact = counts[:, :3].sum(axis=1)
+    assert np.array_equal(exact, np.array(legacy)), "distanze diverse dal compute_wer originale"
+    n_diff = int((banded[:, :3].sum(axis=1) != exact).sum())
+    print(f"  legacy        {t_legacy:.3f} s")
+    print(f"  bit-parallel  {t_batch:.3f} s   (x{t_legacy / t_batch:.0f})")
+    print(f"  banda {band:<6}  {t_banded:.3f} s   (x{t_legacy / t_banded:.0f}, {n_diff} finestre con distanza diversa)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--minutes", type=int, default=30)
+    parser.add_argument("--band", type=int, default=20)
+    args = parser.parse_args()
+    run(args.minutes, args.band)
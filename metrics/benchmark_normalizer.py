@@ -0,0 +1,102 @@
+"""
+Benchmark di `ItalianNormalizer` (metrics_utils.normalize_text / normalize_tokens) rispetto
+alla versione originale a passi separati, su un corpus sintetico di `--hours` ore di parlato.
+Misura i due usi reali: episodi interi (wer_suber.ipynb) e parola per parola
+(extract_words_from_json in sliding_window.ipynb), e verifica che l'output sia identico.
+
+Uso:
+    python metrics/benchmark_normalizer.py --hours 50
+"""
+import argparse
+import os
+import random
+import re
+import sys
+import time
+import unicodedata
+
+from num2words import num2words
+import roman
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from metrics.metrics_utils import ItalianNormalizer  # noqa: E402
+
+WORDS_PER_HOUR = 150 * 60
+EPISODE_HOURS = 2
+WORDS = ["allora", "città", "perché", "governo", "l'anno", "Roma,", "sì?", "è", "stato", "detto", "che", "non",
+         "Papa", "Giovanni", "XXIII", "IV", "secolo", "d.C.", "1945", "50.000", "euro.", "«Però»", "dì", "più!"]
+INSERTS = ["[musica]", "(applausi)", "(ride)", "[incomprensibile]"]
+
+
+def legacy_process_numbers(text):
+    """Copia del `process_numbers` originale."""
+    text = re.sub(r'\b(d\.c\.)\b', 'dopo Cristo', text, flags=re.IGNORECASE)
+    text = re.sub(r'\b(a\.c\.)\b', 'avanti Cristo', text, flags=re.IGNORECASE)
+
+    def arabic_to_words(match):
+        return num2words(int(match.group().replace('.', '')), lang='it')
+
+    text = re.sub(r'\b\d+(?:\.\d{3})*\b', arabic_to_words, text)
+
+    def roman_to_words(match):
+        try:
+            return num2words(roman.fromRoman(match.group().upper()), lang='it')
+        except roman.InvalidRomanNumeralError:
+            return match.group()
+
+    return re.sub(r'\b[IVXLCDM]+\b', roman_to_words, text, flags=re.IGNORECASE)
+
+
+def legacy_normalize_text(text):
+    """Copia del `normalize_text` originale."""
+    text = unicodedata.normalize("NFKC", text)
+    text = re.sub(r'\[.*?\]', '', text)
+    text = re.sub(r'\(.*?\)', '', text)
+    text = ''.join(ch if not unicodedata.category(ch).startswith(('M', 'S', 'P')) else ' ' for ch in text)
+    text = legacy_process_numbers(text)
+    text = text.lower()
+    for accented, plain in {'à': 'a', 'è': 'e', 'é': 'e', 'ì': 'i', 'ò': 'o', 'ù': 'u'}.items():
+        text = text.replace(accented, plain)
+    text = re.sub(r'[^a-z\s]', ' ', text)
+    return re.sub(r'\s+', ' ', text).strip()
+
+
+def synthetic_corpus(hours, seed=0):
+    """Lista di episodi, ognuno come lista di parole."""
+    rng = random.Random(seed)
+    n_words = int(hours * WORDS_PER_HOUR)
+    words = [rng.choice(INSERTS) if rng.random() < 0.01 else rng.choice(WORDS) for _ in range(n_words)]
+    step = EPISODE_HOURS * WORDS_PER_HOUR
+    return [words[i:i + step] for i in range(0, n_words, step)]
+
+
+def timed(fn):
+    t0 = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - t0
+
+
+def run(hours):
+    episodes = synthetic_corpus(hours)
+    texts = [" ".join(words) for words in episodes]
+    n_words = sum(len(words) for words in episodes)
+    print(f"[INFO] {hours} ore: {len(episodes)} episodi, {n_words} parole")
+
+    old, t_old = timed(lambda: [legacy_normalize_text(text) for text in texts])
+    new, t_new = timed(lambda: [ItalianNormalizer().normalize(text) for text in texts])
+    assert old == new, "output diverso sugli episodi interi"
+    print(f"  episodi interi   legacy {t_old:.2f} s   normalizer {t_new:.2f} s   (x{t_old / t_new:.1f})")
+
+    old, t_old = timed(lambda: [legacy_normalize_text(word) for words in episodes for word in words])
+    normalizer = ItalianNormalizer()
+    new, t_new = timed(lambda: [token for words in episodes for token in normalizer.normalize_tokens(words)])
+    assert old == new, "output diverso parola per parola"
+    print(f"  parola per parola legacy {t_old:.2f} s   normalizer {t_new:.2f} s   (x{t_old / t_new:.1f})")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--hours", type=float, default=50)
+    args = parser.parse_args()
+    run(args.hours)
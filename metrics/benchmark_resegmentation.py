@@ -0,0 +1,187 @@
+"""
+Benchmark di `resegmentation` rispetto a `levenshtein_align_hypothesis_to_reference` di
+bleurt.ipynb (copiata qui sotto) su episodi sintetici completi, con più modelli per episodio.
+Verifica che i segmenti prodotti siano identici, anche su casi limite (segmenti vuoti,
+ipotesi vuota, inserzioni prima della prima parola).
+
+Uso:
+    python metrics/benchmark_resegmentation.py --episodes 3 --hours 2 --models 4
+"""
+import argparse
+import os
+import random
+import string
+import sys
+import time
+from dataclasses import dataclass
+from itertools import zip_longest
+from typing import List, Tuple
+
+import numpy
+import Levenshtein
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rapidfuzz.distance import Levenshtein as RapidfuzzLevenshtein  # noqa: E402
+
+from metrics.resegmentation import EncodedReference  # noqa: E402
+
+WORDS_PER_HOUR = 150 * 60
+WORDS = ["allora", "città", "perché", "governo", "l'anno", "Roma,", "sì?", "è", "stato", "detto", "che", "non",
+         "Papa", "Giovanni", "secolo", "euro.", "«Però»", "più!", "-", "...", "Presidente", "dunque", "quindi"]
+
+
+@dataclass
+class Word:
+    string: str
+
+
+@dataclass
+class Segment:
+    word_list: List[Word]
+
+
+def legacy_align(hypothesis, reference):
+    """Copia di `levenshtein_align_hypothesis_to_reference` (bleurt.ipynb)."""
+    remove_punctuation_table = str.maketrans('', '', string.punctuation)
+
+    def normalize_word(word):
+        word = word.lower()
+        word_without_punctuation = word.translate(remove_punctuation_table)
+        if not word_without_punctuation:
+            return word
+        return word_without_punctuation
+
+    all_reference_word_strings = [normalize_word(word.string) for segment in reference for word in segment.word_list]
+    all_hypothesis_word_strings = [normalize_word(word.string) for segment in hypothesis for word in segment.word_list]
+    all_hypothesis_words = [word for segment in hypothesis for word in segment.word_list]
+    reference_string, hypothesis_string = legacy_map_words_to_characters(
+        all_reference_word_strings, all_hypothesis_word_strings)
+    opcodes = Levenshtein.opcodes(reference_string, hypothesis_string)
+
+    reference_segment_lengths = [len(segment.word_list) for segment in reference]
+    reference_segment_boundary_indices = numpy.cumsum(reference_segment_lengths)
+    current_segment_index = 0
+    aligned_hypothesis_word_lists = [[] for _ in reference]
+
+    for opcode_tuple in opcodes:
+        hypothesis_position_range = range(opcode_tuple[3], opcode_tuple[4])
+        reference_position_range = range(opcode_tuple[1], opcode_tuple[2])
+        for hypothesis_position, reference_position in zip_longest(hypothesis_position_range, reference_position_range):
+            if (reference_position is not None
+                    and reference_position >= reference_segment_boundary_indices[current_segment_index]):
+                assert reference_position == reference_segment_boundary_indices[current_segment_index]
+                current_segment_index += 1
+                while (current_segment_index < len(reference_segment_boundary_indices)
+                       and reference_segment_boundary_indices[current_segment_index]
+                       == reference_segment_boundary_indices[current_segment_index - 1]):
+                    current_segment_index += 1
+            if hypothesis_position is not None:
+                word = all_hypothesis_words[hypothesis_position]
+                aligned_hypothesis_word_lists[current_segment_index].append(word)
+
+    return [Segment(word_list=word_list) for word_list in aligned_hypothesis_word_lists]
+
+
+def legacy_map_words_to_characters(reference_words: List[str], hypothesis_words: List[str]) -> Tuple[str, str]:
+    """Copia di `_map_words_to_characters` (bleurt.ipynb)."""
+    unique_words = set(reference_words + hypothesis_words)
+    vocabulary = dict(zip(unique_words, range(len(unique_words))))
+    reference_string = "".join(chr(0x1000 + vocabulary[word]) for word in reference_words)
+    hypothesis_string = "".join(chr(0x1000 + vocabulary[word]) for word in hypothesis_words)
+    return reference_string, hypothesis_string
+
+
+def noisy(words, rng, error_rate):
+    out = []
+    for word in words:
+        r = rng.random()
+        if r < error_rate / 3:
+            continue
+        if r < 2 * error_rate / 3:
+            out.append(rng.choice(WORDS))
+        elif r < error_rate:
+            out.extend([word, rng.choice(WORDS)])
+        else:
+            out.append(word.upper() if rng.random() < 0.05 else word)
+    return out
+
+
+def segments_of(words, rng, empty_rate=0.02):
+    segments, i = [], 0
+    while i < len(words):
+        if rng.random() < empty_rate:
+            segments.append([])
+            continue
+        n = rng.randint(1, 12)
+        segments.append(words[i:i + n])
+        i += n
+    return segments
+
+
+def synthetic_episode(hours, n_models, seed):
+    rng = random.Random(seed)
+    words = [rng.choice(WORDS) + (str(rng.randint(0, 500)) if rng.random() < 0.3 else "")
+             for _ in range(int(hours * WORDS_PER_HOUR))]
+    reference = [[]] + segments_of(words, rng)
+    hypotheses = {f"model_{m}": segments_of(noisy(words, rng, 0.05 + 0.05 * m), rng, 0.0) for m in range(n_models)}
+    return reference, hypotheses
+
+
+def as_segments(segments):
+    return [Segment([Word(w) for w in segment]) for segment in segments]
+
+
+def check_edge_cases():
+    cases = [
+        ([["a", "b"], ["c"]], ["x", "a", "b", "c", "y"]),
+        ([[], [], ["a"], [], ["b", "c"]], ["z", "z", "b"]),
+        ([["a"], ["b"]], []),
+        ([[], []], ["a", "b"]),
+        ([["ciao!"], ["..."], ["Mondo"]], ["Ciao", "...", "mondo", "?"]),
+    ]
+    for reference, hypothesis in cases:
+        old = legacy_align(as_segments([hypothesis]), as_segments(reference))
+        new = EncodedReference(reference).resegment(hypothesis)
+        assert [[w.string for w in s.word_list] for s in old] == new, (reference, hypothesis)
+
+
+def run(episodes, hours, n_models):
+    check_edge_cases()
+    t_old = t_new = t_opcodes = 0.0
+    for e in range(episodes):
+        reference, hypotheses = synthetic_episode(hours, n_models, seed=e)
+        reference_segments = as_segments(reference)
+
+        t0 = time.perf_counter()
+        old = {model: legacy_align(as_segments(hyp), reference_segments) for model, hyp in hypotheses.items()}
+        t_old += time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        encoded = EncodedReference(reference)
+        new = {model: encoded.resegment([w for segment in hyp for w in segment]) for model, hyp in hypotheses.items()}
+        t_new += time.perf_counter() - t0
+
+        # Costo dei soli opcode di Levenshtein, comune alle due versioni
+        hyp_ids = [encoded.encode([w for segment in hyp for w in segment]).tolist() for hyp in hypotheses.values()]
+        t0 = time.perf_counter()
+        for ids in hyp_ids:
+            RapidfuzzLevenshtein.opcodes(encoded.ids.tolist(), ids)
+        t_opcodes += time.perf_counter() - t0
+
+        for model in hypotheses:
+            assert [[w.string for w in s.word_list] for s in old[model]] == new[model], f"output diverso ({model})"
+    n_words = int(hours * WORDS_PER_HOUR)
+    print(f"[INFO] {episodes} episodi da {hours} ore (~{n_words} parole), {n_models} modelli ciascuno: output identico")
+    print(f"  notebook {t_old:.2f} s   resegmentation {t_new:.2f} s   (x{t_old / t_new:.1f})")
+    print(f"  esclusi gli opcode di Levenshtein ({t_opcodes:.2f} s): notebook {t_old - t_opcodes:.2f} s   "
+          f"resegmentation {t_new - t_opcodes:.2f} s   (x{(t_old - t_opcodes) / (t_new - t_opcodes):.1f})")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--episodes", type=int, default=3)
+    parser.add_argument("--hours", type=float, default=2)
+    parser.add_argument("--models", type=int, default=4)
+    args = parser.parse_args()
+    run(args.episodes, args.hours, args.models)
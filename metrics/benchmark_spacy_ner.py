@@ -0,0 +1,138 @@
+"""
+Benchmark di `spacy_ner` rispetto a `extract_entities` di eer.ipynb (copiata qui sotto: `nlp(text)`
+sul testo intero con tutti i componenti attivi).
+
+- Con i dati reali (`--data ../data`) i testi sono quelli della GT e dei modelli, con i loro SRT.
+- Altrimenti i testi sono sintetici (sottotitoli con nomi propri, luoghi e organizzazioni).
+
+Riporta i tempi del notebook, della prima estrazione (cache vuota) e della seconda (tutta da
+cache), e quante entità del notebook vengono ritrovate con lo stesso `char_interval` (i chunk
+cambiano il contesto del modello, quindi la coincidenza non è garantita al 100%). Verifica che
+ogni `extraction_text` coincida con il testo originale agli offset globali.
+
+Richiede spaCy e il modello (`python -m spacy download it_core_news_sm`).
+
+Uso:
+    python metrics/benchmark_spacy_ner.py --files 10 --subtitles 1500 --n-process 4
+    python metrics/benchmark_spacy_ner.py --data ../data
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+import zlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from metrics import spacy_ner  # noqa: E402
+from standardization import standardization_utils  # noqa: E402
+from utils.names import get_file_names, get_model_names  # noqa: E402
+
+NAMES = ["Mario Draghi", "Giorgia Meloni", "Sergio Mattarella", "Papa Francesco", "Roma", "Milano", "Napoli",
+         "l'Unione Europea", "la RAI", "il Parlamento", "la Juventus", "Bruxelles"]
+WORDS = ["allora", "oggi", "ha", "detto", "che", "il", "governo", "è", "stato", "molto", "chiaro", "con", "a", "in"]
+
+
+# --- Copia di eer.ipynb ---
+
+def legacy_extract_entities(text, nlp):
+    doc = nlp(text)
+    entities = []
+    for ent in doc.ents:
+        entities.append({
+            "extraction_class": ent.label_,
+            "extraction_text": ent.text,
+            "char_interval": [ent.start_char, ent.end_char]
+        })
+    return entities
+
+
+# --- Testi sintetici ---
+
+def synthetic_subtitles(n_subtitles, seed):
+    rng = random.Random(seed)
+    subtitles = []
+    for _ in range(n_subtitles):
+        words = [rng.choice(NAMES) if rng.random() < 0.12 else rng.choice(WORDS) for _ in range(rng.randint(2, 9))]
+        text = " ".join(words)
+        subtitles.append(text[0].upper() + text[1:] + rng.choice(["", "", ",", ".", "?"]))
+    return subtitles
+
+
+def load_episodes(data_dir, n_files, n_subtitles):
+    episodes = []
+    if data_dir:
+        for text_path, srt_path, _ in spacy_ner.ner_jobs(get_file_names()[:n_files], get_model_names(), data_dir):
+            if not (os.path.exists(text_path) and os.path.exists(srt_path)):
+                print(f"[SKIP] {text_path}: testo o SRT mancante")
+                continue
+            with open(text_path, "r", encoding="utf-8") as f:
+                text = f.read()
+            episodes.append((text, standardization_utils.read_track(srt_path, errors="replace").char_counts()))
+    else:
+        for file in get_file_names()[:n_files]:
+            subtitles = synthetic_subtitles(n_subtitles, zlib.crc32(file.encode()))
+            episodes.append((" ".join(subtitles) + " ", [len(s) for s in subtitles]))
+    return episodes
+
+
+def run(data_dir, n_files, n_subtitles, n_process, batch_size, max_chars):
+    try:
+        import spacy
+    except ImportError:
+        print("[ERRORE] spaCy non installato")
+        return
+    episodes = load_episodes(data_dir, n_files, n_subtitles)
+    if not episodes:
+        print("[ERRORE] Nessun testo da confrontare")
+        return
+    texts = [text for text, _ in episodes]
+    lengths = [counts for _, counts in episodes]
+
+    nlp_full = spacy.load(spacy_ner.SPACY_MODEL)
+    nlp_full.max_length = max(nlp_full.max_length, max(len(text) for text in texts) + 1)
+    t0 = time.perf_counter()
+    legacy = [legacy_extract_entities(text, nlp_full) for text in texts]
+    t_legacy = time.perf_counter() - t0
+
+    with tempfile.TemporaryDirectory() as tmp:
+        extractor = spacy_ner.EntityExtractor(cache_path=os.path.join(tmp, "ner.sqlite"), n_process=n_process,
+                                              batch_size=batch_size, max_chars=max_chars)
+        print(f"[INFO] Componenti attivi: {extractor._load().pipe_names}")
+        t0 = time.perf_counter()
+        chunked = extractor.extract_many(texts, lengths)
+        t_first = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        cached = extractor.extract_many(texts, lengths)
+        t_cached = time.perf_counter() - t0
+        assert cached == chunked, "le entità lette dalla cache sono diverse da quelle calcolate"
+        assert extractor.stats["computed"] == extractor.stats["cache_hits"], extractor.stats
+
+    n_legacy = n_found = 0
+    for text, old, new in zip(texts, legacy, chunked):
+        for entity in new:
+            start, end = entity["char_interval"]
+            assert text[start:end] == entity["extraction_text"], "offset globali non corretti"
+        new_keys = {(e["extraction_class"], tuple(e["char_interval"])) for e in new}
+        n_legacy += len(old)
+        n_found += sum((e["extraction_class"], tuple(e["char_interval"])) in new_keys for e in old)
+
+    n_chars = sum(len(text) for text in texts)
+    print(f"[INFO] {len(texts)} testi ({n_chars / 1e6:.1f} M caratteri): offset globali corretti")
+    print(f"  notebook {t_legacy:.2f} s   chunk + solo ner ({n_process} processi) {t_first:.2f} s "
+          f"(x{t_legacy / t_first:.1f})   da cache {t_cached:.2f} s")
+    print(f"  entità del notebook ritrovate: {n_found}/{n_legacy} ({n_found / max(n_legacy, 1):.1%})")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--data", default=None, help="cartella data con text/ e srt/ di GT e modelli")
+    parser.add_argument("--files", type=int, default=10)
+    parser.add_argument("--subtitles", type=int, default=1500)
+    parser.add_argument("--n-process", type=int, default=4)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--max-chars", type=int, default=spacy_ner.MAX_CHUNK_CHARS)
+    args = parser.parse_args()
+    run(args.data, args.files, args.subtitles, args.n_process, args.batch_size, args.max_chars)
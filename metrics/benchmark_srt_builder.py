@@ -0,0 +1,250 @@
+"""
+Benchmark di `srt_builder` rispetto a `create_srt_from_json` di readability.ipynb (copiata qui
+sotto) su tutti i modelli x episodi.
+
+- Con i dati reali (`--data ../data`) il confronto golden è con i file
+  `{data}/{model}/improved_srt/{file}.srt` prodotti dal notebook.
+- Altrimenti gli episodi sono sintetici (parole in stile Whisper con spazio iniziale, apostrofi
+  separati, punteggiatura, pause, parole vuote) e il golden è l'output della copia del notebook.
+
+La modalità "greedy" deve coincidere byte per byte; per la modalità "dp" sono riportate le
+statistiche di leggibilità (CPS, durata e caratteri per blocco, blocchi fuori dai limiti).
+
+Uso:
+    python metrics/benchmark_srt_builder.py --minutes 60
+    python metrics/benchmark_srt_builder.py --data ../data
+"""
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import time
+import zlib
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from metrics import srt_builder  # noqa: E402
+from utils.names import get_file_names, get_model_names  # noqa: E402
+
+MAX_LEN_LINE = 37
+MAX_LEN_BLOCK = MAX_LEN_LINE * 2
+MIN_DISPLAY_TIME = 1.0
+MAX_DISPLAY_TIME = 6.0
+WORDS = ["allora", "città", "perché", "governo", "anno", "Roma", "sì", "è", "stato", "detto", "che", "non", "Papa",
+         "Presidente", "dunque", "quindi", "l", "dell", "un", "abbiamo", "precipitevolissimevolmente", "RAI", "2021"]
+
+
+# --- Copia di readability.ipynb ---
+
+def legacy_format_srt_time(seconds: float) -> str:
+    total_ms = round(seconds * 1000)
+    hours = total_ms // 3_600_000
+    minutes = (total_ms % 3_600_000) // 60_000
+    secs = (total_ms % 60_000) // 1000
+    millis = total_ms % 1000
+    return f"{hours:02}:{minutes:02}:{secs:02},{millis:03}"
+
+
+def legacy_smart_line_break(text: str) -> str:
+    text = re.sub(r'\s+', ' ', text.strip())
+    if len(text) <= MAX_LEN_LINE:
+        return text
+    candidates = [m.start() for m in re.finditer(r'[ ,;:.!?]', text)]
+    split_pos = None
+    for pos in reversed(candidates):
+        if pos <= MAX_LEN_LINE:
+            split_pos = pos
+            break
+    if split_pos is None:
+        split_pos = MAX_LEN_LINE
+    first = text[:split_pos].strip()
+    second = text[split_pos:].strip()
+    return first + "\n" + second
+
+
+def legacy_merge_apostrophes(words):
+    merged = []
+    skip = False
+    for i, w in enumerate(words):
+        if skip:
+            skip = False
+            continue
+        if i + 1 < len(words) and words[i + 1]['word'].startswith("'"):
+            merged.append({'word': w['word'] + words[i + 1]['word'], 'start': w['start'], 'end': words[i + 1]['end']})
+            skip = True
+        else:
+            merged.append(w)
+    return merged
+
+
+def legacy_create_srt_from_json(data_json: list) -> str:
+    MIN_GAP = 0.04
+    raw_blocks = []
+    for seg in data_json:
+        words = legacy_merge_apostrophes(seg['words'])
+        i = 0
+        while i < len(words):
+            block_words = []
+            block_len = 0
+            start_time = words[i]['start']
+            while i < len(words):
+                w = words[i]['word']
+                proposed_len = block_len + (len(w) + (1 if block_len > 0 else 0))
+                if proposed_len > MAX_LEN_BLOCK and block_len > 0:
+                    break
+                block_words.append(words[i])
+                block_len = proposed_len
+                i += 1
+            end_time = block_words[-1]['end']
+            text = " ".join(w['word'] for w in block_words)
+            text = legacy_smart_line_break(text)
+            duration = end_time - start_time
+            if duration < MIN_DISPLAY_TIME:
+                end_time = start_time + MIN_DISPLAY_TIME
+            elif duration > MAX_DISPLAY_TIME:
+                end_time = start_time + MAX_DISPLAY_TIME
+            raw_blocks.append({'start': start_time, 'end': end_time, 'text': text})
+
+    merged_blocks = []
+    idx = 0
+    while idx < len(raw_blocks):
+        current = raw_blocks[idx]
+        start_time = current['start']
+        end_time = current['end']
+        merged_text = current['text'].replace("\n", " ")
+        idx += 1
+        while idx < len(raw_blocks):
+            next_block = raw_blocks[idx]
+            candidate_text = merged_text + " " + next_block['text'].replace("\n", " ")
+            candidate_text = re.sub(r'\s+', ' ', candidate_text).strip()
+            candidate_end_time = next_block['end']
+            total_duration = candidate_end_time - start_time
+            if (len(candidate_text) <= MAX_LEN_BLOCK) and (total_duration <= MAX_DISPLAY_TIME):
+                merged_text = candidate_text
+                end_time = candidate_end_time
+                idx += 1
+            else:
+                break
+        merged_text = re.sub(r'\s+', ' ', merged_text).strip()
+        merged_text = legacy_smart_line_break(merged_text)
+        if merged_blocks:
+            prev_end = merged_blocks[-1]['end']
+            if start_time - prev_end < MIN_GAP:
+                start_time = prev_end + MIN_GAP
+                if end_time < start_time:
+                    end_time = start_time + MIN_DISPLAY_TIME
+        merged_blocks.append({'start': start_time, 'end': end_time, 'text': merged_text})
+
+    output_lines = []
+    for num, b in enumerate(merged_blocks, start=1):
+        output_lines.append(f"{num}")
+        output_lines.append(f"{legacy_format_srt_time(b['start'])} --> {legacy_format_srt_time(b['end'])}")
+        output_lines.append(b['text'])
+        output_lines.append("")
+    return "\n".join(output_lines).strip()
+
+
+# --- Episodi sintetici ---
+
+def synthetic_json(minutes, seed):
+    """Segmenti in stile Whisper: parole con spazio iniziale, apostrofi separati, pause e punteggiatura."""
+    rng = random.Random(seed)
+    segments, t = [], 0.0
+    while t < minutes * 60:
+        words = []
+        for _ in range(rng.randint(0, 40)):
+            word = rng.choice(WORDS)
+            r = rng.random()
+            if r < 0.08:
+                word += rng.choice([".", "?", "!"])
+            elif r < 0.18:
+                word += rng.choice([",", ";", ":"])
+            elif r < 0.19:
+                word = ""
+            duration = rng.uniform(0.1, 0.6)
+            words.append({'word': " " + word, 'start': round(t, 3), 'end': round(t + duration, 3)})
+            if r > 0.97:  # apostrofo separato ("l" + "'anno")
+                words.append({'word': "'" + rng.choice(WORDS), 'start': round(t + duration, 3),
+                              'end': round(t + duration + 0.2, 3)})
+                t += 0.2
+            t += duration + (rng.uniform(0.5, 2.5) if rng.random() < 0.05 else rng.uniform(0.0, 0.15))
+        segments.append({'words': words})
+        t += rng.uniform(0.0, 1.0)
+    return segments
+
+
+def block_stats(starts, ends, texts):
+    duration = np.asarray(ends) - np.asarray(starts)
+    chars = np.array([len(text.replace("\n", " ")) for text in texts])
+    long_lines = sum(any(len(line) > MAX_LEN_LINE for line in text.split("\n")) for text in texts)
+    return {"blocks": len(texts), "cps": chars.sum() / max(duration.sum(), 1e-9), "msd": duration.mean(),
+            "ncs": chars.mean(), "short": float(np.mean(duration < MIN_DISPLAY_TIME - 1e-9)),
+            "long_lines": long_lines}
+
+
+def run(minutes, data_dir):
+    episodes = []
+    for model in get_model_names():
+        for m, file in enumerate(get_file_names()):
+            if data_dir:
+                json_path = f"{data_dir}/{model}/json/{file}.json"
+                golden_path = f"{data_dir}/{model}/improved_srt/{file}.srt"
+                if not (os.path.exists(json_path) and os.path.exists(golden_path)):
+                    print(f"[SKIP] {model}/{file}: JSON o improved_srt mancante")
+                    continue
+                with open(json_path, "r", encoding="utf-8") as f:
+                    prediction = json.load(f)
+                with open(golden_path, "r", encoding="utf-8") as f:
+                    golden = f.read()
+            else:
+                prediction = synthetic_json(minutes, seed=zlib.crc32(f"{model}/{file}".encode()))
+                golden = None
+            episodes.append((model, file, prediction, golden))
+    if not episodes:
+        print("[ERRORE] Nessun episodio da confrontare")
+        return
+
+    t_old = t_greedy = t_dp = 0.0
+    stats = {"notebook": [], "dp": []}
+    for model, file, prediction, golden in episodes:
+        t0 = time.perf_counter()
+        if golden is None:
+            golden = legacy_create_srt_from_json(prediction)
+        t_old += time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        greedy = srt_builder.create_srt_from_json(prediction)
+        t_greedy += time.perf_counter() - t0
+        assert greedy == golden, f"{model}/{file}: output diverso dal golden"
+
+        t0 = time.perf_counter()
+        dp = srt_builder.create_srt_from_json(prediction, mode="dp")
+        t_dp += time.perf_counter() - t0
+        # greedy coincide con il notebook: le statistiche si calcolano direttamente dai blocchi
+        timeline = srt_builder.WordTimeline.from_json(prediction)
+        stats["notebook"].append(block_stats(*srt_builder.greedy_blocks(timeline)))
+        stats["dp"].append(block_stats(*srt_builder.dp_blocks(timeline)))
+
+    n_words = sum(len(seg['words']) for _, _, prediction, _ in episodes for seg in prediction)
+    print(f"[INFO] {len(episodes)} episodi ({n_words} parole): greedy identico al notebook")
+    if not data_dir:
+        print(f"  notebook {t_old:.2f} s   greedy {t_greedy:.2f} s   (x{t_old / t_greedy:.1f})   dp {t_dp:.2f} s")
+    else:
+        print(f"  greedy {t_greedy:.2f} s   dp {t_dp:.2f} s")
+    for mode, rows in stats.items():
+        mean = {key: np.mean([row[key] for row in rows]) for key in rows[0]}
+        print(f"  {mode:<9} blocchi/episodio {mean['blocks']:7.1f}  CPS {mean['cps']:5.2f}  MSD {mean['msd']:5.2f} s  "
+              f"NCS {mean['ncs']:5.1f}  sotto {MIN_DISPLAY_TIME:.0f} s {mean['short']:6.1%}  "
+              f"righe > {MAX_LEN_LINE} {mean['long_lines']:5.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--minutes", type=float, default=60)
+    parser.add_argument("--data", default=None, help="cartella data con json/ e improved_srt/ per ogni modello")
+    args = parser.parse_args()
+    run(args.minutes, args.data)
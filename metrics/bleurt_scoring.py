@@ -0,0 +1,158 @@
+"""
+Punteggi BLEURT a batch con cache su disco.
+
+Le coppie (reference, ipotesi) vengono deduplicate, cercate nella cache (SQLite, chiave: sha1
+di modello, reference e ipotesi) e solo quelle mancanti passano dal modello. Le coppie da
+calcolare sono tokenizzate una volta, ordinate per lunghezza e raggruppate in batch dinamici
+limitati da `max_tokens` (righe x lunghezza massima del batch), così il padding resta minimo.
+Ogni batch viene salvato in cache appena calcolato: rivalutare un nuovo allineamento o una
+variante del reviewer costa solo i segmenti effettivamente cambiati.
+"""
+import hashlib
+import os
+import sqlite3
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+BLEURT_MODEL_NAME = "lucadiliello/BLEURT-20-D12"
+BLEURT_CACHE_PATH = "../data/cache/bleurt.sqlite"
+
+
+def pair_key(model_name: str, reference: str, hypothesis: str) -> str:
+    return hashlib.sha1("\0".join((model_name, reference, hypothesis)).encode("utf-8")).hexdigest()
+
+
+class ScoreCache:
+    """Cache persistente chiave -> punteggio."""
+
+    def __init__(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS scores (key TEXT PRIMARY KEY, score REAL NOT NULL)")
+        self.connection.commit()
+
+    def get_many(self, keys: Sequence[str]) -> Dict[str, float]:
+        found = {}
+        keys = list(keys)
+        for i in range(0, len(keys), 500):  # limite di parametri per query di SQLite
+            chunk = keys[i:i + 500]
+            query = f"SELECT key, score FROM scores WHERE key IN ({','.join('?' * len(chunk))})"
+            found.update(self.connection.execute(query, chunk).fetchall())
+        return found
+
+    def put_many(self, items: Dict[str, float]):
+        self.connection.executemany("INSERT OR REPLACE INTO scores (key, score) VALUES (?, ?)", items.items())
+        self.connection.commit()
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM scores").fetchone()[0]
+
+    def close(self):
+        self.connection.close()
+
+
+def length_batches(lengths: Sequence[int], max_tokens: int, max_batch_size: int) -> List[List[int]]:
+    """
+    Indici raggruppati in batch di lunghezza simile: ordinati per lunghezza decrescente, un batch
+    si chiude quando (righe x lunghezza massima) supererebbe `max_tokens` o le righe `max_batch_size`.
+    """
+    order = np.argsort(-np.asarray(lengths), kind="stable")
+    batches, current, current_max = [], [], 0
+    for idx in order.tolist():
+        longest = max(current_max, lengths[idx])
+        if current and (len(current) >= max_batch_size or (len(current) + 1) * longest > max_tokens):
+            batches.append(current)
+            current, longest = [], lengths[idx]
+        current.append(idx)
+        current_max = longest
+    if current:
+        batches.append(current)
+    return batches
+
+
+class BleurtScorer:
+    """
+    Args:
+        model_name: checkpoint BLEURT (bleurt-pytorch).
+        cache_path: file SQLite della cache; None per non usare la cache.
+        device: "cuda" o "cpu" (default: cuda se disponibile).
+        num_threads: thread di torch su CPU (default: quelli già impostati).
+        max_tokens: token per batch (righe x lunghezza massima, padding incluso).
+        max_batch_size: righe massime per batch.
+        model, tokenizer: modello e tokenizer già caricati (altrimenti caricati al primo uso).
+    """
+
+    def __init__(self, model_name: str = BLEURT_MODEL_NAME, cache_path: Optional[str] = BLEURT_CACHE_PATH,
+                 device: Optional[str] = None, num_threads: Optional[int] = None, max_tokens: int = 16384,
+                 max_batch_size: int = 64, model=None, tokenizer=None):
+        self.model_name = model_name
+        self.cache = ScoreCache(cache_path) if cache_path else None
+        self.device = device
+        self.num_threads = num_threads
+        self.max_tokens = max_tokens
+        self.max_batch_size = max_batch_size
+        self.model = model
+        self.tokenizer = tokenizer
+
+    def _load(self):
+        import torch
+
+        if self.device is None:
+            self.device = "cuda" if torch.cuda.is_available() else "cpu"
+        if self.device == "cpu" and self.num_threads:
+            torch.set_num_threads(self.num_threads)
+        if self.model is None or self.tokenizer is None:
+            from bleurt_pytorch import BleurtForSequenceClassification, BleurtTokenizer
+
+            self.model = BleurtForSequenceClassification.from_pretrained(self.model_name)
+            self.tokenizer = BleurtTokenizer.from_pretrained(self.model_name)
+        self.model = self.model.to(self.device).eval()
+
+    def _compute(self, pairs: List[Tuple[str, str]]) -> Dict[int, float]:
+        """Punteggi delle coppie (tutte da calcolare), salvati in cache batch per batch."""
+        import torch
+
+        if self.model is None or self.tokenizer is None or self.device is None:
+            self._load()
+        # Una sola tokenizzazione: le lunghezze decidono i batch, il padding si fa per batch
+        encodings = [self.tokenizer(reference, hypothesis, truncation=True) for reference, hypothesis in pairs]
+        lengths = [len(encoding["input_ids"]) for encoding in encodings]
+
+        scores = {}
+        with torch.inference_mode():
+            for batch in length_batches(lengths, self.max_tokens, self.max_batch_size):
+                inputs = self.tokenizer.pad([encodings[i] for i in batch], return_tensors="pt").to(self.device)
+                logits = self.model(**inputs).logits.reshape(-1).float().cpu().tolist()
+                batch_scores = dict(zip(batch, logits))
+                scores.update(batch_scores)
+                if self.cache is not None:
+                    self.cache.put_many({pair_key(self.model_name, *pairs[i]): s for i, s in batch_scores.items()})
+        return scores
+
+    def score(self, pairs: Sequence[Tuple[str, str]]) -> List[float]:
+        """Punteggio BLEURT di ogni coppia (reference, ipotesi), nello stesso ordine."""
+        unique = list(dict.fromkeys(pairs))
+        keys = [pair_key(self.model_name, reference, hypothesis) for reference, hypothesis in unique]
+        cached = self.cache.get_many(keys) if self.cache is not None else {}
+
+        missing = [i for i, key in enumerate(keys) if key not in cached]
+        print(f"[INFO] BLEURT: {len(pairs)} coppie, {len(unique)} distinte, "
+              f"{len(unique) - len(missing)} in cache, {len(missing)} da calcolare")
+        by_pair = {unique[i]: cached[key] for i, key in enumerate(keys) if key in cached}
+        if missing:
+            computed = self._compute([unique[i] for i in missing])
+            by_pair.update((unique[missing[j]], score) for j, score in computed.items())
+        return [by_pair[pair] for pair in pairs]
+
+    def score_segments(self, references: Sequence[str], hypotheses: Sequence[str]) -> List[Tuple[str, str, float]]:
+        """
+        Come `evaluate_with_bleurt` di bleurt.ipynb: una tupla (reference, ipotesi, punteggio)
+        per ogni segmento di reference, con l'ipotesi allineata di pari indice.
+        """
+        if len(hypotheses) < len(references):
+            raise ValueError(f"Ipotesi allineate insufficienti: {len(hypotheses)} per {len(references)} segmenti")
+        pairs = list(zip(references, hypotheses))
+        return [(reference, hypothesis, score) for (reference, hypothesis), score in zip(pairs, self.score(pairs))]
@@ -0,0 +1,217 @@
+"""
+Intervalli di confidenza bootstrap e test appaiati tra modelli, con ricampionamento vettoriale.
+
+Per il WER si tengono i conteggi S, D, I, N di ogni unità (episodio o finestra) e la statistica
+è quella di corpus, sum(S + D + I) / sum(N), non la media dei WER per episodio. Le metriche di
+cui esiste solo il valore per episodio (SubER, BLEURT, EER dai CSV in `raw_results`) usano la
+stessa formula con denominatore 1, cioè la media.
+
+Tutti i ricampionamenti di un blocco sono una sola matrice di indici (ricampionamenti x unità),
+trasformata con `np.bincount` in una matrice di pesi W: le statistiche di tutti i modelli sono
+allora `W @ numeratori / W @ denominatori`, un prodotto matriciale. Tutti i modelli usano gli
+stessi indici, quindi le differenze tra modelli sono appaiate. Con `strata` (ad esempio
+Programma o Tipologia) ogni ricampionamento mantiene il numero di unità di ogni strato.
+
+Le finestre di uno stesso episodio non sono indipendenti: con conteggi per finestra si
+ricampionano di default gli episodi (`cluster="file"`), sommando prima i conteggi.
+"""
+from typing import Dict, Iterator, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from metrics import edit_distance
+from metrics.metrics_utils import normalize_text
+
+DEFAULT_RESAMPLES = 10_000
+# Celle massime della matrice indici/pesi per blocco di ricampionamenti (memoria limitata)
+MAX_BLOCK_CELLS = 4_000_000
+TIPOLOGIE = {"MEZZORAINPIU": "TalkShow", "PORTAPORTA": "TalkShow", "REPORT": "Inchiesta",
+             "PRESADIRETTA": "Inchiesta", "ULISSE": "Divulgazione"}
+COUNT_COLUMNS = ["S", "D", "I", "N"]
+
+
+def program_metadata(file: str) -> Dict[str, str]:
+    """Programma, Data e Tipologia dal nome del file, come nei CSV di `raw_results`."""
+    programma, data = file[:-9], file[-8:]
+    return {"Programma": programma, "Data": data, "Tipologia": TIPOLOGIE.get(programma, "altro")}
+
+
+def episode_error_counts(files: Sequence[str], models: Sequence[str], data_dir: str = "../data") -> pd.DataFrame:
+    """
+    Conteggi S, D, I, N per (episodio, modello) sui testi normalizzati, come il WER di
+    wer_suber.ipynb. Una riga per coppia con file, Programma, Data, Tipologia, model.
+    """
+    vocabulary = edit_distance.Vocabulary()
+    rows = []
+    for file in files:
+        with open(f"{data_dir}/text/{file}.txt", "r", encoding="utf-8") as f:
+            reference = normalize_text(f.read()).split()
+        for model in models:
+            with open(f"{data_dir}/{model}/text/{file}.txt", "r", encoding="utf-8") as f:
+                hypothesis = normalize_text(f.read()).split()
+            s, d, i = edit_distance.edit_counts(reference, hypothesis, vocabulary=vocabulary)
+            rows.append({"file": file, **program_metadata(file), "model": model,
+                         "S": s, "D": d, "I": i, "N": len(reference)})
+    return pd.DataFrame(rows)
+
+
+def window_error_counts(alignment, file: str, model: str, window_size: float, hop_size: float,
+                        min_ref_words: int = 10) -> pd.DataFrame:
+    """
+    Conteggi S, D, I, N delle finestre valide di un `sliding_wer.EpisodeAlignment`, nello
+    stesso formato di `episode_error_counts` con le colonne aggiuntive start ed end.
+    """
+    from metrics.sliding_wer import window_grid
+
+    starts, ends = window_grid(alignment.max_time, window_size, hop_size)
+    counts = alignment.counts(starts, ends)
+    valid = (counts[:, 3] > 0) & (counts[:, 3] >= min_ref_words)
+    frame = pd.DataFrame({"file": file, **program_metadata(file), "model": model,
+                          "start": starts[valid], "end": ends[valid]})
+    frame[COUNT_COLUMNS] = counts[valid, :4]
+    return frame
+
+
+def count_matrices(counts: pd.DataFrame, models: Sequence[str], cluster: str = "file"
+                   ) -> Tuple[np.ndarray, np.ndarray, pd.DataFrame]:
+    """
+    Numeratori (S + D + I) e denominatori (N) come matrici (unità, modelli), con i conteggi
+    sommati per `cluster`. Ritorna anche i metadati di ogni unità (Programma, Tipologia...).
+    Le unità senza conteggi per tutti i modelli vengono scartate, così il confronto resta appaiato.
+    """
+    totals = counts.groupby([cluster, "model"], sort=True)[COUNT_COLUMNS].sum()
+    wide = totals.unstack("model").dropna()
+    num = (wide["S"] + wide["D"] + wide["I"])[list(models)].to_numpy(dtype=np.float64)
+    den = wide["N"][list(models)].to_numpy(dtype=np.float64)
+    meta_columns = [c for c in ("Programma", "Data", "Tipologia") if c in counts.columns and c != cluster]
+    meta = counts.groupby(cluster, sort=True)[meta_columns].first().loc[wide.index].reset_index()
+    return num, den, meta
+
+
+def score_matrix(results: pd.DataFrame, models: Sequence[str]) -> np.ndarray:
+    """Valori per episodio (righe) e modello (colonne) da un CSV di `raw_results`."""
+    return results[list(models)].to_numpy(dtype=np.float64)
+
+
+def resample_weights(n_units: int, n_resamples: int = DEFAULT_RESAMPLES, seed: int = 0,
+                     strata: Optional[Sequence] = None, max_block_cells: int = MAX_BLOCK_CELLS) -> Iterator[np.ndarray]:
+    """
+    Matrici di pesi (ricampionamenti, unità): quante volte ogni unità compare in ogni
+    ricampionamento. Ogni blocco è estratto come un'unica matrice di indici; con `strata` gli
+    indici di ogni strato sono estratti solo tra le sue unità.
+    """
+    rng = np.random.default_rng(seed)
+    if strata is None:
+        groups = [np.arange(n_units)]
+    else:
+        codes = pd.factorize(np.asarray(strata))[0]
+        groups = [np.flatnonzero(codes == code) for code in range(codes.max() + 1)]
+    block = max(1, min(n_resamples, max_block_cells // max(n_units, 1)))
+    for first in range(0, n_resamples, block):
+        size = min(block, n_resamples - first)
+        indices = np.concatenate([group[rng.integers(0, len(group), size=(size, len(group)))] for group in groups],
+                                 axis=1)
+        rows = np.arange(size, dtype=np.int64)[:, None] * n_units
+        yield np.bincount((indices + rows).ravel(), minlength=size * n_units).reshape(size, n_units).astype(np.float64)
+
+
+def bootstrap_samples(num: np.ndarray, den: Optional[np.ndarray] = None, n_resamples: int = DEFAULT_RESAMPLES,
+                      seed: int = 0, strata: Optional[Sequence] = None) -> np.ndarray:
+    """
+    Statistica sum(num) / sum(den) su ogni ricampionamento, per tutte le colonne insieme:
+    array (ricampionamenti, modelli). Senza `den` è la media.
+    """
+    num = np.asarray(num, dtype=np.float64).reshape(len(num), -1)
+    den = np.ones_like(num) if den is None else np.asarray(den, dtype=np.float64).reshape(num.shape)
+    out = []
+    for weights in resample_weights(len(num), n_resamples, seed, strata):
+        total = weights @ den
+        out.append(np.divide(weights @ num, total, out=np.full_like(total, np.nan), where=total > 0))
+    return np.concatenate(out)
+
+
+def bootstrap_correlation_samples(x: np.ndarray, y: np.ndarray, n_resamples: int = DEFAULT_RESAMPLES,
+                                  seed: int = 0, strata: Optional[Sequence] = None) -> np.ndarray:
+    """Correlazione di Pearson tra le colonne corrispondenti di x e y su ogni ricampionamento."""
+    x = np.asarray(x, dtype=np.float64).reshape(len(x), -1)
+    y = np.asarray(y, dtype=np.float64).reshape(x.shape)
+    # Centrare prima riduce la cancellazione numerica nelle somme dei quadrati
+    x = x - x.mean(axis=0)
+    y = y - y.mean(axis=0)
+    moments = np.concatenate([x, y, x * x, y * y, x * y], axis=1)
+    k = x.shape[1]
+    out = []
+    for weights in resample_weights(len(x), n_resamples, seed, strata):
+        sx, sy, sxx, syy, sxy = np.split(weights @ moments, 5, axis=1)
+        n = weights.sum(axis=1, keepdims=True)
+        cov = n * sxy - sx * sy
+        var = (n * sxx - sx * sx) * (n * syy - sy * sy)
+        out.append(np.divide(cov, np.sqrt(np.clip(var, 0, None)), out=np.full((len(n), k), np.nan), where=var > 0))
+    return np.concatenate(out)
+
+
+def _point_estimate(num, den):
+    num = np.asarray(num, dtype=np.float64).reshape(len(num), -1)
+    den = np.ones_like(num) if den is None else np.asarray(den, dtype=np.float64).reshape(num.shape)
+    return num.sum(axis=0) / den.sum(axis=0)
+
+
+def confidence_intervals(num: np.ndarray, den: Optional[np.ndarray], models: Sequence[str],
+                         n_resamples: int = DEFAULT_RESAMPLES, alpha: float = 0.05, seed: int = 0,
+                         strata: Optional[Sequence] = None, samples: Optional[np.ndarray] = None) -> pd.DataFrame:
+    """
+    Stima puntuale, errore standard e intervallo percentile (1 - alpha) per ogni modello.
+    `samples`: ricampionamenti già calcolati con `bootstrap_samples` (per riusarli nei test).
+    """
+    if samples is None:
+        samples = bootstrap_samples(num, den, n_resamples, seed, strata)
+    low, high = np.nanquantile(samples, [alpha / 2, 1 - alpha / 2], axis=0)
+    return pd.DataFrame({"model": list(models), "estimate": _point_estimate(num, den),
+                         "std": np.nanstd(samples, axis=0, ddof=1), "low": low, "high": high})
+
+
+def paired_tests(num: np.ndarray, den: Optional[np.ndarray], models: Sequence[str],
+                 n_resamples: int = DEFAULT_RESAMPLES, alpha: float = 0.05, seed: int = 0,
+                 strata: Optional[Sequence] = None, samples: Optional[np.ndarray] = None) -> pd.DataFrame:
+    """
+    Test bootstrap appaiato per ogni coppia di modelli: differenza (a - b), intervallo
+    percentile della differenza e p-value bilaterale 2 * min(P(d <= 0), P(d >= 0)).
+    """
+    if samples is None:
+        samples = bootstrap_samples(num, den, n_resamples, seed, strata)
+    estimate = _point_estimate(num, den)
+    a, b = np.triu_indices(len(models), k=1)
+    deltas = samples[:, a] - samples[:, b]
+    low, high = np.nanquantile(deltas, [alpha / 2, 1 - alpha / 2], axis=0)
+    p_value = np.minimum(1.0, 2 * np.minimum(np.mean(deltas <= 0, axis=0), np.mean(deltas >= 0, axis=0)))
+    return pd.DataFrame({"model_a": [models[i] for i in a], "model_b": [models[j] for j in b],
+                         "delta": estimate[a] - estimate[b], "low": low, "high": high, "p_value": p_value,
+                         "significant": p_value < alpha})
+
+
+def correlation_intervals(x: np.ndarray, y: np.ndarray, models: Sequence[str], n_resamples: int = DEFAULT_RESAMPLES,
+                          alpha: float = 0.05, seed: int = 0, strata: Optional[Sequence] = None) -> pd.DataFrame:
+    """Correlazione di Pearson per modello con intervallo percentile bootstrap."""
+    samples = bootstrap_correlation_samples(x, y, n_resamples, seed, strata)
+    x = np.asarray(x, dtype=np.float64).reshape(len(x), -1)
+    y = np.asarray(y, dtype=np.float64).reshape(x.shape)
+    estimate = [np.corrcoef(x[:, k], y[:, k])[0, 1] for k in range(x.shape[1])]
+    low, high = np.nanquantile(samples, [alpha / 2, 1 - alpha / 2], axis=0)
+    return pd.DataFrame({"model": list(models), "corr": estimate, "low": low, "high": high})
+
+
+def grouped(function, num: np.ndarray, den: Optional[np.ndarray], labels: Sequence, models: Sequence[str],
+            **kwargs) -> pd.DataFrame:
+    """
+    Applica `confidence_intervals` o `paired_tests` separatamente a ogni gruppo di unità
+    (ad esempio per Tipologia) e concatena i risultati con la colonna `group`.
+    """
+    labels = np.asarray(labels)
+    frames = []
+    for label in pd.unique(labels):
+        mask = labels == label
+        frame = function(num[mask], None if den is None else den[mask], models, **kwargs)
+        frame.insert(0, "group", label)
+        frames.append(frame)
+    return pd.concat(frames, ignore_index=True)
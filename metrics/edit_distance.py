@@ -0,0 +1,196 @@
+"""
+Distanza di edit a livello di parola, condivisa da WER, WER a finestre scorrevoli e
+allineamento ipotesi/reference per BLEURT.
+
+Le parole vengono codificate in interi con un `Vocabulary` condiviso, così ogni confronto
+avviene tra array di ID. Senza limite di banda l'allineamento usa il kernel bit-parallel
+(Myers/Hyyrö) di rapidfuzz, lo stesso usato da jiwer; con `band` si usa un kernel NumPy che
+calcola la matrice di programmazione dinamica per righe (il minimo lungo la riga è risolto
+con `np.minimum.accumulate`) limitandola a una banda attorno alla diagonale.
+"""
+from collections import Counter
+from typing import Iterable, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+from rapidfuzz.distance import Levenshtein
+
+# Codici delle operazioni di edit
+EQUAL, SUBSTITUTION, DELETION, INSERTION = 0, 1, 2, 3
+
+_OPCODE_TAGS = {"equal": EQUAL, "replace": SUBSTITUTION, "delete": DELETION, "insert": INSERTION}
+_INF = np.int64(1) << 40
+
+
+class Vocabulary:
+    """Mappa parola -> ID intero, condivisa tra reference e ipotesi (e tra più ipotesi)."""
+
+    def __init__(self):
+        self.ids = {}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def encode(self, words: Sequence[str]) -> np.ndarray:
+        ids = self.ids
+        return np.fromiter((ids.setdefault(w, len(ids)) for w in words), dtype=np.int64, count=len(words))
+
+
+class Alignment(NamedTuple):
+    """
+    Allineamento completo (match compresi) tra reference e ipotesi.
+    Per ogni operazione: codice, posizione nella reference e posizione nell'ipotesi. Per le
+    inserzioni `ref_pos` è l'indice della parola di reference successiva, per le cancellazioni
+    `hyp_pos` è l'indice della parola di ipotesi successiva.
+    """
+    ops: np.ndarray
+    ref_pos: np.ndarray
+    hyp_pos: np.ndarray
+
+    def counts(self) -> Tuple[int, int, int]:
+        """Restituisce (S, D, I)."""
+        n = np.bincount(self.ops, minlength=4)
+        return int(n[SUBSTITUTION]), int(n[DELETION]), int(n[INSERTION])
+
+
+def _is_encoded(tokens) -> bool:
+    return isinstance(tokens, np.ndarray) and np.issubdtype(tokens.dtype, np.integer)
+
+
+def _encode_pair(ref, hyp, vocabulary: Optional[Vocabulary] = None):
+    if _is_encoded(ref) and _is_encoded(hyp):
+        return ref, hyp
+    vocabulary = vocabulary or Vocabulary()
+    return vocabulary.encode(ref), vocabulary.encode(hyp)
+
+
+def _opcodes_to_alignment(opcodes) -> Alignment:
+    ops, ref_pos, hyp_pos = [], [], []
+    for tag, i1, i2, j1, j2 in opcodes:
+        n = max(i2 - i1, j2 - j1)
+        ops.append(np.full(n, _OPCODE_TAGS[tag], dtype=np.uint8))
+        ref_pos.append(np.arange(i1, i2) if i2 > i1 else np.full(n, i1))
+        hyp_pos.append(np.arange(j1, j2) if j2 > j1 else np.full(n, j1))
+    if not ops:
+        empty = np.zeros(0, dtype=np.int64)
+        return Alignment(np.zeros(0, dtype=np.uint8), empty, empty)
+    return Alignment(np.concatenate(ops), np.concatenate(ref_pos).astype(np.int64),
+                     np.concatenate(hyp_pos).astype(np.int64))
+
+
+def _row_slice(row: np.ndarray, row_lo: int, lo: int, hi: int) -> np.ndarray:
+    """Valori di `row` (che copre le colonne row_lo..) per le colonne lo..hi, _INF fuori."""
+    out = np.full(hi - lo + 1, _INF, dtype=np.int64)
+    a = max(lo, row_lo)
+    b = min(hi, row_lo + len(row) - 1)
+    if a <= b:
+        out[a - lo:b - lo + 1] = row[a - row_lo:b - row_lo + 1]
+    return out
+
+
+def _banded_alignment(ref: np.ndarray, hyp: np.ndarray, band: int) -> Alignment:
+    """
+    Levenshtein su array di ID limitato a `band` colonne attorno alla diagonale (scalata su
+    h/r). Ogni riga è calcolata in blocco: prima il minimo tra cancellazione e
+    sostituzione/match, poi le inserzioni lungo la riga con un minimo cumulativo.
+    """
+    r, h = len(ref), len(hyp)
+    # La banda deve permettere di collegare righe consecutive anche con pendenza h/r > 1
+    band = max(int(band), int(np.ceil(h / max(r, 1))))
+    slope = h / r if r else 0.0
+
+    bounds = []
+    rows = []
+    for i in range(r + 1):
+        center = int(round(i * slope))
+        lo = 0 if i == 0 else max(0, center - band)
+        hi = h if i == r else min(h, center + band)
+        cols = np.arange(lo, hi + 1, dtype=np.int64)
+        if i == 0:
+            cur = cols.copy()
+        else:
+            prev, prev_lo = rows[-1], bounds[-1][0]
+            up = _row_slice(prev, prev_lo, lo, hi) + 1
+            diag = _row_slice(prev, prev_lo, lo - 1, hi - 1)
+            cost = np.ones(hi - lo + 1, dtype=np.int64)
+            if lo == 0:
+                cost[1:] = hyp[0:hi] != ref[i - 1]
+            else:
+                cost[:] = hyp[lo - 1:hi] != ref[i - 1]
+            t = np.minimum(up, diag + cost)
+            cur = np.minimum.accumulate(t - cols) + cols
+        rows.append(cur)
+        bounds.append((lo, hi))
+
+    def value(i, j):
+        lo, hi = bounds[i]
+        return rows[i][j - lo] if lo <= j <= hi else _INF
+
+    ops, ref_pos, hyp_pos = [], [], []
+    i, j = r, h
+    while i > 0 or j > 0:
+        v = value(i, j)
+        if i > 0 and j > 0:
+            cost = int(ref[i - 1] != hyp[j - 1])
+            if value(i - 1, j - 1) + cost == v:
+                ops.append(SUBSTITUTION if cost else EQUAL)
+                i -= 1
+                j -= 1
+                ref_pos.append(i)
+                hyp_pos.append(j)
+                continue
+        if i > 0 and value(i - 1, j) + 1 == v:
+            ops.append(DELETION)
+            i -= 1
+            ref_pos.append(i)
+            hyp_pos.append(j)
+        else:
+            ops.append(INSERTION)
+            j -= 1
+            ref_pos.append(i)
+            hyp_pos.append(j)
+
+    return Alignment(np.array(ops[::-1], dtype=np.uint8), np.array(ref_pos[::-1], dtype=np.int64),
+                     np.array(hyp_pos[::-1], dtype=np.int64))
+
+
+def align(ref, hyp, band: Optional[int] = None, vocabulary: Optional[Vocabulary] = None) -> Alignment:
+    """
+    Allinea reference e ipotesi (liste di parole o array di ID) e restituisce tutte le
+    operazioni, match compresi. `band` limita la ricerca a una banda attorno alla diagonale.
+    """
+    ref, hyp = _encode_pair(ref, hyp, vocabulary)
+    if band is not None:
+        return _banded_alignment(ref, hyp, band)
+    return _opcodes_to_alignment(Levenshtein.opcodes(ref.tolist(), hyp.tolist()).as_list())
+
+
+def edit_counts(ref, hyp, band: Optional[int] = None, vocabulary: Optional[Vocabulary] = None) -> Tuple[int, int, int]:
+    """Restituisce (S, D, I) per trasformare la reference nell'ipotesi."""
+    ref, hyp = _encode_pair(ref, hyp, vocabulary)
+    if band is not None:
+        return _banded_alignment(ref, hyp, band).counts()
+    tags = Counter(tag for tag, _, _ in Levenshtein.editops(ref.tolist(), hyp.tolist()).as_list())
+    return tags["replace"], tags["delete"], tags["insert"]
+
+
+def batch_edit_counts(pairs: Iterable[Tuple[Sequence, Sequence]], band: Optional[int] = None,
+                      vocabulary: Optional[Vocabulary] = None) -> np.ndarray:
+    """
+    Calcola S/D/I per molte coppie (reference, ipotesi), ad esempio tutte le finestre di un
+    episodio, con un unico vocabolario. Restituisce un array (n, 4) con colonne S, D, I, N.
+    """
+    vocabulary = vocabulary or Vocabulary()
+    out = []
+    for ref, hyp in pairs:
+        ref, hyp = _encode_pair(ref, hyp, vocabulary)
+        out.append((*edit_counts(ref, hyp, band=band), len(ref)))
+    return np.array(out, dtype=np.int64).reshape(-1, 4)
+
+
+def wer(reference: str, hypothesis: str) -> float:
+    """WER tra due testi già normalizzati, con parole separate da spazi."""
+    ref_words = reference.split()
+    if not ref_words:
+        raise ValueError("La reference non può essere vuota")
+    s, d, i = edit_counts(ref_words, hypothesis.split())
+    return (s + d + i) / len(ref_words)
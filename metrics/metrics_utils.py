@@ -1,8 +1,67 @@
 import re
 import unicodedata
+from functools import lru_cache
+from typing import Iterable, List, Optional
 from num2words import num2words
 import roman
 
+_DC = re.compile(r'\b(d\.c\.)\b', re.IGNORECASE)
+_AC = re.compile(r'\b(a\.c\.)\b', re.IGNORECASE)
+_ARABIC_NUMBER = re.compile(r'\b\d+(?:\.\d{3})*\b')
+_ROMAN_NUMBER = re.compile(r'\b[IVXLCDM]+\b', re.IGNORECASE)
+_SQUARE_BRACKETS = re.compile(r'\[.*?\]')
+_ROUND_BRACKETS = re.compile(r'\(.*?\)')
+_KEEP_CHAR = re.compile(r'[a-z\s]')
+
+_ACCENTS = {
+    'à': 'a', 'è': 'e', 'é': 'e',
+    'ì': 'i', 'ò': 'o', 'ù': 'u'
+}
+
+
+@lru_cache(maxsize=65536)
+def _number_to_words(number: int) -> str:
+    return num2words(number, lang='it')
+
+
+@lru_cache(maxsize=4096)
+def _roman_to_words(romano: str) -> Optional[str]:
+    """Numero romano (maiuscolo) in lettere, None se non è un numero romano valido."""
+    try:
+        return _number_to_words(roman.fromRoman(romano))
+    except roman.InvalidRomanNumeralError:
+        return None
+
+
+def _arabic_to_words(match) -> str:
+    return _number_to_words(int(match.group().replace('.', '')))
+
+
+def _roman_match_to_words(match) -> str:
+    words = _roman_to_words(match.group().upper())
+    return match.group() if words is None else words
+
+
+class _CategoryTable(dict):
+    """Tabella per str.translate: simboli/punteggiatura/marcatori (categorie M, S, P) -> spazio."""
+
+    def __missing__(self, codepoint):
+        value = ' ' if unicodedata.category(chr(codepoint)).startswith(('M', 'S', 'P')) else codepoint
+        self[codepoint] = value
+        return value
+
+
+class _FoldTable(dict):
+    """Tabella per str.translate: vocali accentate -> vocali semplici, tutto il resto tranne a-z e spazi -> spazio."""
+
+    def __missing__(self, codepoint):
+        ch = chr(codepoint)
+        ch = _ACCENTS.get(ch, ch)
+        value = ord(ch) if _KEEP_CHAR.fullmatch(ch) else ' '
+        self[codepoint] = value
+        return value
+
+
 def process_numbers(text: str) -> str:
     """
     Converte:
@@ -11,67 +70,74 @@ def process_numbers(text: str) -> str:
     3. Numeri romani maiuscoli/minuscoli -> lettere italiane
     """
     # Espansione a.C. / d.C. (case-insensitive)
-    text = re.sub(r'\b(d\.c\.)\b', 'dopo Cristo', text, flags=re.IGNORECASE)
-    text = re.sub(r'\b(a\.c\.)\b', 'avanti Cristo', text, flags=re.IGNORECASE)
+    text = _DC.sub('dopo Cristo', text)
+    text = _AC.sub('avanti Cristo', text)
 
     # Numeri arabi
-    def arabic_to_words(match):
-        numero_str = match.group()
-        numero_int = int(numero_str.replace('.', ''))
-        return num2words(numero_int, lang='it')
-
-    text = re.sub(r'\b\d+(?:\.\d{3})*\b', arabic_to_words, text)
+    text = _ARABIC_NUMBER.sub(_arabic_to_words, text)
 
     # Numeri romani
-    def roman_to_words(match):
-        romano = match.group().upper()
-        try:
-            numero_int = roman.fromRoman(romano)
-            return num2words(numero_int, lang='it')
-        except roman.InvalidRomanNumeralError:
-            return match.group()
-
-    text = re.sub(r'\b[IVXLCDM]+\b', roman_to_words, text, flags=re.IGNORECASE)
+    text = _ROMAN_NUMBER.sub(_roman_match_to_words, text)
 
     return text
 
 
-def normalize_text(text: str) -> str:
-    # NFKC normalizzazione
-    text = unicodedata.normalize("NFKC", text)
+class ItalianNormalizer:
+    """
+    Normalizzatore del testo italiano per WER e metriche a livello di parola.
+    Pattern compilati una volta, tabelle di `str.translate` costruite pigramente per carattere
+    e conversioni dei numeri memorizzate; l'output è identico alla versione a passi separati.
+    `cache_size` è la dimensione della cache per parola usata da `normalize_tokens`.
+    """
 
-    # 1. Rimuovi frasi tra parentesi quadre
-    text = re.sub(r'\[.*?\]', '', text)
-    # 2. Rimuovi frasi tra parentesi tonde
-    text = re.sub(r'\(.*?\)', '', text)
+    def __init__(self, cache_size: int = 131072):
+        self._category_table = _CategoryTable()
+        self._fold_table = _FoldTable()
+        self.normalize_token = lru_cache(maxsize=cache_size)(self.normalize)
 
-    # 3. Sostituisci simboli/punteggiatura/marcatori con spazio
-    text = ''.join(
-        ch if not unicodedata.category(ch).startswith(('M', 'S', 'P')) else ' '
-        for ch in text
-    )
+    def normalize(self, text: str) -> str:
+        # NFKC normalizzazione
+        text = unicodedata.normalize("NFKC", text)
 
-    # 4. Converte numeri in lettere (arabi, romani, date speciali)
-    text = process_numbers(text)
+        # 1-2. Rimuovi frasi tra parentesi quadre e tonde
+        if '[' in text:
+            text = _SQUARE_BRACKETS.sub('', text)
+        if '(' in text:
+            text = _ROUND_BRACKETS.sub('', text)
 
-    # 5. Minuscole
-    text = text.lower()
+        # 3. Sostituisci simboli/punteggiatura/marcatori con spazio
+        text = text.translate(self._category_table)
 
-    # 6. Sostituisci vocali accentate italiane
-    replacements = {
-        'à': 'a', 'è': 'e', 'é': 'e',
-        'ì': 'i', 'ò': 'o', 'ù': 'u'
-    }
-    for accented, plain in replacements.items():
-        text = text.replace(accented, plain)
+        # 4. Converte numeri in lettere. Dopo il passo 3 non restano punti, quindi le espansioni
+        # di a.C./d.C. non possono più applicarsi e restano solo numeri arabi e romani
+        text = _ARABIC_NUMBER.sub(_arabic_to_words, text)
+        text = _ROMAN_NUMBER.sub(_roman_match_to_words, text)
 
-    # 7. Mantieni solo lettere italiane e spazi
-    text = re.sub(r'[^a-z\s]', ' ', text)
+        # 5. Minuscole
+        text = text.lower()
 
-    # 8. Spazio singolo
-    text = re.sub(r'\s+', ' ', text).strip()
+        # 6-7. Vocali accentate italiane -> semplici, mantieni solo lettere e spazi
+        text = text.translate(self._fold_table)
 
-    return text
+        # 8. Spazio singolo
+        return ' '.join(text.split())
+
+    __call__ = normalize
+
+    def normalize_tokens(self, tokens: Iterable[str]) -> List[str]:
+        """Normalizza una lista di parole; le parole ripetute vengono normalizzate una sola volta."""
+        return [self.normalize_token(token) for token in tokens]
+
+
+_normalizer = ItalianNormalizer()
+
+
+def normalize_text(text: str) -> str:
+    return _normalizer.normalize(text)
+
+
+def normalize_tokens(tokens: Iterable[str]) -> List[str]:
+    return _normalizer.normalize_tokens(tokens)
 
 
 def normalize_text_dummy(text: str) -> list:
@@ -0,0 +1,103 @@
+"""
+Risegmentazione dell'ipotesi sulla segmentazione della reference tramite allineamento di
+Levenshtein (come `levenshtein_align_hypothesis_to_reference` di bleurt.ipynb).
+
+Le parole sono codificate in ID interi con un `Vocabulary` condiviso (nessuna mappatura su
+caratteri Unicode, quindi nessun limite sul numero di parole distinte); ogni forma distinta
+viene normalizzata una volta sola. Dagli opcode di Levenshtein (rapidfuzz, come in
+`edit_distance`) ogni parola di ipotesi riceve l'ultima parola di reference consumata, calcolata
+per blocchi con `np.repeat`, e il segmento corrispondente con `searchsorted` sui confini
+cumulativi dei segmenti. I segmenti risultanti sono intervalli contigui dell'ipotesi, quindi il
+risultato è un array di offset.
+
+Una `EncodedReference` si costruisce una volta per episodio e si riusa per tutti i modelli.
+"""
+import string
+from typing import Dict, List, Optional, Sequence, TypeVar
+
+import numpy as np
+from rapidfuzz.distance import Levenshtein
+
+from metrics import edit_distance
+
+T = TypeVar("T")
+
+_REMOVE_PUNCTUATION = str.maketrans('', '', string.punctuation)
+
+
+def normalize_word(word: str) -> str:
+    """Minuscolo e senza punteggiatura (migliora l'allineamento); i token di sola punteggiatura restano."""
+    word = word.lower()
+    return word.translate(_REMOVE_PUNCTUATION) or word
+
+
+class EncodedReference:
+    """
+    Reference di un episodio codificata una volta sola.
+
+    Args:
+        segments: parole di ogni segmento di reference (i segmenti vuoti sono ammessi).
+        vocabulary: vocabolario condiviso (default: nuovo).
+    """
+
+    def __init__(self, segments: Sequence[Sequence[str]], vocabulary: Optional[edit_distance.Vocabulary] = None):
+        self.vocabulary = vocabulary or edit_distance.Vocabulary()
+        self._word_ids = {}  # forma originale -> ID della forma normalizzata
+        self.n_segments = len(segments)
+        self.boundaries = np.cumsum([len(segment) for segment in segments], dtype=np.int64)
+        self.ids = self.encode([word for segment in segments for word in segment])
+        self._id_list = self.ids.tolist()
+
+    def encode(self, words: Sequence[str]) -> np.ndarray:
+        """ID delle parole normalizzate (la normalizzazione è calcolata una volta per forma)."""
+        word_ids, ids = self._word_ids, self.vocabulary.ids
+        for word in set(words).difference(word_ids):
+            word_ids[word] = ids.setdefault(normalize_word(word), len(ids))
+        return np.fromiter(map(word_ids.__getitem__, words), dtype=np.int64, count=len(words))
+
+    def segment_offsets(self, hypothesis_words: Sequence[str]) -> np.ndarray:
+        """
+        Offset (lunghezza n_segments + 1) delle parole di ipotesi assegnate a ogni segmento:
+        il segmento k riceve hypothesis_words[offsets[k]:offsets[k + 1]].
+        """
+        offsets = np.zeros(self.n_segments + 1, dtype=np.int64)
+        if self.n_segments == 0:
+            return offsets
+        hyp_ids = self.encode(hypothesis_words)
+        opcodes = Levenshtein.opcodes(self._id_list, hyp_ids.tolist()).as_list()
+        # Blocchi che consumano parole di ipotesi: (i1, j1, j2, è un'inserzione)
+        blocks = np.array([(i1, j1, j2, tag == "insert") for tag, i1, _, j1, j2 in opcodes if j2 > j1],
+                          dtype=np.int64).reshape(-1, 4)
+        i1, j1, j2, insert = blocks.T
+        lengths = j2 - j1
+
+        # Ultima parola di reference consumata da ogni parola di ipotesi j: i1 + (j - j1) per
+        # match/sostituzioni, i1 - 1 per le inserzioni
+        base = np.where(insert == 1, i1 - 1, i1 - j1)
+        last_ref = np.repeat(base, lengths) + np.repeat(1 - insert, lengths) * np.arange(len(hyp_ids))
+        # Segmento della parola p: primo confine > p (salta anche i segmenti vuoti); prima di
+        # qualsiasi parola di reference le inserzioni vanno nel segmento 0
+        segment = np.where(last_ref >= 0, np.searchsorted(self.boundaries, last_ref, side="right"), 0)
+        offsets[1:] = np.searchsorted(segment, np.arange(1, self.n_segments + 1), side="left")
+        return offsets
+
+    def resegment(self, hypothesis_words: Sequence[str], items: Optional[Sequence[T]] = None) -> List[List[T]]:
+        """
+        Parole di ipotesi raggruppate per segmento di reference. Se `items` è dato (es. gli
+        oggetti `Word` corrispondenti a `hypothesis_words`), i gruppi contengono quelli.
+        """
+        items = hypothesis_words if items is None else items
+        offsets = self.segment_offsets(hypothesis_words).tolist()
+        return [list(items[offsets[k]:offsets[k + 1]]) for k in range(self.n_segments)]
+
+
+def resegment(hypothesis_words: Sequence[str], reference_segments: Sequence[Sequence[str]]) -> List[List[str]]:
+    """Risegmenta un'ipotesi (lista di parole) sui segmenti di reference."""
+    return EncodedReference(reference_segments).resegment(hypothesis_words)
+
+
+def resegment_models(reference_segments: Sequence[Sequence[str]],
+                     hypotheses: Dict[str, Sequence[str]]) -> Dict[str, List[List[str]]]:
+    """Risegmenta le ipotesi di più modelli sulla stessa reference, codificata una volta sola."""
+    reference = EncodedReference(reference_segments)
+    return {model: reference.resegment(words) for model, words in hypotheses.items()}
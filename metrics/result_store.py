@@ -0,0 +1,108 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+import pandas as pd
+
+RESULTS_DB = "results.sqlite"
+
+
+def config_hash(**config) -> str:
+    """Hash breve e stabile della configurazione di una metrica (parametri, cartelle, versioni)."""
+    payload = json.dumps(config, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()[:16]
+
+
+class ResultStore:
+    """
+    Archivio dei risultati delle metriche su SQLite in modalità WAL, con chiave
+    (metric, model, file, config_hash).
+
+    Ogni processo apre la propria connessione alla prima operazione, quindi l'oggetto può essere
+    passato ai worker di un `ProcessPoolExecutor`. Ogni `put` è una transazione breve e
+    durevole: un crash perde al più il risultato in corso, e la ripresa non richiede lock
+    condivisi né il parsing di file di testo.
+    """
+
+    def __init__(self, path=RESULTS_DB, timeout=60.0):
+        self.path = path
+        self.timeout = timeout
+        self._conn = None
+        self._pid = None
+
+    def __getstate__(self):
+        return {"path": self.path, "timeout": self.timeout}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def conn(self):
+        if self._conn is None or self._pid != os.getpid():
+            self._conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            self._pid = os.getpid()
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                " metric TEXT NOT NULL, model TEXT NOT NULL, file TEXT NOT NULL, config_hash TEXT NOT NULL,"
+                " score REAL, extra TEXT, created_at REAL NOT NULL,"
+                " PRIMARY KEY (metric, model, file, config_hash)) WITHOUT ROWID"
+            )
+        return self._conn
+
+    def close(self):
+        if self._conn is not None and self._pid == os.getpid():
+            self._conn.close()
+        self._conn = None
+
+    def put(self, metric, model, file, score, config_hash="", extra=None, replace=True):
+        """Salva (o sovrascrive) un risultato. `extra` è un dict opzionale salvato come JSON."""
+        verb = "INSERT OR REPLACE" if replace else "INSERT OR IGNORE"
+        self.conn.execute(
+            f"{verb} INTO results (metric, model, file, config_hash, score, extra, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (metric, model, file, config_hash, score,
+             json.dumps(extra, ensure_ascii=False) if extra is not None else None, time.time()),
+        )
+
+    def get(self, metric, model, file, config_hash=""):
+        row = self.conn.execute(
+            "SELECT score FROM results WHERE metric = ? AND model = ? AND file = ? AND config_hash = ?",
+            (metric, model, file, config_hash),
+        ).fetchone()
+        return row[0] if row else None
+
+    def has(self, metric, model, file, config_hash=""):
+        return self.conn.execute(
+            "SELECT 1 FROM results WHERE metric = ? AND model = ? AND file = ? AND config_hash = ?",
+            (metric, model, file, config_hash),
+        ).fetchone() is not None
+
+    def completed(self, metric, config_hash=""):
+        """Insieme delle coppie (model, file) già calcolate, per controlli di ripresa in O(1)."""
+        rows = self.conn.execute(
+            "SELECT model, file FROM results WHERE metric = ? AND config_hash = ?", (metric, config_hash))
+        return set(rows)
+
+    def to_frame(self, metric, config_hash="", index=None, columns=None):
+        """
+        Restituisce i punteggi come DataFrame file x modello.
+        `index`/`columns` fissano ordine e righe/colonne attese (le mancanti restano NaN).
+        """
+        rows = self.conn.execute(
+            "SELECT file, model, score FROM results WHERE metric = ? AND config_hash = ?", (metric, config_hash)
+        ).fetchall()
+        df = pd.DataFrame(rows, columns=["file", "model", "score"]).pivot(index="file", columns="model", values="score")
+        df.index.name = None
+        df.columns.name = None
+        if index is not None or columns is not None:
+            df = df.reindex(index=index if index is not None else df.index,
+                            columns=columns if columns is not None else df.columns)
+        return df
@@ -0,0 +1,110 @@
+"""
+WER a finestre scorrevoli con un solo allineamento per episodio.
+
+Reference e ipotesi vengono allineate una volta sola sull'intero episodio; ogni operazione di
+edit riceve il tempo della parola a cui si riferisce (parola di reference per match,
+sostituzioni e cancellazioni, parola di ipotesi per le inserzioni). S/D/I di una finestra sono
+quindi il numero di operazioni con tempo in [start, end), ottenuto con `searchsorted` su array
+ordinati. Qualsiasi griglia finestra/hop costa solo qualche ricerca binaria.
+
+A differenza del calcolo finestra per finestra, gli errori vicino ai bordi vengono attribuiti
+secondo l'allineamento globale e non secondo un allineamento locale alla finestra.
+"""
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from metrics import edit_distance
+
+
+def _word_arrays(words: List[Dict]):
+    """Token e tempi di inizio, ordinati (in modo stabile) per tempo di inizio."""
+    starts = np.fromiter((w["start"] for w in words), dtype=np.float64, count=len(words))
+    tokens = [w["word"] for w in words]
+    if len(starts) > 1 and np.any(np.diff(starts) < 0):
+        order = np.argsort(starts, kind="stable")
+        starts = starts[order]
+        tokens = [tokens[i] for i in order]
+    return tokens, starts
+
+
+def window_grid(max_time: float, window_size: float, hop_size: float) -> Tuple[np.ndarray, np.ndarray]:
+    """Inizi e fine delle finestre: partono da 0 e avanzano di `hop_size` finché start < max_time."""
+    n = int(np.ceil(max_time / hop_size)) if max_time > 0 else 0
+    starts = np.arange(n, dtype=np.float64) * hop_size
+    return starts, starts + window_size
+
+
+class EpisodeAlignment:
+    """
+    Allineamento globale reference/ipotesi di un episodio, interrogabile su finestre arbitrarie.
+
+    Args:
+        ref_words, hyp_words: liste di dict {"start", "end", "word"} come prodotte da
+            `create_ref_word_timestamps` / `extract_words_from_json`.
+        band: limite di banda opzionale per l'allineamento (vedi `edit_distance.align`).
+    """
+
+    def __init__(self, ref_words: List[Dict], hyp_words: List[Dict], band: Optional[int] = None,
+                 vocabulary: Optional[edit_distance.Vocabulary] = None):
+        self.max_time = max(ref_words[-1]["end"] if ref_words else 0, hyp_words[-1]["end"] if hyp_words else 0)
+
+        ref_tokens, self.ref_starts = _word_arrays(ref_words)
+        hyp_tokens, self.hyp_starts = _word_arrays(hyp_words)
+        alignment = edit_distance.align(ref_tokens, hyp_tokens, band=band, vocabulary=vocabulary)
+
+        # Tempo di ogni errore, separato per tipo e ordinato per le ricerche binarie
+        self.error_times = {}
+        for op in (edit_distance.SUBSTITUTION, edit_distance.DELETION, edit_distance.INSERTION):
+            mask = alignment.ops == op
+            if op == edit_distance.INSERTION:
+                times = self.hyp_starts[alignment.hyp_pos[mask]]
+            else:
+                times = self.ref_starts[alignment.ref_pos[mask]]
+            self.error_times[op] = np.sort(times)
+
+    @staticmethod
+    def _count(sorted_times: np.ndarray, starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+        return np.searchsorted(sorted_times, ends, side="left") - np.searchsorted(sorted_times, starts, side="left")
+
+    def counts(self, starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+        """
+        Conteggi per le finestre [starts[k], ends[k]).
+        Restituisce un array (n, 5) con colonne S, D, I, N (parole di reference), parole di ipotesi.
+        """
+        starts = np.asarray(starts, dtype=np.float64)
+        ends = np.asarray(ends, dtype=np.float64)
+        return np.stack([
+            self._count(self.error_times[edit_distance.SUBSTITUTION], starts, ends),
+            self._count(self.error_times[edit_distance.DELETION], starts, ends),
+            self._count(self.error_times[edit_distance.INSERTION], starts, ends),
+            self._count(self.ref_starts, starts, ends),
+            self._count(self.hyp_starts, starts, ends),
+        ], axis=1)
+
+    def windows(self, window_size: float, hop_size: float, min_ref_words: int = 10) -> List[Dict]:
+        """Finestre nello stesso formato di `sliding_window_analysis` del notebook."""
+        starts, ends = window_grid(self.max_time, window_size, hop_size)
+        counts = self.counts(starts, ends)
+        windows = []
+        for start, end, (s, d, i, n, hyp_count) in zip(starts.tolist(), ends.tolist(), counts.tolist()):
+            windows.append({
+                "start": start,
+                "end": end,
+                "WER": round((s + d + i) / n, 3) if n > 0 else None,
+                "valid": n > 0 and n >= min_ref_words,
+                "ref_count": n,
+                "hyp_count": hyp_count
+            })
+        return windows
+
+    def sweep(self, grids: Iterable[Tuple[float, float]], min_ref_words: int = 10) -> Dict[Tuple[float, float], List[Dict]]:
+        """Finestre per più griglie (window_size, hop_size), riusando lo stesso allineamento."""
+        return {(window_size, hop_size): self.windows(window_size, hop_size, min_ref_words)
+                for window_size, hop_size in grids}
+
+
+def sliding_window_analysis(ref_words: List[Dict], hyp_words: List[Dict], window_size: float, hop_size: float,
+                            min_ref_words: int = 10, band: Optional[int] = None) -> List[Dict]:
+    """Calcola WER per finestre scorrevoli con un solo allineamento dell'episodio."""
+    return EpisodeAlignment(ref_words, hyp_words, band=band).windows(window_size, hop_size, min_ref_words)
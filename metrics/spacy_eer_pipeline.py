@@ -1,10 +1,17 @@
+import hashlib
 import os
 import json
 import re
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
 import pandas as pd
-from rapidfuzz import fuzz
+from rapidfuzz import fuzz, process
 from standardization import standardization_utils
 
+_NON_WORD = re.compile(r"[^\w']+")
+TRACK_CACHE_DIR = "../data/cache/tracks"
+EER_RESULTS_DIR = "raw_results/eer"
+
 def process_gt_jsonl(gt_jsonl_path):
     """Carica le entità GT da un JSONL."""
     entities = []
@@ -17,33 +24,137 @@ def process_gt_jsonl(gt_jsonl_path):
                     "extraction_text": extr["extraction_text"],
                     "char_interval": extr["char_interval"],
                     "start_time": None,
-                    "end_time": None
+                    "end_time": None,
+                    "spans_boundary": False
                 })
     return entities
 
 def timestamp_to_entities(subtitles, entities):
-    """Allinea entità GT ai sottotitoli usando gli offset carattere."""
-    offset = 0
-    for sub in subtitles:
-        sub_len = len(sub.text)
+    """
+    Allinea entità GT ai sottotitoli usando gli offset carattere.
+    Gli offset cumulativi dei sottotitoli (testi separati da un carattere) sono calcolati una
+    volta sola e ogni entità viene collocata con una ricerca binaria sul suo `char_interval`.
+    Le entità che attraversano il confine tra due sottotitoli restano senza tempi, ma vengono
+    marcate con `spans_boundary=True` e segnalate.
+    """
+    if isinstance(subtitles, standardization_utils.SubtitleTrack):
+        lengths = subtitles.char_counts()
+        sub_start_times, sub_end_times = subtitles.start_times.tolist(), subtitles.end_times.tolist()
+    else:
+        lengths = np.fromiter((len(sub.text) for sub in subtitles), dtype=np.int64, count=len(subtitles))
+        sub_start_times = [sub.start_time for sub in subtitles]
+        sub_end_times = [sub.end_time for sub in subtitles]
+    if not entities:
+        return entities
+    if len(lengths) == 0:
         for entity in entities:
-            start_char, end_char = entity["char_interval"]
-            if start_char >= offset and end_char <= offset + sub_len:
-                entity["start_time"] = sub.start_time
-                entity["end_time"] = sub.end_time
-        offset += sub_len + 1  # +1 per spazio/line break
+            entity["spans_boundary"] = False
+        return entities
+
+    # Offset di inizio/fine del testo di ogni sottotitolo (+1 per spazio/line break)
+    char_starts = np.zeros(len(lengths), dtype=np.int64)
+    np.cumsum(lengths[:-1] + 1, out=char_starts[1:])
+    char_ends = char_starts + lengths
+
+    intervals = np.array([entity["char_interval"] for entity in entities]).reshape(len(entities), 2)
+    idx = np.searchsorted(char_starts, intervals[:, 0], side="right") - 1
+    inside = idx >= 0
+    placed = inside & (intervals[:, 1] <= char_ends[np.clip(idx, 0, None)])
+    spans_boundary = inside & ~placed & (idx < len(lengths) - 1)
+
+    for entity, i, is_placed, spans in zip(entities, idx.tolist(), placed.tolist(), spans_boundary.tolist()):
+        if is_placed:
+            entity["start_time"] = sub_start_times[i]
+            entity["end_time"] = sub_end_times[i]
+        entity["spans_boundary"] = spans
+
+    n_spanning = int(spans_boundary.sum())
+    if n_spanning:
+        print(f"[WARN] {n_spanning} entità attraversano il confine tra due sottotitoli e restano senza tempi")
     return entities
 
 def clean_entity_text(text):
     """Normalizza il testo rimuovendo punteggiatura e spazi extra."""
     if "'" in text:
         text = text.split("'", 1)[1]
-    return re.sub(r"[^\w']+", " ", text).strip().lower()
+    return _NON_WORD.sub(" ", text).strip().lower()
+
+class AsrTrackIndex:
+    """
+    Indice temporale di una traccia ASR per `match_entities`.
+    I segmenti sono ordinati per inizio; il massimo cumulativo dei tempi di fine permette di
+    trovare con due ricerche binarie i segmenti che si sovrappongono a un intervallo. Le parole
+    di tutti i segmenti sono in un'unica lista, già pulite una volta sola: per ogni parola si
+    tengono il testo pulito intero e quello dopo il primo apostrofo, così il testo pulito di un
+    n-gramma si ricompone senza rieseguire `clean_entity_text` (che taglia al primo apostrofo
+    dell'intero n-gramma).
+    """
+
+    def __init__(self, asr_segments):
+        if isinstance(asr_segments, standardization_utils.SubtitleTrack):
+            order = np.argsort(asr_segments.start_times, kind="stable")
+            self.start_times = asr_segments.start_times[order].astype(np.float64)
+            self.end_times = asr_segments.end_times[order].astype(np.float64)
+            texts = [asr_segments.text(i) for i in order]
+        else:
+            asr_segments = sorted(asr_segments, key=lambda s: s.start_time)
+            self.start_times = np.array([s.start_time for s in asr_segments], dtype=np.float64)
+            self.end_times = np.array([s.end_time for s in asr_segments], dtype=np.float64)
+            texts = [s.text for s in asr_segments]
+        self.max_end_times = np.maximum.accumulate(self.end_times) if len(texts) else self.end_times
+
+        self.words = []
+        word_offsets = [0]
+        for text in texts:
+            self.words.extend(text.split())
+            word_offsets.append(len(self.words))
+        self.word_offsets = np.array(word_offsets, dtype=np.int64)
+
+        self.clean_words = [_NON_WORD.sub(" ", w).strip().lower() for w in self.words]
+        self.clean_tails = [clean_entity_text(w) if "'" in w else None for w in self.words]
+
+    def words_in_window(self, win_lo, win_hi):
+        """Indici delle parole dei segmenti che si sovrappongono a [win_lo, win_hi], in ordine."""
+        lo = int(np.searchsorted(self.max_end_times, win_lo, side="left"))
+        hi = int(np.searchsorted(self.start_times, win_hi, side="right"))
+        if lo >= hi:
+            return range(0)
+        overlapping = self.end_times[lo:hi] >= win_lo
+        if overlapping.all():
+            return range(self.word_offsets[lo], self.word_offsets[hi])
+        return [j for k in np.flatnonzero(overlapping) + lo
+                for j in range(self.word_offsets[k], self.word_offsets[k + 1])]
+
+    def clean_ngrams(self, word_ids, n_tokens):
+        """Testo pulito (come `clean_entity_text`) di ogni n-gramma di `n_tokens` parole."""
+        clean_words = self.clean_words
+        clean_tails = self.clean_tails
+        ngrams = []
+        next_apostrophe = len(word_ids)
+        # Indice del primo apostrofo a partire da ogni posizione, scorrendo all'indietro
+        first_apostrophe = [0] * len(word_ids)
+        for i in range(len(word_ids) - 1, -1, -1):
+            if clean_tails[word_ids[i]] is not None:
+                next_apostrophe = i
+            first_apostrophe[i] = next_apostrophe
+        for i in range(len(word_ids) - n_tokens + 1):
+            k = first_apostrophe[i]
+            if k < i + n_tokens:
+                pieces = [clean_tails[word_ids[k]]] + [clean_words[j] for j in word_ids[k + 1:i + n_tokens]]
+            else:
+                pieces = [clean_words[j] for j in word_ids[i:i + n_tokens]]
+            ngrams.append(" ".join(p for p in pieces if p))
+        return ngrams
 
 def match_entities(gt_entities, asr_segments, threshold=0.9, time_pad=500):
-    """Trova il miglior match per ogni entità GT tra i segmenti ASR."""
+    """
+    Trova il miglior match per ogni entità GT tra i segmenti ASR.
+    `asr_segments` può essere una lista di sottotitoli o un `AsrTrackIndex` già costruito.
+    """
+    index = asr_segments if isinstance(asr_segments, AsrTrackIndex) else AsrTrackIndex(asr_segments)
+    # Tolleranza per il confronto sim >= threshold fatto sui punteggi in centesimi
+    score_cutoff = max(0.0, threshold * 100.0 - 1e-9)
     results = []
-    asr_segments = sorted(asr_segments, key=lambda s: s.start_time)
 
     for ent in gt_entities:
         gt_text = clean_entity_text(ent["extraction_text"])
@@ -57,84 +168,132 @@ def match_entities(gt_entities, asr_segments, threshold=0.9, time_pad=500):
         win_lo = gt_start - time_pad
         win_hi = gt_end + time_pad
 
-        merged_words = []
-        for seg in asr_segments:
-            if seg.end_time < win_lo or seg.start_time > win_hi:
-                continue
-            merged_words.extend(seg.text.split())
+        word_ids = index.words_in_window(win_lo, win_hi)
+        if not word_ids:
+            results.append("")
+            continue
+
+        n_tokens = max(len(gt_text.split()), 1)
+        candidates = index.clean_ngrams(word_ids, n_tokens)
 
-        if not merged_words:
+        # Primo candidato con punteggio massimo, scartando subito quelli sotto soglia
+        best = process.extractOne(gt_text, candidates, scorer=fuzz.ratio, score_cutoff=score_cutoff)
+        if best is None or best[1] <= 0 or best[1] / 100.0 < threshold:
             results.append("")
             continue
 
-        n_tokens = len(gt_text.split())
-        ngrams = (
-            [" ".join(merged_words[i:i+n_tokens]) for i in range(len(merged_words)-n_tokens+1)]
-            if n_tokens > 1 else merged_words
-        )
+        i = best[2]
+        results.append(" ".join(index.words[j] for j in word_ids[i:i + n_tokens]))
 
-        best_ngram = ""
-        best_sim = 0.0
-        for ng in ngrams:
-            sim = fuzz.ratio(gt_text, clean_entity_text(ng)) / 100.0
-            if sim > best_sim:
-                best_sim = sim
-                best_ngram = ng
+    return results
 
-        best_ngram = best_ngram if best_sim >= threshold else ""
+def episode_input_paths(file, models):
+    """File letti da `compare_episode` per un episodio: JSONL e SRT della GT, SRT di ogni modello."""
+    return ([f"../data/jsonl_spacy/{file}.jsonl", f"../data/srt/ground-truth-cleaned/{file}.srt"]
+            + [f"../data/{model}/srt/{file}.srt" for model in models])
 
-        results.append(best_ngram)
+def _file_sha1(path):
+    if not os.path.exists(path):
+        return "missing"
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
 
-    return results
+def episode_results_key(file, models, threshold, time_pad):
+    """
+    Chiave dei risultati di un episodio: configurazione, modelli (ordinati) e sha1 dei file di
+    input. Cambiando l'elenco dei modelli o rigenerando un SRT/JSONL il Parquet viene ricalcolato.
+    """
+    payload = json.dumps({
+        "threshold": threshold, "time_pad": time_pad, "models": sorted(models),
+        "inputs": {path: _file_sha1(path) for path in episode_input_paths(file, sorted(models))},
+    }, sort_keys=True)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()[:16]
 
-def compare_multiple_asr(files, models, threshold=0.9, time_pad=5):
+def episode_results_path(output_dir, file, threshold, time_pad, key):
+    """Parquet dei risultati di un episodio per una configurazione (threshold, time_pad) e una chiave di input."""
+    return os.path.join(output_dir, f"threshold={threshold}_time_pad={time_pad}", f"{file}-{key}.parquet")
+
+def compare_episode(file, models, threshold, time_pad, output_path, cache_dir=TRACK_CACHE_DIR):
+    """
+    Confronta le entità GT di un episodio con tutti i modelli e scrive il risultato in Parquet.
+    Le tracce SRT vengono lette dalla cache su disco (chiave: hash del contenuto), quindi al
+    variare di threshold/time_pad si paga solo il matching.
+    """
+    gt_jsonl_path, gt_srt_path = episode_input_paths(file, [])
+
+    gt_subtitles = standardization_utils.read_track_cached(gt_srt_path, cache_dir)
+    # Carico GT
+    gt_entities = process_gt_jsonl(gt_jsonl_path)
+    gt_timestamp_entities = timestamp_to_entities(gt_subtitles, gt_entities)
+
+    gt_timestamp_entities = [e for e in gt_timestamp_entities if e.get("start_time") is not None and e.get("end_time") is not None]
+
+    start_time_sub = [round(float(e["start_time"])/1000, 3) for e in gt_timestamp_entities]
+    end_time_sub   = [round(float(e["end_time"])/1000, 3) for e in gt_timestamp_entities]
+    win_time_start = [sts - float(time_pad) for sts in start_time_sub]
+    win_time_end = [ets + float(time_pad) for ets in end_time_sub]
+
+    # Preparo la riga iniziale
+    result_row = {
+        "program": file,
+        "gt_entity": [e["extraction_text"] for e in gt_timestamp_entities],
+        "start_time_sub": start_time_sub,
+        "end_time_sub": end_time_sub,
+        "extraction_class": [e["extraction_class"] for e in gt_timestamp_entities],
+        "win_time_start": win_time_start,
+        "win_time_end": win_time_end
+    }
+
+    for model in models:
+        asr_path = f"../data/{model}/srt/{file}.srt"
+        asr_subtitles = standardization_utils.read_track_cached(asr_path, cache_dir)
+        result_row[model] = match_entities(gt_timestamp_entities, asr_subtitles, threshold, time_pad)
+
+    df = pd.DataFrame(result_row)
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    tmp_path = output_path + ".tmp"
+    df.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, output_path)
+    return output_path
+
+def compare_multiple_asr(files, models, threshold=0.9, time_pad=5, output_dir=EER_RESULTS_DIR,
+                         cache_dir=TRACK_CACHE_DIR, max_workers=None, overwrite=False):
     """
     Confronta le entità di più file GT con più sistemi ASR.
+    Gli episodi sono distribuiti su un pool di processi; ogni episodio scrive il proprio Parquet
+    in `output_dir` (una cartella per configurazione) e quelli già calcolati vengono riusati solo
+    se modelli e file di input sono gli stessi (vedi `episode_results_key`).
+    Se qualche episodio fallisce solleva RuntimeError dopo aver atteso tutti gli altri.
     Ritorna un DataFrame con colonne: program, gt_entity, extraction_class, modello1, modello2...
     """
-    all_results = []
-
+    paths = {file: episode_results_path(output_dir, file, threshold, time_pad,
+                                        episode_results_key(file, models, threshold, time_pad))
+             for file in files}
+    todo = [file for file in files if overwrite or not os.path.exists(paths[file])]
     for file in files:
-        gt_jsonl_path = f"../data/jsonl_spacy/{file}.jsonl"
-        gt_srt_path = f"../data/srt/ground-truth-cleaned/{file}.srt"
-
-        with open(gt_srt_path, "r", encoding="utf-8", errors="replace") as f:
-                srt_text = f.read()
-
-        gt_subtitles = standardization_utils.preprocess(srt_text)
-        # Carico GT
-        gt_entities = process_gt_jsonl(gt_jsonl_path)        
-        gt_timestamp_entities = timestamp_to_entities(gt_subtitles, gt_entities)
-
-        gt_timestamp_entities = [e for e in gt_timestamp_entities if e.get("start_time") is not None and e.get("end_time") is not None]
-
-        start_time_sub = [round(float(e["start_time"])/1000, 3) for e in gt_timestamp_entities]
-        end_time_sub   = [round(float(e["end_time"])/1000, 3) for e in gt_timestamp_entities]
-        win_time_start = [sts - float(time_pad) for sts in start_time_sub]
-        win_time_end = [ets + float(time_pad) for ets in end_time_sub]
-
-        # Preparo la riga iniziale
-        result_row = {
-            "program": file,
-            "gt_entity": [e["extraction_text"] for e in gt_timestamp_entities],
-            "start_time_sub": start_time_sub,
-            "end_time_sub": end_time_sub,
-            "extraction_class": [e["extraction_class"] for e in gt_timestamp_entities],
-            "win_time_start": win_time_start,
-            "win_time_end": win_time_end 
-        }
-
-        # Per ogni modello, dividi i risultati in 3 colonne
-        for model in models:
-            asr_path = f"../data/{model}/srt/{file}.srt"
-            with open(asr_path, "r", encoding="utf-8", errors="replace") as f:
-                srt_text = f.read()
-            asr_subtitles = standardization_utils.preprocess(srt_text)
-            matches = match_entities(gt_timestamp_entities, asr_subtitles, threshold, time_pad)
-            # matches è una lista di tuple (best_ngram, win_lo, win_hi)
-            result_row[model] = matches           
-
-        df_partial = pd.DataFrame(result_row)
-        all_results.append(df_partial)
-
-    return pd.concat(all_results, ignore_index=True)
+        if file not in todo:
+            print(f"[SKIP] Già calcolato: {paths[file]}")
+
+    failures = {}
+    if todo:
+        if max_workers is None:
+            max_workers = max(1, min(len(todo), (os.cpu_count() or 1) - 2))
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = {executor.submit(compare_episode, file, models, threshold, time_pad, paths[file], cache_dir): file
+                       for file in todo}
+            for future in as_completed(futures):
+                try:
+                    print(f"[INFO] Completato {futures[future]}: {future.result()}")
+                except Exception as e:
+                    print(f"[ERRORE] Durante l'elaborazione {futures[future]}: {e}")
+                    failures[futures[future]] = e
+
+    if failures:
+        details = "; ".join(f"{file}: {e!r}" for file, e in sorted(failures.items()))
+        raise RuntimeError(f"{len(failures)} episodi non elaborati, risultati EER incompleti: {details}")
+
+    frames = [pd.read_parquet(paths[file]) for file in files]
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
@@ -0,0 +1,289 @@
+"""
+Estrazione delle entità con spaCy a batch, su più processi e con cache su disco.
+
+Il testo di ogni episodio viene diviso in chunk di al più `max_chars` caratteri tagliando sui
+confini dei sottotitoli (di preferenza dopo un punto fermo), così nessun `nlp(text)` supera
+`nlp.max_length` e le entità non vengono spezzate. Ogni chunk ricorda il proprio offset nel
+testo completo: i `char_interval` scritti nel JSONL restano globali, come quelli del notebook.
+
+Del modello restano attivi solo `ner` e il `tok2vec` da cui eventualmente dipende; i chunk di
+tutti i testi (GT e modelli) passano in un unico `nlp.pipe(n_process=..., batch_size=...)`.
+Le entità sono salvate in cache (SQLite, chiave: sha1 di modello e testo del chunk), quindi
+rieseguire l'estrazione dopo una modifica costa solo i chunk effettivamente cambiati.
+"""
+import bisect
+import hashlib
+import json
+import os
+import re
+import sqlite3
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from standardization import standardization_utils
+
+SPACY_MODEL = "it_core_news_sm"
+NER_CACHE_PATH = "../data/cache/spacy_ner.sqlite"
+TRACK_CACHE_DIR = "../data/cache/tracks"
+MAX_CHUNK_CHARS = 5000
+_SENTENCE_END = ".!?…"
+_WHITESPACE = re.compile(r"\s+")
+
+
+def chunk_key(model_id: str, text: str) -> str:
+    return hashlib.sha1("\0".join((model_id, text)).encode("utf-8")).hexdigest()
+
+
+class EntityCache:
+    """Cache persistente chiave -> entità del chunk ([etichetta, inizio, fine] relativi al chunk)."""
+
+    def __init__(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS entities (key TEXT PRIMARY KEY, entities TEXT NOT NULL)")
+        self.connection.commit()
+
+    def get_many(self, keys: Sequence[str]) -> Dict[str, list]:
+        found = {}
+        keys = list(keys)
+        for i in range(0, len(keys), 500):  # limite di parametri per query di SQLite
+            chunk = keys[i:i + 500]
+            query = f"SELECT key, entities FROM entities WHERE key IN ({','.join('?' * len(chunk))})"
+            found.update((key, json.loads(value)) for key, value in self.connection.execute(query, chunk))
+        return found
+
+    def put_many(self, items: Dict[str, list]):
+        self.connection.executemany("INSERT OR REPLACE INTO entities (key, entities) VALUES (?, ?)",
+                                    ((key, json.dumps(value)) for key, value in items.items()))
+        self.connection.commit()
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM entities").fetchone()[0]
+
+    def close(self):
+        self.connection.close()
+
+
+def subtitle_boundaries(text: str, subtitle_lengths: Optional[Sequence[int]] = None) -> Tuple[List[int], List[int]]:
+    """
+    Posizioni in cui si può tagliare il testo: (dopo fine frase, tutte), ordinate.
+    Con le lunghezze dei sottotitoli (testi separati da un carattere, come in
+    `spacy_eer_pipeline.timestamp_to_entities`) sono gli inizi dei sottotitoli, tenuti solo se
+    preceduti da uno spazio; senza, sono gli inizi delle parole.
+    """
+    if subtitle_lengths is not None and len(subtitle_lengths) > 1:
+        candidates, position = [], 0
+        for length in list(subtitle_lengths)[:-1]:
+            position += int(length) + 1
+            if position > len(text):
+                break
+            candidates.append(position)
+        weak = [b for b in candidates if text[b - 1].isspace()]
+    else:
+        weak = [m.end() for m in _WHITESPACE.finditer(text) if 0 < m.end() < len(text)]
+    strong = [b for b in weak if b >= 2 and text[b - 2] in _SENTENCE_END]
+    return strong, weak
+
+
+def chunk_spans(text: str, subtitle_lengths: Optional[Sequence[int]] = None,
+                max_chars: int = MAX_CHUNK_CHARS) -> List[Tuple[int, int]]:
+    """
+    Intervalli [inizio, fine) dei chunk che coprono `text`, ciascuno di al più `max_chars`
+    caratteri. Si taglia all'ultimo confine di frase nella seconda metà della finestra, altrimenti
+    all'ultimo confine disponibile e, solo se non ce ne sono, esattamente a `max_chars`.
+    """
+    strong, weak = subtitle_boundaries(text, subtitle_lengths)
+    spans, start = [], 0
+    while len(text) - start > max_chars:
+        limit = start + max_chars
+        cut = None
+        for bounds, lowest in ((strong, start + max_chars // 2), (weak, start)):
+            i = bisect.bisect_right(bounds, limit) - 1
+            if i >= 0 and bounds[i] > lowest:
+                cut = bounds[i]
+                break
+        if cut is None:
+            cut = limit
+        spans.append((start, cut))
+        start = cut
+    if start < len(text):
+        spans.append((start, len(text)))
+    return [(s, e) for s, e in spans if text[s:e].strip()]
+
+
+def load_ner_pipeline(model: str = SPACY_MODEL):
+    """Carica il modello spaCy lasciando attivi solo `ner` e i componenti da cui dipende."""
+    import spacy
+
+    nlp = spacy.load(model)
+    keep = {"ner"}
+    for name, pipe in nlp.pipeline:
+        # tok2vec condiviso: il ner lo usa solo se è tra i suoi "listener"
+        if "ner" in getattr(pipe, "listening_components", []):
+            keep.add(name)
+    nlp.select_pipes(enable=[name for name in nlp.pipe_names if name in keep])
+    return nlp
+
+
+class EntityExtractor:
+    """
+    Args:
+        model: modello spaCy.
+        cache_path: file SQLite della cache; None per non usare la cache.
+        n_process: processi di `nlp.pipe` (default: CPU disponibili - 2).
+        batch_size: testi per batch di `nlp.pipe`.
+        max_chars: caratteri massimi per chunk.
+        nlp: pipeline già caricata (altrimenti caricata al primo uso con `load_ner_pipeline`).
+    """
+
+    def __init__(self, model: str = SPACY_MODEL, cache_path: Optional[str] = NER_CACHE_PATH,
+                 n_process: Optional[int] = None, batch_size: int = 32, max_chars: int = MAX_CHUNK_CHARS, nlp=None):
+        self.model = model
+        self.cache = EntityCache(cache_path) if cache_path else None
+        self.n_process = n_process if n_process is not None else max(1, (os.cpu_count() or 1) - 2)
+        self.batch_size = batch_size
+        self.max_chars = max_chars
+        self.nlp = nlp
+        self._model_id = None
+        self.stats = {"texts": 0, "chunks": 0, "cache_hits": 0, "computed": 0}
+
+    def _load(self):
+        if self.nlp is None:
+            self.nlp = load_ner_pipeline(self.model)
+        return self.nlp
+
+    @property
+    def model_id(self) -> str:
+        """Nome e versione del modello: cambiando modello le voci in cache non vengono riusate."""
+        if self._model_id is None:
+            if self.nlp is None:
+                from importlib import metadata
+                try:
+                    self._model_id = f"{self.model}-{metadata.version(self.model)}"
+                except metadata.PackageNotFoundError:
+                    self._load()
+            if self._model_id is None:
+                meta = self.nlp.meta
+                self._model_id = f"{self.nlp.lang}_{meta.get('name')}-{meta.get('version')}"
+        return self._model_id
+
+    def _compute(self, chunks: Dict[str, str]) -> Dict[str, list]:
+        """Entità dei chunk non in cache, salvate in cache un batch alla volta."""
+        nlp = self._load()
+        keys = list(chunks)
+        # Per pochi chunk avviare i processi costa più dell'estrazione
+        n_process = self.n_process if len(keys) > 2 * self.batch_size else 1
+        computed, pending = {}, {}
+        docs = nlp.pipe((chunks[key] for key in keys), n_process=n_process, batch_size=self.batch_size)
+        for key, doc in zip(keys, docs):
+            pending[key] = [[ent.label_, ent.start_char, ent.end_char] for ent in doc.ents]
+            if len(pending) >= self.batch_size:
+                if self.cache is not None:
+                    self.cache.put_many(pending)
+                computed.update(pending)
+                pending = {}
+        if pending and self.cache is not None:
+            self.cache.put_many(pending)
+        computed.update(pending)
+        return computed
+
+    def extract_many(self, texts: Sequence[str],
+                     subtitle_lengths: Optional[Sequence[Optional[Sequence[int]]]] = None) -> List[List[dict]]:
+        """
+        Entità di ogni testo nel formato del notebook ({"extraction_class", "extraction_text",
+        "char_interval"}), con offset relativi al testo completo.
+        `subtitle_lengths[i]`: lunghezze dei sottotitoli del testo i (None: taglio sulle parole).
+        """
+        if subtitle_lengths is None:
+            subtitle_lengths = [None] * len(texts)
+        model_id = self.model_id
+        layouts, chunks = [], {}
+        for text, lengths in zip(texts, subtitle_lengths):
+            layout = []
+            for start, end in chunk_spans(text, lengths, self.max_chars):
+                chunk = text[start:end]
+                key = chunk_key(model_id, chunk)
+                chunks[key] = chunk
+                layout.append((start, key))
+            layouts.append(layout)
+
+        found = self.cache.get_many(chunks) if self.cache is not None else {}
+        missing = {key: chunk for key, chunk in chunks.items() if key not in found}
+        n_chunks = sum(len(layout) for layout in layouts)
+        print(f"[INFO] spaCy NER: {len(texts)} testi, {n_chunks} chunk, {len(chunks)} distinti, "
+              f"{len(found)} in cache, {len(missing)} da calcolare")
+        if missing:
+            found.update(self._compute(missing))
+        self.stats["texts"] += len(texts)
+        self.stats["chunks"] += n_chunks
+        self.stats["cache_hits"] += len(chunks) - len(missing)
+        self.stats["computed"] += len(missing)
+
+        results = []
+        for layout in layouts:
+            entities = []
+            for start, key in layout:
+                chunk = chunks[key]
+                for label, s, e in found[key]:
+                    entities.append({
+                        "extraction_class": label,
+                        "extraction_text": chunk[s:e],
+                        "char_interval": [start + s, start + e]
+                    })
+            results.append(entities)
+        return results
+
+    def extract(self, text: str, subtitle_lengths: Optional[Sequence[int]] = None) -> List[dict]:
+        return self.extract_many([text], [subtitle_lengths])[0]
+
+
+def write_spacy_jsonl(extractions: List[dict], output_path: str):
+    """Salva le entità di un testo in un JSONL di una riga, come `get_spacy_jsonl` del notebook."""
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    tmp_path = output_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(json.dumps({"extractions": extractions}, ensure_ascii=False) + "\n")
+    os.replace(tmp_path, output_path)
+
+
+def ner_jobs(files: Sequence[str], models: Sequence[str] = (), data_dir: str = "../data") -> List[Tuple[str, str, str]]:
+    """
+    Coppie (testo, SRT, JSONL di output) per la GT e per ogni modello.
+    Il JSONL della GT resta `jsonl_spacy/{file}.jsonl`, quello letto da `spacy_eer_pipeline`.
+    """
+    jobs = [(f"{data_dir}/text/{file}.txt", f"{data_dir}/srt/ground-truth-cleaned/{file}.srt",
+             f"{data_dir}/jsonl_spacy/{file}.jsonl") for file in files]
+    for model in models:
+        jobs.extend((f"{data_dir}/{model}/text/{file}.txt", f"{data_dir}/{model}/srt/{file}.srt",
+                     f"{data_dir}/{model}/jsonl_spacy/{file}.jsonl") for file in files)
+    return jobs
+
+
+def extract_all(jobs: Sequence[Tuple[str, Optional[str], str]], extractor: Optional[EntityExtractor] = None,
+                track_cache_dir: str = TRACK_CACHE_DIR) -> Dict[str, int]:
+    """
+    Estrae le entità di tutti i job (testo, SRT o None, JSONL di output) con un solo `nlp.pipe`.
+    Se l'SRT esiste i chunk seguono i suoi sottotitoli, altrimenti si taglia sulle parole.
+    Ritorna il numero di entità per file di output.
+    """
+    extractor = extractor or EntityExtractor()
+    texts, lengths, outputs = [], [], []
+    for text_path, srt_path, output_path in jobs:
+        if not os.path.exists(text_path):
+            print(f"[SKIP] Testo mancante: {text_path}")
+            continue
+        with open(text_path, "r", encoding="utf-8") as f:
+            texts.append(f.read())
+        if srt_path and os.path.exists(srt_path):
+            lengths.append(standardization_utils.read_track_cached(srt_path, track_cache_dir).char_counts())
+        else:
+            lengths.append(None)
+        outputs.append(output_path)
+
+    counts = {}
+    for output_path, extractions in zip(outputs, extractor.extract_many(texts, lengths)):
+        write_spacy_jsonl(extractions, output_path)
+        counts[output_path] = len(extractions)
+        print(f"[SAVE] {len(extractions)} entità salvate in {output_path}")
+    return counts
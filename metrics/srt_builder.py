@@ -0,0 +1,376 @@
+"""
+Costruzione degli SRT "improved" dai timestamp di parola (come `create_srt_from_json` di
+readability.ipynb), con i vincoli RAI di leggibilità: righe da `MAX_LEN_LINE` caratteri, blocchi
+di al massimo due righe, durata tra `MIN_DISPLAY_TIME` e `MAX_DISPLAY_TIME`.
+
+Le parole di un episodio sono tenute in una `WordTimeline` (array di inizio, fine, lunghezza,
+punteggiatura finale, pausa successiva). Due modalità:
+- "greedy": lo stesso risultato del notebook (riempimento dei blocchi per segmento, poi fusione
+  dei blocchi consecutivi), con i confini dei blocchi trovati con `searchsorted` sulle somme
+  cumulative delle lunghezze e `smart_line_break` senza espressioni regolari;
+- "dp": i confini dei blocchi sono scelti con una programmazione dinamica su tutto l'episodio,
+  minimizzando un costo per blocco (numero di blocchi, durata sotto il minimo, CPS oltre il
+  massimo, pause interne, confini lontani da punteggiatura e pause). I costi di tutti i blocchi
+  candidati sono calcolati in modo vettoriale per numero di parole; la ricorsione è un solo
+  passaggio sulle parole. L'andata a capo è scelta tra i confini di parola che rispettano
+  `MAX_LEN_LINE`, preferendo la punteggiatura e righe bilanciate.
+
+L'SRT è scritto con un solo join, con i timestamp formattati in blocco.
+"""
+from typing import List, Sequence, Tuple
+
+import numpy as np
+
+# --- CONSTANTS FOR RAI SUBTITLES ---
+MAX_LEN_LINE = 37       # max chars per line (RAI style)
+MAX_LEN_BLOCK = MAX_LEN_LINE * 2  # max chars for 2 lines
+MIN_DISPLAY_TIME = 1.0  # min seconds per block
+MAX_DISPLAY_TIME = 6.0  # max seconds per block
+MIN_GAP = 0.04          # min seconds between consecutive blocks
+MAX_CPS = 15.0          # limite superiore dei caratteri al secondo (linee guida)
+
+_BREAK_CHARS = " ,;:.!?"
+_STRONG_PUNCTUATION = ".!?…"
+_WEAK_PUNCTUATION = ",;:"
+
+
+def collapse_spaces(text: str) -> str:
+    """Come `re.sub(r'\\s+', ' ', text.strip())`."""
+    return " ".join(text.split())
+
+
+def smart_line_break(text: str) -> str:
+    """
+    Divide il testo in al massimo 2 righe (come nel notebook): taglio sull'ultimo spazio o
+    segno di punteggiatura entro `MAX_LEN_LINE`, altrimenti a `MAX_LEN_LINE` caratteri.
+    """
+    text = collapse_spaces(text)
+    if len(text) <= MAX_LEN_LINE:
+        return text
+    head = text[:MAX_LEN_LINE + 1]
+    split_pos = max(head.rfind(c) for c in _BREAK_CHARS)
+    if split_pos < 0:
+        split_pos = MAX_LEN_LINE
+    return text[:split_pos].strip() + "\n" + text[split_pos:].strip()
+
+
+def merge_apostrophes(words: List[dict]) -> List[dict]:
+    """
+    Joins tokens split by apostrophe (like "l" + "'abbiamo" -> "l'abbiamo")
+    """
+    merged = []
+    skip = False
+    for i, w in enumerate(words):
+        if skip:
+            skip = False
+            continue
+        if i + 1 < len(words) and words[i + 1]['word'].startswith("'"):
+            merged.append({'word': w['word'] + words[i + 1]['word'], 'start': w['start'], 'end': words[i + 1]['end']})
+            skip = True
+        else:
+            merged.append(w)
+    return merged
+
+
+def format_srt_times(seconds) -> List[str]:
+    """Timestamp SRT HH:MM:SS,mmm di un array di secondi (arrotondamento al millisecondo come `round`)."""
+    total_ms = np.rint(np.asarray(seconds, dtype=np.float64) * 1000).astype(np.int64)
+    hours, rest = np.divmod(total_ms, 3_600_000)
+    minutes, rest = np.divmod(rest, 60_000)
+    secs, millis = np.divmod(rest, 1000)
+    return [f"{h:02}:{m:02}:{s:02},{ms:03}" for h, m, s, ms in
+            zip(hours.tolist(), minutes.tolist(), secs.tolist(), millis.tolist())]
+
+
+def to_srt(starts: Sequence[float], ends: Sequence[float], texts: Sequence[str]) -> str:
+    """Testo SRT dei blocchi, numerati da 1."""
+    start_str, end_str = format_srt_times(starts), format_srt_times(ends)
+    return "\n".join(f"{num}\n{a} --> {b}\n{text}\n" for num, (a, b, text) in
+                     enumerate(zip(start_str, end_str, texts), start=1)).strip()
+
+
+class WordTimeline:
+    """
+    Parole di un episodio (dopo `merge_apostrophes`) come array.
+
+    Attributi:
+        words: testo delle parole, come nel JSON.
+        start, end: tempi in secondi.
+        length: lunghezza del testo della parola nel JSON (spazi compresi).
+        punctuation: 2 se la parola chiude una frase (.!?…), 1 se termina con , ; :, altrimenti 0.
+        pause: pausa dopo la parola (inf per l'ultima).
+        segment_bounds: indici di inizio di ogni segmento del JSON, più il totale.
+    """
+
+    def __init__(self, words: List[str], start, end, segment_bounds):
+        self.words = words
+        self.start = np.asarray(start, dtype=np.float64)
+        self.end = np.asarray(end, dtype=np.float64)
+        self.segment_bounds = np.asarray(segment_bounds, dtype=np.int64)
+        self.length = np.fromiter(map(len, words), dtype=np.int64, count=len(words))
+        stripped = [word.strip() for word in words]
+        self.punctuation = np.fromiter(
+            (2 if word and word[-1] in _STRONG_PUNCTUATION else 1 if word and word[-1] in _WEAK_PUNCTUATION else 0
+             for word in stripped), dtype=np.int8, count=len(words))
+        self.pause = np.append(self.start[1:] - self.end[:-1], np.inf) if len(words) else np.zeros(0)
+
+    @classmethod
+    def from_json(cls, data_json: list) -> "WordTimeline":
+        """Dal JSON di predizione (lista di segmenti con 'words': [{'word', 'start', 'end'}])."""
+        words, start, end, bounds = [], [], [], [0]
+        for seg in data_json:
+            for w in merge_apostrophes(seg['words']):
+                words.append(w['word'])
+                start.append(w['start'])
+                end.append(w['end'])
+            bounds.append(len(words))
+        return cls(words, start, end, bounds)
+
+    def without_empty_words(self) -> "WordTimeline":
+        """Copia senza le parole vuote (o di soli spazi), con i confini dei segmenti rimappati."""
+        keep = np.fromiter((bool(word.strip()) for word in self.words), dtype=bool, count=len(self.words))
+        if keep.all():
+            return self
+        index = np.flatnonzero(keep)
+        kept_before = np.concatenate(([0], np.cumsum(keep)))
+        return WordTimeline([self.words[i] for i in index.tolist()], self.start[index], self.end[index],
+                            kept_before[self.segment_bounds])
+
+    def __len__(self):
+        return len(self.words)
+
+
+# --- Modalità greedy (come il notebook) ---
+
+def _pack_loop(lengths: Sequence[int], a: int, b: int) -> List[int]:
+    """Inizi dei blocchi di un segmento con il ciclo parola per parola del notebook."""
+    starts, i = [], a
+    while i < b:
+        starts.append(i)
+        block_len = 0
+        while i < b:
+            proposed_len = block_len + (lengths[i] + (1 if block_len > 0 else 0))
+            if proposed_len > MAX_LEN_BLOCK and block_len > 0:
+                break
+            block_len = proposed_len
+            i += 1
+    return starts
+
+
+def greedy_block_bounds(timeline: WordTimeline) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Inizio e fine (esclusa) dei blocchi della prima fase del notebook: ogni segmento è riempito
+    parola per parola fino a `MAX_LEN_BLOCK` caratteri (spazi inclusi).
+    """
+    # cumulative[k] = somma di (lunghezza + 1) delle parole prima di k: le parole i..j-1 occupano
+    # cumulative[j] - cumulative[i] - 1 caratteri
+    cumulative = np.concatenate(([0], np.cumsum(timeline.length + 1)))
+    # Fine massima di un blocco che inizia a ogni parola (almeno una parola)
+    reach = np.searchsorted(cumulative, cumulative[:-1] + MAX_LEN_BLOCK + 1, side="right") - 1
+    reach = np.maximum(reach, np.arange(1, len(timeline) + 1)).tolist()
+    lengths = timeline.length.tolist()
+
+    starts, stops = [], []
+    bounds = timeline.segment_bounds.tolist()
+    for a, b in zip(bounds[:-1], bounds[1:]):
+        if 0 in lengths[a:b]:
+            # Con parole vuote il notebook non conta lo spazio prima della prima parola non vuota
+            seg_starts = _pack_loop(lengths, a, b)
+            starts += seg_starts
+            stops += seg_starts[1:] + [b]
+            continue
+        i = a
+        while i < b:
+            j = min(reach[i], b)
+            starts.append(i)
+            stops.append(j)
+            i = j
+    return np.asarray(starts, dtype=np.int64), np.asarray(stops, dtype=np.int64)
+
+
+def greedy_blocks(timeline: WordTimeline) -> Tuple[List[float], List[float], List[str]]:
+    """Blocchi (inizi, fini, testi) di `create_srt_from_json` di readability.ipynb."""
+    block_start, block_stop = greedy_block_bounds(timeline)
+    if len(block_start) == 0:
+        return [], [], []
+    # 1) Blocchi per segmento con durata provvisoria tra minimo e massimo
+    start = timeline.start[block_start]
+    end = timeline.end[block_stop - 1]
+    duration = end - start
+    end = np.where(duration < MIN_DISPLAY_TIME, start + MIN_DISPLAY_TIME,
+                   np.where(duration > MAX_DISPLAY_TIME, start + MAX_DISPLAY_TIME, end))
+    words = timeline.words
+    flat = [smart_line_break(" ".join(words[i:j])).replace("\n", " ")
+            for i, j in zip(block_start.tolist(), block_stop.tolist())]
+    start, end = start.tolist(), end.tolist()
+
+    # 2) Fusione dei blocchi consecutivi finché testo e durata lo consentono
+    out_start, out_end, out_text = [], [], []
+    idx = 0
+    while idx < len(flat):
+        start_time, end_time = start[idx], end[idx]
+        merged_text = flat[idx]
+        idx += 1
+        while idx < len(flat):
+            if end[idx] - start_time > MAX_DISPLAY_TIME:
+                break
+            candidate_text = collapse_spaces(merged_text + " " + flat[idx])
+            if len(candidate_text) > MAX_LEN_BLOCK:
+                break
+            merged_text = candidate_text
+            end_time = end[idx]
+            idx += 1
+        merged_text = smart_line_break(merged_text)
+
+        if out_end:
+            prev_end = out_end[-1]
+            if start_time - prev_end < MIN_GAP:
+                start_time = prev_end + MIN_GAP
+                if end_time < start_time:
+                    end_time = start_time + MIN_DISPLAY_TIME
+        out_start.append(start_time)
+        out_end.append(end_time)
+        out_text.append(merged_text)
+    return out_start, out_end, out_text
+
+
+# --- Modalità dp ---
+
+def _block_costs(timeline: WordTimeline, max_words: int, max_pause: float, max_cps: float,
+                 cumulative: np.ndarray) -> np.ndarray:
+    """
+    costs[n, j]: costo del blocco con le n parole che terminano prima di j (inf se non ammesso).
+    Calcolato in modo vettoriale su j per ogni n.
+    """
+    n_words = len(timeline)
+    costs = np.full((max_words + 1, n_words + 1), np.inf)
+    j = np.arange(1, n_words + 1)
+    last = j - 1
+    # Costo del confine dopo l'ultima parola: basso su fine frase o pausa, medio su , ; :
+    end_penalty = np.where((timeline.punctuation[last] == 2) | (timeline.pause[last] >= 0.5), 0.0,
+                           np.where(timeline.punctuation[last] == 1, 0.3, 1.0))
+    segment_end = np.zeros(n_words + 1, dtype=bool)
+    segment_end[timeline.segment_bounds] = True
+    end_penalty = np.where(segment_end[j], np.minimum(end_penalty, 0.2), end_penalty)
+    # Andate a capo possibili: la prima riga da i arriva al più a line_reach[i], la seconda
+    # riga fino a j parte almeno da line_from[j]
+    line_reach = np.searchsorted(cumulative, cumulative + MAX_LEN_LINE + 1, side="right") - 1
+    line_from = np.searchsorted(cumulative, cumulative - MAX_LEN_LINE - 1, side="left")
+
+    internal_pause = np.zeros(n_words)
+    for n in range(1, max_words + 1):
+        valid = j >= n
+        jj, ii = j[valid], j[valid] - n
+        if n > 1:
+            # pausa massima tra le parole del blocco, aggiornata aggiungendo la parola iniziale
+            internal_pause = np.maximum(internal_pause[1:], timeline.pause[ii]) if n > 2 else timeline.pause[ii]
+        chars = cumulative[jj] - cumulative[ii] - 1
+        duration = timeline.end[jj - 1] - timeline.start[ii]
+        fits = (chars <= MAX_LEN_LINE) | (np.maximum(line_from[jj], ii + 1) <= np.minimum(line_reach[ii], jj - 1))
+        allowed = fits & (chars <= MAX_LEN_BLOCK) & (duration <= MAX_DISPLAY_TIME)
+        if n > 1:
+            allowed &= internal_pause <= max_pause
+        else:
+            allowed[:] = True  # una parola fa sempre un blocco
+        shown = np.maximum(duration, MIN_DISPLAY_TIME)
+        cost = (1.0
+                + 2.0 * np.maximum(0.0, MIN_DISPLAY_TIME - duration)
+                + 0.2 * np.maximum(0.0, chars / shown - max_cps)
+                + (internal_pause if n > 1 else 0.0)
+                + end_penalty[jj - 1])
+        costs[n, jj] = np.where(allowed, cost, np.inf)
+        if not allowed.any():
+            return costs[:n]
+    return costs
+
+
+def _line_break(words: List[str], punctuation: Sequence[int]) -> str:
+    """Due righe entro `MAX_LEN_LINE` se necessario: preferisce la punteggiatura, poi l'equilibrio."""
+    text = " ".join(words)
+    if len(text) <= MAX_LEN_LINE:
+        return text
+    best, best_cost = None, None
+    line1 = -1
+    for m in range(1, len(words)):
+        line1 += len(words[m - 1]) + 1
+        line2 = len(text) - line1 - 1
+        if line1 > MAX_LEN_LINE:
+            break
+        if line2 > MAX_LEN_LINE:
+            continue
+        cost = abs(line1 - line2) - (20 if punctuation[m - 1] == 2 else 10 if punctuation[m - 1] == 1 else 0)
+        if best_cost is None or cost < best_cost:
+            best, best_cost = m, cost
+    if best is None:
+        return smart_line_break(text)
+    return " ".join(words[:best]) + "\n" + " ".join(words[best:])
+
+
+def dp_blocks(timeline: WordTimeline, max_pause: float = 1.5,
+              max_cps: float = MAX_CPS) -> Tuple[List[float], List[float], List[str]]:
+    """
+    Blocchi scelti con la programmazione dinamica su tutto l'episodio.
+
+    Args:
+        max_pause: pausa massima (s) tra due parole dello stesso blocco.
+        max_cps: caratteri al secondo oltre i quali il blocco è penalizzato.
+    """
+    timeline = timeline.without_empty_words()
+    n_words = len(timeline)
+    if n_words == 0:
+        return [], [], []
+    words = [word.strip() for word in timeline.words]
+    lengths = np.fromiter(map(len, words), dtype=np.int64, count=n_words)
+    cumulative = np.concatenate(([0], np.cumsum(lengths + 1)))
+    max_words = int(min(n_words, MAX_LEN_BLOCK // 2 + 1))
+    costs = _block_costs(timeline, max_words, max_pause, max_cps, cumulative)
+    max_words = len(costs) - 1
+
+    # best[j]: costo minimo delle prime j parole; choice[j]: parole dell'ultimo blocco. I blocchi
+    # ammessi che terminano in j sono quelli da 1 a allowed[j] parole (i vincoli sono monotoni)
+    allowed = np.isfinite(costs[1:]).sum(axis=0).tolist()
+    columns = costs[1:].T.tolist()
+    best = [0.0] * (n_words + 1)
+    choice = [0] * (n_words + 1)
+    for j in range(1, n_words + 1):
+        column, best_j, choice_j = columns[j], np.inf, 1
+        for n in range(1, allowed[j] + 1):
+            total = best[j - n] + column[n - 1]
+            if total < best_j:
+                best_j, choice_j = total, n
+        best[j], choice[j] = best_j, choice_j
+
+    stops = []
+    j = n_words
+    while j > 0:
+        stops.append(j)
+        j -= choice[j]
+    stops = np.asarray(stops[::-1], dtype=np.int64)
+    block_start = np.concatenate(([0], stops[:-1]))
+
+    # Tempi: almeno MIN_DISPLAY_TIME se c'è spazio prima del blocco successivo, mai oltre
+    # MAX_DISPLAY_TIME, e mai prima della fine dell'ultima parola
+    start = timeline.start[block_start]
+    spoken_end = timeline.end[stops - 1]
+    target = np.minimum(np.maximum(spoken_end, start + MIN_DISPLAY_TIME), start + MAX_DISPLAY_TIME)
+    limit = np.append(start[1:] - MIN_GAP, np.inf)
+    end = np.maximum(np.minimum(target, limit), np.minimum(spoken_end, target))
+
+    punctuation = timeline.punctuation.tolist()
+    texts = [_line_break(words[i:j], punctuation[i:j]) for i, j in zip(block_start.tolist(), stops.tolist())]
+    return start.tolist(), end.tolist(), texts
+
+
+def create_srt_from_json(data_json: list, mode: str = "greedy") -> str:
+    """
+    SRT dai timestamp di parola di un JSON di predizione.
+
+    Args:
+        mode: "greedy" (identico a readability.ipynb) o "dp".
+    """
+    timeline = WordTimeline.from_json(data_json)
+    if mode == "greedy":
+        return to_srt(*greedy_blocks(timeline))
+    if mode == "dp":
+        return to_srt(*dp_blocks(timeline))
+    raise ValueError(f"Modalità '{mode}' non supportata: usa 'greedy' o 'dp'")
@@ -1,117 +1,162 @@
-import subprocess
-import json
-import pandas as pd
-from concurrent.futures import ProcessPoolExecutor, as_completed
 import os
-from utils import names
-from multiprocessing import Manager
+import re
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from importlib.metadata import version
+
+# Questo script ha lo stesso nome del pacchetto `suber`: se lanciato come `python metrics/suber.py`
+# la sua cartella è in testa a sys.path e nasconderebbe il pacchetto installato.
+_SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path[:] = [p for p in sys.path if os.path.abspath(p or os.curdir) != _SCRIPT_DIR]
+
+from suber.data_types import LineBreak, Subtitle as SuberSubtitle, TimedWord  # noqa: E402
+from suber.metrics.suber import calculate_SubER  # noqa: E402
+from suber.utilities import set_approximate_word_times  # noqa: E402
+
+from utils import names  # noqa: E402
+from standardization import standardization_utils  # noqa: E402
+from metrics.result_store import ResultStore, config_hash  # noqa: E402
 
 # Funzioni di utilità
 files = names.get_file_names()
 models = names.get_model_names()
-SCORES_FILE = "suber_score.txt"
-
-
-def load_existing_scores(path=SCORES_FILE):
-    """Carica le combinazioni già presenti nel file di score."""
-    existing = set()
-    if os.path.exists(path):
-        with open(path, "r", encoding="utf-8") as f:
-            for line in f:
-                try:
-                    model, file, _ = [x.strip() for x in line.split(" - ")]
-                    existing.add((model, file))
-                except ValueError:
-                    continue  # in caso di righe malformate
-    return existing
+LEGACY_SCORES_FILE = "suber_score.txt"
+METRIC = "SubER"
+SUBER_CONFIG_HASH = config_hash(
+    metric=METRIC, reference="ground-truth-cleaned", hypothesis="improved-srt", suber=version("subtitle-edit-rate"))
+_FORMATTING_TAGS = re.compile('</?[^>]>')
 
 
-def clean_srt_file(path):
+def import_legacy_scores(store, path=LEGACY_SCORES_FILE):
     """
-    Legge e riscrive un file SRT, sostituendo i caratteri non validi
-    con il simbolo � (errors='replace').
+    Importa nello store i punteggi del vecchio file di testo `model - file - score`.
+    Il modello non contiene mai il separatore e il punteggio è l'ultimo campo, quindi il nome
+    del file viene ricostruito anche se contiene " - ". Non sovrascrive risultati già presenti.
     """
     if not os.path.exists(path):
-        raise FileNotFoundError(f"File SRT non trovato: {path}")
-
+        return 0
+    imported = 0
     with open(path, "r", encoding="utf-8") as f:
-        content = f.read()
-    
-    import unicodedata
-    import re
-
-    # nfkd = unicodedata.normalize('NFKD', content)
-    # filtered = ''.join(c for c in nfkd if not unicodedata.combining(c))
-    cleaned = re.sub(r"[^\x00-\x7F]", "�", content)
-
-    path = path.replace('.srt','') + '_decoded.srt'
-
-    with open(path, "w", encoding="utf-8") as f:
-        f.write(cleaned)
-    
-    return path
+        for line in f:
+            try:
+                model, rest = line.strip().split(" - ", 1)
+                file, score = rest.rsplit(" - ", 1)
+                store.put(METRIC, model, file, float(score), SUBER_CONFIG_HASH, replace=False)
+                imported += 1
+            except ValueError:
+                continue  # in caso di righe malformate
+    return imported
 
 
-def get_suber(file, model, lock):
-    """Esegue il calcolo dello score SubER tra due file SRT."""
-    reference_srt_path = os.path.normpath(os.path.join("..", "data", "srt", "ground-truth-cleaned", f"{file}.srt"))
-    hypothesis_srt_path = os.path.normpath(os.path.join("..", "data", model, "improved-srt", f"{file}.srt"))
+def track_to_suber_subtitles(track):
+    """
+    Converte una `SubtitleTrack` (o una lista di `Subtitle`) nei sottotitoli usati da SubER,
+    replicando il lettore SRT del pacchetto: tag di formattazione rimossi, interruzioni di
+    riga/blocco sulle parole e tempi delle parole interpolati linearmente nel sottotitolo.
+    """
+    subtitles = []
+    for sub in track:
+        start_time = sub.start_time / 1000
+        end_time = sub.end_time / 1000
+        word_list = []
+        for line in sub.text.splitlines():
+            line = _FORMATTING_TAGS.sub('', line.strip())
+            word_list.extend(
+                TimedWord(string=word, subtitle_start_time=start_time, subtitle_end_time=end_time)
+                for word in line.split())
+            if word_list:
+                word_list[-1].line_break = LineBreak.END_OF_LINE
+        if word_list:
+            word_list[-1].line_break = LineBreak.END_OF_BLOCK
+            set_approximate_word_times(word_list, start_time, end_time)
+        subtitles.append(SuberSubtitle(word_list=word_list, index=len(subtitles) + 1,
+                                       start_time=start_time, end_time=end_time))
+    return subtitles
+
+
+def read_suber_subtitles(path):
+    """
+    Legge un file SRT una sola volta, in memoria, sostituendo i caratteri non decodificabili
+    con il simbolo � (errors='replace') per evitare UnicodeDecodeError.
+    """
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"File SRT non trovato: {path}")
+    return track_to_suber_subtitles(standardization_utils.read_track(path, errors="replace"))
 
-    # Ripulisce il file ipotesi per evitare UnicodeDecodeError
-    new_hypothesis_path = clean_srt_file(hypothesis_srt_path)
 
-    command = [
-        "suber",
-        "-H", hypothesis_srt_path,
-        "-R", reference_srt_path
-    ]
-    result = subprocess.run(command, capture_output=True, text=True, check=True)
-    output = result.stdout.strip()
-    score = json.loads(output)
+def calculate_suber(hypothesis, reference):
+    """
+    Calcola SubER nello stesso processo tra due tracce già lette.
+    Accetta sottotitoli SubER oppure `SubtitleTrack`/liste di `Subtitle`.
+    """
+    if not (hypothesis and isinstance(hypothesis[0], SuberSubtitle)):
+        hypothesis = track_to_suber_subtitles(hypothesis)
+    if not (reference and isinstance(reference[0], SuberSubtitle)):
+        reference = track_to_suber_subtitles(reference)
+    return calculate_SubER(hypothesis=hypothesis, reference=reference)
 
-    print(f"[INFO] SubER score for file '{file}' with model '{model}': {score['SubER']}")
 
-    with lock:
-        with open(SCORES_FILE, "a", encoding="utf-8") as f:
-            f.write(f"{model} - {file} - {score['SubER']}\n")
+def reference_path(file):
+    return os.path.normpath(os.path.join("..", "data", "srt", "ground-truth-cleaned", f"{file}.srt"))
 
-    return score['SubER']
 
+def hypothesis_path(file, model):
+    return os.path.normpath(os.path.join("..", "data", model, "improved-srt", f"{file}.srt"))
 
-def process_task(file, model, lock, existing):
-    """Funzione wrapper per parallelizzare il calcolo SubER di un singolo file/model."""
-    if (model, file) in existing:
-        print(f"[SKIP] Già calcolato: file '{file}' con modello '{model}'")
-        return (file, model, None)
 
-    print(f"[INFO] Calcolo SubER per file '{file}' con modello '{model}'")
-    return (file, model, get_suber(file, model, lock))
+def process_file(file, file_models, store):
+    """
+    Calcola SubER per un file su tutti i modelli richiesti: la reference viene letta una sola
+    volta e riusata per ogni ipotesi. Ogni punteggio viene scritto subito nello store dal
+    worker stesso. Restituisce una lista di (file, model, errore) per i casi falliti.
+    """
+    reference = read_suber_subtitles(reference_path(file))
+    errors = []
+    for model in file_models:
+        print(f"[INFO] Calcolo SubER per file '{file}' con modello '{model}'")
+        try:
+            hypothesis = read_suber_subtitles(hypothesis_path(file, model))
+            score = calculate_suber(hypothesis, reference)
+        except Exception as e:
+            errors.append((file, model, str(e)))
+            continue
+
+        print(f"[INFO] SubER score for file '{file}' with model '{model}': {score}")
+        store.put(METRIC, model, file, score, SUBER_CONFIG_HASH)
+    return errors
 
 
 if __name__ == "__main__":
-    # Imposta DataFrame
-    suber_results = pd.DataFrame(index=files, columns=models)
-
-    # Carica combinazioni già presenti
-    existing = load_existing_scores()
+    store = ResultStore()
+
+    # Carica combinazioni già presenti (migrando l'eventuale vecchio file di testo)
+    import_legacy_scores(store)
+    existing = store.completed(METRIC, SUBER_CONFIG_HASH)
+
+    # Un task per file: ogni worker legge la reference una volta e valuta tutti i modelli mancanti
+    tasks = {}
+    for file in files:
+        missing = [model for model in models if (model, file) not in existing]
+        for model in models:
+            if model not in missing:
+                print(f"[SKIP] Già calcolato: file '{file}' con modello '{model}'")
+        if missing:
+            tasks[file] = missing
 
     # Numero massimo di core disponibili
-    max_workers = os.cpu_count() - 2
-
-    tasks = [(file, model) for model in models for file in files]
-    manager = Manager()
-    lock = manager.Lock()
+    max_workers = max(1, min(len(tasks), os.cpu_count() - 2))
 
     with ProcessPoolExecutor(max_workers=max_workers) as executor:
-        futures = [executor.submit(process_task, file, model, lock, existing) for file, model in tasks]
+        futures = {executor.submit(process_file, file, file_models, store): file for file, file_models in tasks.items()}
 
         for future in as_completed(futures):
             try:
-                file, model, score = future.result()
-                if score is not None:
-                    suber_results.loc[file, model] = score
+                for file, model, error in future.result():
+                    print(f"[ERRORE] Durante l'elaborazione {file} {model}: {error}")
             except Exception as e:
-                print(f"[ERRORE] Durante l'elaborazione {file} {model}: {e}")
+                print(f"[ERRORE] Durante l'elaborazione {futures[future]}: {e}")
+
+    suber_results = store.to_frame(METRIC, SUBER_CONFIG_HASH, index=files, columns=models)
 
     print("\n=== Calcolo completato ===")
     #print(suber_results)
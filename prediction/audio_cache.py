@@ -0,0 +1,191 @@
+"""
+Cache locale dell'audio decodificato, condivisa dai backend di predizione.
+
+Ogni sorgente viene decodificata una sola volta con ffmpeg in PCM mono a 16 kHz (lo stesso
+comando di `whisper.load_audio` / `whisperx.load_audio`) e salvata come file `.npy` il cui nome
+è l'hash del contenuto della sorgente. Le letture successive aprono il file come memmap
+copy-on-write: l'audio non viene copiato in memoria e le slice per chunk/segmenti VAD sono viste
+sullo stesso buffer.
+
+La cartella si imposta con la variabile d'ambiente AUDIO_CACHE_DIR. I file sono limitati per
+numero (`max_entries`) e/o dimensione totale (`max_bytes`, di default AUDIO_CACHE_MAX_BYTES o
+4 GiB): dopo ogni scrittura vengono eliminati quelli usati meno di recente (LRU, l'mtime del
+file è aggiornato a ogni hit). Un file eliminato mentre è aperto come memmap resta leggibile da
+chi lo sta usando.
+"""
+import base64
+import hashlib
+import os
+import subprocess
+import tempfile
+import time
+from typing import Dict, Optional
+
+import numpy as np
+
+SAMPLE_RATE = 16000
+DEFAULT_CACHE_DIR = os.environ.get("AUDIO_CACHE_DIR", os.path.join(tempfile.gettempdir(), "audio_cache"))
+DEFAULT_MAX_BYTES = int(os.environ.get("AUDIO_CACHE_MAX_BYTES", 4 << 30))
+_HASH_BLOCK_BYTES = 1 << 20
+
+
+def file_hash(path: str) -> str:
+    """MD5 del contenuto del file (lo stesso hash che GCS espone come `md5_hash`)."""
+    md5 = hashlib.md5()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(_HASH_BLOCK_BYTES), b""):
+            md5.update(block)
+    return md5.hexdigest()
+
+
+def decode_audio(path: str, sample_rate: int = SAMPLE_RATE) -> np.ndarray:
+    """Decodifica un file audio in PCM mono float32 a `sample_rate` Hz con ffmpeg."""
+    cmd = ["ffmpeg", "-nostdin", "-threads", "0", "-i", path,
+           "-f", "s16le", "-ac", "1", "-acodec", "pcm_s16le", "-ar", str(sample_rate), "-"]
+    try:
+        out = subprocess.run(cmd, capture_output=True, check=True).stdout
+    except subprocess.CalledProcessError as e:
+        raise RuntimeError(f"Impossibile decodificare l'audio {path}: {e.stderr.decode(errors='replace')}") from e
+    return np.frombuffer(out, np.int16).flatten().astype(np.float32) / 32768.0
+
+
+class AudioCache:
+    """
+    Cache content-addressed dell'audio decodificato.
+
+    Args:
+        cache_dir: cartella dei file `.npy`.
+        sample_rate: frequenza di campionamento dell'audio in cache.
+        dtype: "float32" (pronto per i modelli, nessuna conversione) oppure "int16" (metà
+            spazio su disco; `load` restituisce comunque float32, con una conversione).
+        max_entries: numero massimo di file in cache (None: nessun limite).
+        max_bytes: dimensione massima dei file in cache, in byte (None: nessun limite).
+    """
+
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR, sample_rate: int = SAMPLE_RATE, dtype: str = "float32",
+                 max_entries: Optional[int] = None, max_bytes: Optional[int] = DEFAULT_MAX_BYTES):
+        if dtype not in ("float32", "int16"):
+            raise ValueError("dtype deve essere 'float32' o 'int16'")
+        self.cache_dir = cache_dir
+        self.sample_rate = sample_rate
+        self.dtype = dtype
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.evictions = 0
+
+    def path_for(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}_{self.sample_rate}_{self.dtype}.npy")
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        """Audio in cache per `key`, oppure None."""
+        path = self.path_for(key)
+        try:
+            audio = np.load(path, mmap_mode="c")
+        except FileNotFoundError:  # mai scritto, oppure appena eliminato da `evict`
+            return None
+        try:
+            os.utime(path)  # usato ora: ultimo a essere eliminato
+        except FileNotFoundError:
+            pass
+        return audio if self.dtype == "float32" else audio.astype(np.float32) / 32768.0
+
+    def put(self, key: str, audio: np.ndarray) -> np.ndarray:
+        """Salva l'audio (float32) in cache e lo restituisce riaperto come memmap."""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        if self.dtype == "int16":
+            audio = np.clip(np.round(audio * 32768.0), -32768, 32767).astype(np.int16)
+        # Scrittura atomica: più processi possono decodificare la stessa sorgente
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".npy.tmp")
+        with os.fdopen(fd, "wb") as f:
+            np.save(f, audio)
+        os.replace(tmp_path, self.path_for(key))
+        audio = self.get(key)
+        self.evict(keep=self.path_for(key))
+        return audio
+
+    def _entries(self):
+        """File della cache (anche di altri sample_rate/dtype) come (mtime, size, path)."""
+        entries = []
+        with os.scandir(self.cache_dir) as it:
+            for entry in it:
+                if not entry.name.endswith(".npy"):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:  # eliminato da un altro processo
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def evict(self, keep: Optional[str] = None):
+        """Elimina i file meno recenti oltre `max_entries` o `max_bytes`; `keep` non viene mai eliminato."""
+        if self.max_entries is None and self.max_bytes is None:
+            return
+        kept_entries = kept_bytes = 0
+        for _, size, path in sorted(self._entries(), key=lambda e: (e[2] != keep, -e[0], e[2])):
+            kept_entries += 1
+            kept_bytes += size
+            over = ((self.max_entries is not None and kept_entries > self.max_entries)
+                    or (self.max_bytes is not None and kept_bytes > self.max_bytes))
+            if over and path != keep:
+                try:
+                    os.remove(path)
+                    self.evictions += 1
+                except FileNotFoundError:
+                    pass
+
+    def stats(self) -> Dict[str, int]:
+        entries = self._entries() if os.path.isdir(self.cache_dir) else []
+        return {"entries": len(entries), "bytes": sum(size for _, size, _ in entries), "evictions": self.evictions}
+
+    def load(self, path: str, key: Optional[str] = None, timings: Optional[Dict[str, float]] = None) -> np.ndarray:
+        """Audio di un file locale, decodificato solo se non è già in cache."""
+        key = key or file_hash(path)
+        audio = self.get(key)
+        if audio is not None:
+            return audio
+        start = time.perf_counter()
+        decoded = decode_audio(path, self.sample_rate)
+        if timings is not None:
+            timings["decode"] = time.perf_counter() - start
+        return self.put(key, decoded)
+
+    def load_gcs(self, storage_client, gcs_uri: str, timings: Optional[Dict[str, float]] = None) -> np.ndarray:
+        """
+        Audio di un oggetto GCS. Se l'oggetto espone `md5_hash` la cache viene consultata prima
+        del download, quindi una sorgente già decodificata non viene nemmeno scaricata.
+        """
+        if not gcs_uri.startswith("gs://"):
+            raise ValueError("URI non valido, deve iniziare con 'gs://'")
+        bucket_name, blob_name = gcs_uri.replace("gs://", "").split("/", 1)
+        blob = storage_client.bucket(bucket_name).get_blob(blob_name)
+        if blob is None:
+            raise FileNotFoundError(f"Oggetto non trovato: {gcs_uri}")
+
+        key = base64.b64decode(blob.md5_hash).hex() if getattr(blob, "md5_hash", None) else None
+        if key is not None:
+            audio = self.get(key)
+            if audio is not None:
+                return audio
+
+        suffix = os.path.splitext(blob_name)[1] or ".tmp"
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            tmp_path = os.path.join(tmp_dir, f"source{suffix}")
+            start = time.perf_counter()
+            blob.download_to_filename(tmp_path)
+            if timings is not None:
+                timings["download"] = time.perf_counter() - start
+            return self.load(tmp_path, key=key, timings=timings)
+
+    def lookup_gcs(self, storage_client, gcs_uri: str) -> Optional[np.ndarray]:
+        """Audio in cache per un oggetto GCS, senza scaricarlo; None se assente o senza md5."""
+        bucket_name, blob_name = gcs_uri.replace("gs://", "").split("/", 1)
+        blob = storage_client.bucket(bucket_name).get_blob(blob_name)
+        if blob is None or not getattr(blob, "md5_hash", None):
+            return None
+        return self.get(base64.b64decode(blob.md5_hash).hex())
+
+    def slice(self, audio: np.ndarray, start_sec: float, end_sec: float) -> np.ndarray:
+        """Vista (senza copia) sull'intervallo [start_sec, end_sec) dell'audio."""
+        return audio[int(start_sec * self.sample_rate):int(end_sec * self.sample_rate)]
+
@@ -0,0 +1,176 @@
+"""
+Micro-batching asincrono delle finestre audio tra richieste concorrenti.
+
+Le richieste non chiamano il modello direttamente: accodano le proprie finestre (es. 30 s di
+audio) con `submit` e attendono il risultato. Un unico worker raccoglie le finestre in coda,
+da qualunque richiesta provengano, fino a `max_batch_size` oppure finché sono passati
+`max_wait_ms` dalla prima, esegue il batch in un thread dedicato e restituisce a ogni richiesta
+i propri risultati.
+
+Il thread dedicato è l'unico che deve usare il modello: gli endpoint sincroni che chiamano il
+modello fuori dai batch (es. `model.transcribe` in /predict) passano da `call`, che esegue la
+funzione sullo stesso thread, tra un batch e l'altro.
+
+`stats()` espone profondità della coda, riempimento dei batch e percentili delle latenze.
+"""
+import asyncio
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+
+
+class MicroBatcher:
+    """
+    Args:
+        run_batch: funzione sincrona lista di item -> lista di risultati (stessa lunghezza e
+            ordine). Un elemento del risultato che è un'eccezione viene sollevato solo nella
+            richiesta corrispondente; un'eccezione di `run_batch` fallisce tutto il batch.
+        max_batch_size: numero massimo di item per batch (dimensionato sulla GPU).
+        max_wait_ms: attesa massima dopo il primo item prima di eseguire un batch incompleto.
+        history: numero di campioni recenti usati per i percentili.
+    """
+
+    def __init__(self, run_batch: Callable[[List[Any]], Sequence[Any]], max_batch_size: int = 16,
+                 max_wait_ms: float = 20.0, history: int = 2048, name: str = "batcher"):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size deve essere almeno 1")
+        self.run_batch = run_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.name = name
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._in_flight = 0
+
+        self.batches = 0
+        self.items = 0
+        self.errors = 0
+        self._batch_sizes = deque(maxlen=history)
+        self._queue_waits = deque(maxlen=history)
+        self._latencies = deque(maxlen=history)
+        self._run_times = deque(maxlen=history)
+
+    # --- Ciclo di vita ---
+    async def start(self):
+        if self._worker is not None:
+            return
+        self._queue = asyncio.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=self.name)
+        self._worker = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._worker is None:
+            return
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        while not self._queue.empty():
+            _, future, _ = self._queue.get_nowait()
+            if not future.done():
+                future.set_exception(RuntimeError(f"{self.name} arrestato"))
+        self._executor.shutdown(wait=True)
+        self._worker = None
+
+    # --- Richieste ---
+    async def submit(self, item: Any) -> Any:
+        """Accoda un item e ne attende il risultato."""
+        if self._worker is None:
+            raise RuntimeError(f"{self.name} non avviato")
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((item, future, time.perf_counter()))
+        return await future
+
+    async def submit_many(self, items: Sequence[Any], return_exceptions: bool = False) -> List[Any]:
+        """Accoda tutti gli item di una richiesta insieme; i risultati sono nello stesso ordine."""
+        return await asyncio.gather(*(self.submit(item) for item in items), return_exceptions=return_exceptions)
+
+    def call(self, fn: Callable, *args, **kwargs) -> Any:
+        """
+        Esegue `fn(*args, **kwargs)` sul thread del batcher, in serie con i batch, e ne attende
+        il risultato. Da usare nei thread sincroni (non nel loop asyncio, che resterebbe bloccato).
+        """
+        if self._executor is None:
+            raise RuntimeError(f"{self.name} non avviato")
+        return self._executor.submit(fn, *args, **kwargs).result()
+
+    # --- Worker ---
+    async def _collect(self) -> List[tuple]:
+        batch = [await self._queue.get()]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            items = [item for item, _, _ in batch]
+            started = time.perf_counter()
+            self._in_flight = len(items)
+            try:
+                results = await loop.run_in_executor(self._executor, self.run_batch, items)
+                if len(results) != len(items):
+                    raise RuntimeError(f"run_batch ha restituito {len(results)} risultati per {len(items)} item")
+            except Exception as e:
+                results = [e] * len(items)
+            finally:
+                self._in_flight = 0
+            finished = time.perf_counter()
+
+            for (_, future, queued_at), result in zip(batch, results):
+                if future.done():  # richiesta annullata nel frattempo
+                    continue
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+                self._queue_waits.append(started - queued_at)
+                self._latencies.append(finished - queued_at)
+            self.batches += 1
+            self.items += len(items)
+            self.errors += sum(isinstance(result, Exception) for result in results)
+            self._batch_sizes.append(len(items))
+            self._run_times.append(finished - started)
+
+    # --- Statistiche ---
+    @staticmethod
+    def _percentiles(values) -> Dict[str, Optional[float]]:
+        if not values:
+            return {"p50": None, "p90": None, "p99": None}
+        p50, p90, p99 = np.percentile(np.fromiter(values, dtype=np.float64), [50, 90, 99])
+        return {"p50": round(float(p50), 4), "p90": round(float(p90), 4), "p99": round(float(p99), 4)}
+
+    def stats(self) -> Dict[str, Any]:
+        """Stato corrente e statistiche sugli ultimi `history` batch/item (tempi in secondi)."""
+        sizes = list(self._batch_sizes)
+        return {
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "in_flight": self._in_flight,
+            "batches": self.batches,
+            "items": self.items,
+            "errors": self.errors,
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000.0,
+            "mean_batch_size": round(float(np.mean(sizes)), 3) if sizes else None,
+            "batch_fill": round(float(np.mean(sizes)) / self.max_batch_size, 4) if sizes else None,
+            "queue_wait": self._percentiles(self._queue_waits),
+            "latency": self._percentiles(self._latencies),
+            "batch_time": self._percentiles(self._run_times),
+        }
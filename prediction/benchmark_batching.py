@@ -0,0 +1,86 @@
+"""
+Benchmark su CPU di `MicroBatcher` con un modello fittizio il cui costo per batch è
+`overhead + per_item * n` (come una GPU: il costo fisso domina finché il batch non è pieno).
+
+Confronta `--clients` client concorrenti che trascrivono file da `--windows` finestre:
+- serializzato: ogni richiesta chiama il modello da sola, una finestra alla volta (come /predict);
+- micro-batch: tutte le finestre passano dallo stesso MicroBatcher (come /predict_batched).
+Stampa i tempi e le statistiche del batcher; la correttezza (risultati alla richiesta giusta,
+modello usato da un solo thread) è verificata in tests/test_batching.py e
+tests/test_whisper_large_endpoint.py.
+
+Uso:
+    python prediction/benchmark_batching.py --clients 8 --windows 20
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from prediction.batching import MicroBatcher  # noqa: E402
+
+
+class FakeModel:
+    """Modello a costo fisso per batch; un solo batch alla volta, come su una GPU condivisa."""
+
+    def __init__(self, overhead_ms: float, per_item_ms: float):
+        self.overhead = overhead_ms / 1000.0
+        self.per_item = per_item_ms / 1000.0
+        self.lock = threading.Lock()
+        self.calls = 0
+
+    def __call__(self, windows):
+        with self.lock:
+            self.calls += 1
+            time.sleep(self.overhead + self.per_item * len(windows))
+            return [f"testo {client}-{window}" for client, window in windows]
+
+
+async def serialized(model, clients, windows):
+    async def client(c):
+        return [(await asyncio.to_thread(model, [(c, w)]))[0] for w in range(windows)]
+    return await asyncio.gather(*(client(c) for c in range(clients)))
+
+
+async def batched(model, clients, windows, max_batch_size, max_wait_ms):
+    batcher = MicroBatcher(model, max_batch_size=max_batch_size, max_wait_ms=max_wait_ms)
+    await batcher.start()
+    try:
+        results = await asyncio.gather(*(batcher.submit_many([(c, w) for w in range(windows)]) for c in range(clients)))
+        return results, batcher.stats()
+    finally:
+        await batcher.stop()
+
+
+def run(clients, windows, max_batch_size, max_wait_ms, overhead_ms, per_item_ms):
+    print(f"[INFO] {clients} client x {windows} finestre, batch max {max_batch_size}, attesa max {max_wait_ms} ms")
+
+    model = FakeModel(overhead_ms, per_item_ms)
+    t0 = time.perf_counter()
+    asyncio.run(serialized(model, clients, windows))
+    t_serial = time.perf_counter() - t0
+    print(f"  serializzato {t_serial:.2f} s   ({model.calls} chiamate al modello)")
+
+    model = FakeModel(overhead_ms, per_item_ms)
+    t0 = time.perf_counter()
+    _, stats = asyncio.run(batched(model, clients, windows, max_batch_size, max_wait_ms))
+    t_batch = time.perf_counter() - t0
+    print(f"  micro-batch  {t_batch:.2f} s   ({model.calls} chiamate al modello, x{t_serial / t_batch:.1f})")
+    print(json.dumps(stats, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--windows", type=int, default=20)
+    parser.add_argument("--max-batch-size", type=int, default=16)
+    parser.add_argument("--max-wait-ms", type=float, default=20)
+    parser.add_argument("--overhead-ms", type=float, default=20)
+    parser.add_argument("--per-item-ms", type=float, default=1)
+    args = parser.parse_args()
+    run(args.clients, args.windows, args.max_batch_size, args.max_wait_ms, args.overhead_ms, args.per_item_ms)
@@ -0,0 +1,106 @@
+"""
+Benchmark su CPU dell'alimentazione dei chunk VAD in `transcribe_chunks_resumable`:
+chunk WAV scritti/letti/cancellati su disco (feed="disk", il vecchio percorso) contro viste in
+memoria sull'audio dell'episodio (feed="memory").
+
+Il modello è un sostituto minuscolo (energia RMS per frame da 1 s -> "parole"), così il tempo
+misurato è dominato dall'I/O dei chunk e non dall'inferenza. Verifica anche che i due percorsi
+producano le stesse trascrizioni.
+
+Uso:
+    python prediction/parakeet/benchmark_parakeet_pipeline.py --minutes 60 --batch-size 8
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import wave
+from types import SimpleNamespace
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from prediction.parakeet.parakeet_pipeline import SAMPLE_RATE, transcribe_chunks_resumable  # noqa: E402
+
+FRAME_SECONDS = 1.0
+
+
+class TinyModel:
+    """Modello fittizio con l'interfaccia di `ASRModel.transcribe(..., timestamps=True)`."""
+
+    def __init__(self, sample_rate: int = SAMPLE_RATE):
+        self.frame = int(FRAME_SECONDS * sample_rate)
+
+    @staticmethod
+    def _read(item):
+        if isinstance(item, str):
+            with wave.open(item, "rb") as f:
+                pcm = np.frombuffer(f.readframes(f.getnframes()), dtype="<i2")
+            return pcm.astype(np.float32) / 32767.0
+        return np.asarray(item, dtype=np.float32)
+
+    def _hypothesis(self, audio):
+        n = len(audio) // self.frame
+        rms = np.sqrt(np.mean(np.square(audio[:n * self.frame].reshape(n, self.frame)), axis=1)) if n else []
+        words = [{"start": k * FRAME_SECONDS, "end": (k + 1) * FRAME_SECONDS, "word": f"w{int(v * 4)}"}
+                 for k, v in enumerate(rms)]
+        segment = {"start": 0.0, "end": n * FRAME_SECONDS, "segment": " ".join(w["word"] for w in words)}
+        return SimpleNamespace(timestamp={"segment": [segment], "word": words})
+
+    def transcribe(self, inputs, batch_size=1, timestamps=False):
+        return [self._hypothesis(self._read(item)) for item in inputs]
+
+
+def synthetic_episode(minutes: float, seed: int = 0):
+    """Audio sintetico (float32) e segmenti VAD di 2-30 s separati da pause."""
+    rng = np.random.default_rng(seed)
+    total = minutes * 60.0
+    audio = (rng.standard_normal(int(total * SAMPLE_RATE)) * 0.3).astype(np.float32)
+    segments, t = [], 0.0
+    while True:
+        start = t + rng.uniform(0.2, 1.5)
+        end = start + rng.uniform(2.0, 30.0)
+        if end > total:
+            break
+        segments.append((start, end))
+        t = end
+    return audio, segments
+
+
+def run(minutes: float, batch_size: int):
+    audio, segments = synthetic_episode(minutes)
+    print(f"[INFO] {minutes} minuti di audio, {len(segments)} chunk VAD, batch_size={batch_size}")
+
+    results = {}
+    for feed in ("disk", "memory"):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            cache_dir = os.path.join(tmp_dir, "vad_cache")
+            os.makedirs(cache_dir)
+            t0 = time.perf_counter()
+            segments_result, words_result, _ = transcribe_chunks_resumable(
+                audio_path="synthetic.wav",
+                segments=segments,
+                cache_dir=cache_dir,
+                model_name="tiny",
+                output_segments_json=os.path.join(tmp_dir, "segments.json"),
+                output_words_json=os.path.join(tmp_dir, "words.json"),
+                batch_size=batch_size,
+                asr_model=TinyModel(),
+                audio=audio,
+                feed=feed,
+            )
+            results[feed] = (segments_result, words_result, time.perf_counter() - t0)
+
+    assert results["disk"][:2] == results["memory"][:2], "trascrizioni diverse tra disco e memoria"
+    t_disk, t_memory = results["disk"][2], results["memory"][2]
+    print(f"  disco {t_disk:.2f} s   memoria {t_memory:.2f} s   (x{t_disk / t_memory:.1f})")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--minutes", type=float, default=60)
+    parser.add_argument("--batch-size", type=int, default=8)
+    args = parser.parse_args()
+    run(args.minutes, args.batch_size)
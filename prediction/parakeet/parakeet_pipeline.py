@@ -0,0 +1,404 @@
+"""
+Pipeline per fare predizione con il modello Nvidia Parakeet 0.6 B con VAD preprocessing e
+gestione resiliente.
+
+L'episodio viene decodificato una sola volta (cache audio condivisa, memmap a 16 kHz) e i
+chunk VAD vengono passati al modello come viste sull'array, in un'unica chiamata batch per
+gruppo di chunk: nessun WAV intermedio su disco. La ripresa (`chunk_outputs.json`, legato alla
+lista dei chunk) e lo skip dei chunk falliti funzionano come nella versione del notebook, e una
+cache lasciata dal notebook viene convertita invece di essere ignorata.
+
+NeMo e pyannote vengono importati solo quando servono, e il modello ASR può essere passato
+già costruito (es. un modello fittizio per test e benchmark su CPU).
+"""
+import bisect
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+import wave
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from prediction.audio_cache import AudioCache
+from prediction.parakeet.vad_packing import restore_timeline, sequential_batches
+
+SAMPLE_RATE = 16000
+FEED_MODES = ("memory", "disk")
+
+
+def _deterministic_cache_dir(audio_path: str, cache_root: str = None) -> str:
+    """Crea una cartella cache deterministica basata sul nome file audio.
+    Esempio: /tmp/vad_cache/<basename_senza_ext>"""
+    base = os.path.splitext(os.path.basename(audio_path))[0]
+    cache_root = cache_root or os.path.join(tempfile.gettempdir(), "vad_cache")
+    os.makedirs(cache_root, exist_ok=True)
+    cache_dir = os.path.join(cache_root, base)
+    os.makedirs(cache_dir, exist_ok=True)
+    return cache_dir
+
+
+def _run_vad_and_save_manifest(
+    audio_path: str,
+    cache_dir: str,
+    sample_rate: int = SAMPLE_RATE,
+    max_duration: float = 30.0,
+    hf_token: Optional[str] = None,
+) -> List[Tuple[float, float]]:
+    """Esegue la VAD con pyannote e salva manifest su JSON.
+    Restituisce la lista dei segmenti grezzi [(start, end), ...]; l'unione fino a max_duration
+    avviene in `vad_packing.pack_segments`."""
+    import torch
+    from pyannote.audio import Pipeline
+
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+    print("[INFO] Caricamento modello VAD pyannote.audio...")
+    pipeline = Pipeline.from_pretrained(
+        "pyannote/voice-activity-detection",
+        use_auth_token=hf_token,
+    )
+    pipeline.to(device)
+
+    print(f"[INFO] Analisi VAD in corso su {audio_path} ...")
+    vad_output = pipeline(audio_path)
+
+    # segmenti grezzi
+    raw_segments = [(speech.start, speech.end) for speech in vad_output.get_timeline()]
+
+    # salva manifest per ripresa senza ripetere VAD
+    manifest_path = os.path.join(cache_dir, "segments.json")
+    meta = {
+        "audio_path": audio_path,
+        "sample_rate": sample_rate,
+        "max_duration": max_duration,
+        "segments": raw_segments,
+        "created_at": time.time(),
+    }
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+
+    print(f"[SAVE] Manifest VAD: {manifest_path} ({len(raw_segments)} segmenti)")
+    return raw_segments
+
+
+def prepare_vad_cache(
+    audio_path: str,
+    cache_root: Optional[str] = None,
+    sample_rate: int = SAMPLE_RATE,
+    max_duration: float = 30.0,
+    hf_token: Optional[str] = None,
+) -> Tuple[List[Tuple[float, float]], str]:
+    """Prepara (o carica) i segmenti VAD per un file audio.
+    - Se esiste segments.json, lo carica e *non* riesegue la VAD.
+    - Altrimenti esegue la VAD, salva il manifest e restituisce i segmenti.
+
+    Ritorna: (segments, cache_dir)
+    """
+    cache_dir = _deterministic_cache_dir(audio_path, cache_root)
+    manifest_path = os.path.join(cache_dir, "segments.json")
+
+    if os.path.exists(manifest_path):
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        segments = [tuple(seg) for seg in meta["segments"]]
+        print(f"[INFO] Manifest VAD trovato: {manifest_path} ({len(segments)} segmenti)")
+    else:
+        # token da env (se non passato esplicitamente)
+        token = hf_token or os.environ.get("HF_TOKEN")
+        segments = _run_vad_and_save_manifest(
+            audio_path,
+            cache_dir,
+            sample_rate=sample_rate,
+            max_duration=max_duration,
+            hf_token=token,
+        )
+    return segments, cache_dir
+
+
+def load_asr_model(model_name: str):
+    """Carica il modello NeMo `nvidia/<model_name>`."""
+    import nemo.collections.asr as nemo_asr
+
+    print(f"[INFO] Caricamento modello {model_name}...")
+    return nemo_asr.models.ASRModel.from_pretrained(f"nvidia/{model_name}")
+
+
+def chunk_views(audio: np.ndarray, segments: Sequence[Tuple[float, float]], indices: Sequence[int],
+                sample_rate: int = SAMPLE_RATE) -> List[np.ndarray]:
+    """Viste (senza copia) sull'audio per i segmenti richiesti."""
+    return [audio[int(segments[idx][0] * sample_rate):int(segments[idx][1] * sample_rate)] for idx in indices]
+
+
+def write_wav(path: str, audio: np.ndarray, sample_rate: int = SAMPLE_RATE) -> None:
+    """Scrive audio float32 in [-1, 1] come WAV PCM 16 bit mono."""
+    pcm = np.clip(np.round(np.asarray(audio) * 32767.0), -32768, 32767).astype("<i2")
+    with wave.open(path, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(sample_rate)
+        f.writeframes(pcm.tobytes())
+
+
+def _export_chunks_for_indices(
+    audio: np.ndarray,
+    segments: Sequence[Tuple[float, float]],
+    indices: List[int],
+    cache_dir: str,
+    sample_rate: int = SAMPLE_RATE,
+) -> List[str]:
+    """Esporta su disco i chunk WAV solo per gli indici richiesti e restituisce i path.
+    I file sono creati come {cache_dir}/chunk_XXX.wav (usato solo con feed="disk")
+    """
+    out_paths = []
+    for idx, chunk in zip(indices, chunk_views(audio, segments, indices, sample_rate)):
+        out_path = os.path.join(cache_dir, f"chunk_{idx+1:03d}.wav")
+        write_wav(out_path, chunk, sample_rate)
+        out_paths.append(out_path)
+    return out_paths
+
+
+def _delete_files(paths: List[str]) -> None:
+    for p in paths:
+        try:
+            if os.path.exists(p):
+                os.remove(p)
+        except Exception as exc:
+            print(f"[WARN] Impossibile rimuovere {p}: {exc}")
+
+
+def _cleanup_cache_dir(cache_dir: str) -> None:
+    """Rimuove completamente la cartella cache (chunk + manifest)."""
+    try:
+        if os.path.exists(cache_dir):
+            shutil.rmtree(cache_dir)
+            print(f"[CLEAN] Cache rimossa: {cache_dir}")
+    except Exception as exc:
+        print(f"[WARN] Cleanup incompleto {cache_dir}: {exc}")
+
+
+def _load_json(path: str, default):
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    return default
+
+
+def chunks_key(chunks: Sequence) -> str:
+    """Hash della lista dei chunk: cambia con i parametri di `pack_segments` e con la VAD."""
+    payload = json.dumps([[round(float(v), 6) for v in chunk] for chunk in chunks])
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()[:16]
+
+
+def _migrate_legacy_progress(
+    cache_dir: str,
+    chunks: Sequence,
+    output_segments_json: str,
+    output_words_json: str,
+) -> Tuple[dict, List[int]]:
+    """Stato di ripresa ricostruito da una cache della versione del notebook.
+
+    Lì venivano trascritti in ordine i segmenti VAD grezzi del manifest (segments.json) e
+    progress.json conteneva solo `processed_chunks`, cioè quanti segmenti *grezzi* erano fatti;
+    skipped_chunks.json conteneva gli indici dei segmenti grezzi falliti. Il conteggio diventa
+    un limite temporale (fine del segmento grezzo `processed_chunks - 1`): sono completati solo
+    i chunk che finiscono entro il limite e non contengono segmenti saltati. Segmenti e parole
+    già nei JSON di output vengono assegnati al chunk che ne possiede il punto medio; quelli dei
+    chunk da rifare vengono scartati. Senza manifest o JSON di output si riparte da zero.
+
+    Ritorna (output per chunk completato, []).
+    """
+    progress = _load_json(os.path.join(cache_dir, "progress.json"), {})
+    processed = int(progress.get("processed_chunks", 0))
+    if processed <= 0 or "chunks_key" in progress:
+        return {}, []
+    manifest = _load_json(os.path.join(cache_dir, "segments.json"), None)
+    if manifest is None or not (os.path.exists(output_segments_json) and os.path.exists(output_words_json)):
+        print(f"[WARN] progress.json indica {processed} segmenti completati ma mancano il manifest VAD "
+              "o i JSON di output: riparto da zero")
+        return {}, []
+
+    raw_segments = manifest["segments"]
+    processed = min(processed, len(raw_segments))
+    bound = raw_segments[processed - 1][1]
+    skipped_raw = [raw_segments[idx] for idx in _load_json(os.path.join(cache_dir, "skipped_chunks.json"), [])
+                   if 0 <= idx < len(raw_segments)]
+
+    def completed(chunk):
+        if chunk[1] > bound:
+            return False
+        return not any(s_start < chunk[1] and s_end > chunk[0] for s_start, s_end in skipped_raw)
+
+    chunk_outputs = {idx: ([], []) for idx, chunk in enumerate(chunks) if completed(chunk)}
+    starts = [chunk[2] if len(chunk) >= 4 else chunk[0] for chunk in chunks]
+    for position, path in enumerate((output_segments_json, output_words_json)):
+        for item in _load_json(path, []):
+            idx = max(bisect.bisect_right(starts, (item[0] + item[1]) / 2) - 1, 0)
+            if idx in chunk_outputs:
+                chunk_outputs[idx][position].append(item)
+    print(f"[INFO] Ripresa da progress.json: {processed}/{len(raw_segments)} segmenti VAD fino a {bound:.1f} s, "
+          f"{len(chunk_outputs)}/{len(chunks)} chunk già completati")
+    return chunk_outputs, []
+
+
+def _load_resume_state(cache_dir: str, chunks: Sequence, key: str, output_segments_json: str,
+                       output_words_json: str) -> Tuple[dict, List[int]]:
+    """(output per chunk, chunk saltati) dalla cache; vuoti se la cache è di un'altra lista di chunk."""
+    state = _load_json(os.path.join(cache_dir, "chunk_outputs.json"), None)
+    if state is None:
+        return _migrate_legacy_progress(cache_dir, chunks, output_segments_json, output_words_json)
+    if state.get("chunks_key") != key:
+        print("[WARN] chunk_outputs.json è di un'altra lista di chunk (VAD o parametri di packing cambiati): "
+              "riparto da zero")
+        return {}, []
+    return {int(idx): output for idx, output in state["outputs"].items()}, list(state["skipped"])
+
+
+def _transcribe_batch(asr_model, inputs: list) -> list:
+    """Una chiamata batch al modello; restituisce un'ipotesi per input."""
+    outputs = asr_model.transcribe(inputs, batch_size=len(inputs), timestamps=True)
+    if isinstance(outputs, tuple):  # alcuni modelli restituiscono (best, all_hypotheses)
+        outputs = outputs[0]
+    return list(outputs)
+
+
+def transcribe_chunks_resumable(
+    audio_path: str,
+    segments: List[Tuple[float, float]],
+    cache_dir: str,
+    model_name: str,
+    output_segments_json: str,
+    output_words_json: str,
+    batch_size: int = 2,
+    sample_rate: int = SAMPLE_RATE,
+    cleanup_on_success: bool = True,
+    asr_model=None,
+    audio: Optional[np.ndarray] = None,
+    audio_store: Optional[AudioCache] = None,
+    feed: str = "memory",
+    batches: Optional[List[List[int]]] = None,
+) -> Tuple[list, list, float]:
+    """Trascrive i segmenti con ripresa e skip dei chunk falliti.
+
+    - La ripresa usa chunk_outputs.json (output per chunk in tempi assoluti e chunk saltati),
+      quindi salta i chunk già fatti qualunque sia l'ordine dei batch. Lo stato vale solo per la
+      stessa lista di chunk (`chunks_key`): se VAD o parametri di packing cambiano si riparte da
+      zero. progress.json riporta solo il numero di chunk completati; una cache della versione
+      del notebook (senza chunk_outputs.json) viene convertita con `_migrate_legacy_progress`.
+    - `batches` (liste di indici, es. `vad_packing.length_batches`) sceglie quali chunk
+      trascrivere insieme; di default batch consecutivi da `batch_size`. Segmenti e parole sono
+      comunque scritti in ordine di timeline (`vad_packing.restore_timeline`).
+    - L'audio viene letto una sola volta (`audio`, oppure dalla cache audio condivisa) e ogni
+      batch di chunk è passato al modello in un'unica chiamata come viste sull'array
+      (feed="memory"); feed="disk" riproduce il vecchio percorso con WAV temporanei.
+    - Se un batch fallisce, i suoi chunk vengono ritentati uno per uno e quelli che falliscono
+      ancora vengono saltati e registrati in skipped_chunks.json.
+    - Se l'intero job termina con successo, opzionalmente rimuove tutta la cache.
+    """
+    if feed not in FEED_MODES:
+        raise ValueError(f"feed deve essere uno tra {FEED_MODES}")
+
+    total_chunks = len(segments)
+    schedule = batches if batches is not None else sequential_batches(total_chunks, batch_size)
+
+    # Output per chunk (tempi assoluti) salvati in cache: la ripresa non dipende dall'ordine dei batch
+    key = chunks_key(segments)
+    outputs_path = os.path.join(cache_dir, "chunk_outputs.json")
+    chunk_outputs, skipped_chunks = _load_resume_state(cache_dir, segments, key, output_segments_json,
+                                                       output_words_json)
+
+    # Stato di avanzamento
+    progress_path = os.path.join(cache_dir, "progress.json")
+    skipped_path = os.path.join(cache_dir, "skipped_chunks.json")
+    done = set(chunk_outputs) | set(skipped_chunks)
+
+    if audio is None:
+        # Decodifica una sola volta per episodio (nessuna decodifica se già in cache)
+        audio_store = audio_store or AudioCache(sample_rate=sample_rate)
+        audio = audio_store.load(audio_path)
+    if asr_model is None:
+        asr_model = load_asr_model(model_name)
+
+    elapsed_time = 0.0
+    success = False
+
+    try:
+        for batch_number, batch in enumerate(schedule, start=1):
+            batch_indices = [idx for idx in batch if idx not in done]
+            if not batch_indices:
+                continue
+
+            if feed == "disk":
+                batch_inputs = _export_chunks_for_indices(audio, segments, batch_indices, cache_dir, sample_rate)
+            else:
+                batch_inputs = chunk_views(audio, segments, batch_indices, sample_rate)
+
+            print(f"[ASR] Trascrizione batch {batch_number}/{len(schedule)} ({len(batch_indices)} chunk)")
+
+            t0 = time.time()
+            try:
+                outputs = _transcribe_batch(asr_model, batch_inputs)
+            except Exception as e:
+                print(f"[WARN] Trascrizione batch {batch_number} fallita, ritento chunk per chunk: {e}")
+                outputs = []
+                for chunk_idx, chunk_input in zip(batch_indices, batch_inputs):
+                    try:
+                        outputs.append(_transcribe_batch(asr_model, [chunk_input])[0])
+                    except Exception as chunk_error:
+                        print(f"[WARN] Trascrizione chunk {chunk_idx+1} fallita, skip: {chunk_error}")
+                        skipped_chunks.append(chunk_idx)
+                        outputs.append(None)
+            elapsed_time += time.time() - t0
+
+            for chunk_idx, output in zip(batch_indices, outputs):
+                done.add(chunk_idx)
+                if output is None:
+                    continue
+                offset_start = segments[chunk_idx][0]
+                # segment-level
+                chunk_segments = [(seg['start'] + offset_start, seg['end'] + offset_start, seg['segment'])
+                                  for seg in output.timestamp.get('segment', [])]
+                # word-level
+                chunk_words = [(w['start'] + offset_start, w['end'] + offset_start, w['word'])
+                               for w in output.timestamp.get('word', [])]
+                chunk_outputs[chunk_idx] = (chunk_segments, chunk_words)
+
+            # Salvataggio incrementale, sempre in ordine di timeline
+            segments_result, words_result = restore_timeline(chunk_outputs, segments)
+            with open(outputs_path, "w", encoding="utf-8") as f:
+                json.dump({"chunks_key": key, "outputs": chunk_outputs, "skipped": skipped_chunks}, f,
+                          ensure_ascii=False)
+            with open(output_segments_json, "w", encoding="utf-8") as f:
+                json.dump(segments_result, f, ensure_ascii=False, indent=2)
+            with open(output_words_json, "w", encoding="utf-8") as f:
+                json.dump(words_result, f, ensure_ascii=False, indent=2)
+            with open(skipped_path, "w", encoding="utf-8") as f:
+                json.dump(skipped_chunks, f, ensure_ascii=False, indent=2)
+
+            # Aggiorna progresso *dopo* il salvataggio
+            with open(progress_path, "w", encoding="utf-8") as f:
+                json.dump({"processed_chunks": len(done), "total_chunks": total_chunks, "chunks_key": key}, f)
+
+            print(f"[SAVE] Salvati progressi: {len(done)}/{total_chunks} chunk")
+
+            if feed == "disk":
+                _delete_files(batch_inputs)
+
+        segments_result, words_result = restore_timeline(chunk_outputs, segments)
+        success = True
+        print("\n[INFO] Trascrizione completata.")
+        print(f"  Segmenti totali: {len(segments_result)}")
+        print(f"  Parole totali: {len(words_result)}")
+        if skipped_chunks:
+            print(f"  Chunk saltati: {skipped_chunks}")
+        return segments_result, words_result, elapsed_time
+
+    finally:
+        # Pulizia se e solo se tutto è andato a buon fine
+        if success and cleanup_on_success:
+            _cleanup_cache_dir(cache_dir)
+        else:
+            print(f"[INFO] Interruzione o errore: cache preservata in {cache_dir}")
@@ -0,0 +1,154 @@
+"""
+Impacchettamento dei segmenti VAD per l'ASR a batch.
+
+I segmenti grezzi di pyannote hanno durate molto diverse: batch di chunk consecutivi sprecano
+calcolo nel padding fino al chunk più lungo. Qui i segmenti vengono:
+
+1. fusi quando la pausa tra due regioni è più corta di `min_gap` (stessa frase);
+2. spezzati, con `overlap` secondi di sovrapposizione, se più lunghi di `target_duration`;
+3. accorpati in modo greedy finché il chunk resta entro `target_duration` e la pausa entro
+   `max_merge_gap`;
+4. ordinati per durata e divisi in batch (`length_batches`).
+
+Ogni chunk "possiede" un intervallo [keep_start, keep_end) della timeline (i confini cadono a
+metà delle pause o delle sovrapposizioni): `restore_timeline` rimette le trascrizioni in ordine
+temporale e scarta le parole duplicate nelle sovrapposizioni. Solo Python/NumPy, senza pyannote.
+"""
+import math
+from typing import Dict, List, NamedTuple, Sequence, Tuple
+
+import numpy as np
+
+
+class PackedChunk(NamedTuple):
+    start: float
+    end: float
+    keep_start: float
+    keep_end: float
+
+    @property
+    def duration(self) -> float:
+        return self.end - self.start
+
+
+def _fuse_short_gaps(segments: Sequence[Tuple[float, float]], min_gap: float) -> List[List[float]]:
+    regions = []
+    for start, end in sorted((float(s), float(e)) for s, e in segments if e > s):
+        if regions and start - regions[-1][1] < min_gap:
+            regions[-1][1] = max(regions[-1][1], end)
+        else:
+            regions.append([start, end])
+    return regions
+
+
+def _split_region(start: float, end: float, target_duration: float, overlap: float) -> List[Tuple[float, float]]:
+    """Pezzi di uguale durata (<= target_duration) che si sovrappongono di `overlap` secondi."""
+    length = end - start
+    if length <= target_duration:
+        return [(start, end)]
+    n = math.ceil((length - overlap) / (target_duration - overlap))
+    piece = (length + (n - 1) * overlap) / n
+    step = piece - overlap
+    # L'ultimo pezzo termina esattamente a `end`: con gli arrotondamenti k * step + piece può restare appena sotto
+    return [(start + k * step, end if k == n - 1 else start + k * step + piece) for k in range(n)]
+
+
+def pack_segments(
+    segments: Sequence[Tuple[float, float]],
+    target_duration: float = 30.0,
+    min_gap: float = 0.3,
+    max_merge_gap: float = 2.0,
+    overlap: float = 1.0,
+) -> List[PackedChunk]:
+    """
+    Trasforma i segmenti VAD grezzi [(start, end), ...] in chunk di durata <= target_duration,
+    in ordine temporale.
+
+    Args:
+        target_duration: durata massima di un chunk (secondi).
+        min_gap: pause più corte vengono sempre fuse, anche oltre target_duration (poi si spezza).
+        max_merge_gap: pausa massima attraversata quando si accorpano regioni distinte.
+        overlap: sovrapposizione tra i pezzi di una regione troppo lunga.
+    """
+    if not 0 <= overlap < target_duration:
+        raise ValueError("overlap deve essere in [0, target_duration)")
+
+    pieces = []  # (start, end, si sovrappone al pezzo precedente)
+    for start, end in _fuse_short_gaps(segments, min_gap):
+        for k, (piece_start, piece_end) in enumerate(_split_region(start, end, target_duration, overlap)):
+            pieces.append((piece_start, piece_end, k > 0))
+
+    merged = []  # [start, end]
+    for start, end, overlapping in pieces:
+        if not overlapping and merged and end - merged[-1][0] <= target_duration \
+                and start - merged[-1][1] <= max_merge_gap:
+            merged[-1][1] = end
+        else:
+            merged.append([start, end])
+
+    # Confini di possesso a metà della pausa (o della sovrapposizione) tra chunk consecutivi
+    bounds = [0.0] + [(prev[1] + cur[0]) / 2 for prev, cur in zip(merged, merged[1:])]
+    if merged:
+        bounds.append(merged[-1][1] + target_duration)
+    return [PackedChunk(start, end, bounds[k], bounds[k + 1]) for k, (start, end) in enumerate(merged)]
+
+
+def length_batches(chunks: Sequence[Tuple[float, float]], batch_size: int) -> List[List[int]]:
+    """Indici dei chunk raggruppati in batch di durata simile (dal più lungo al più corto)."""
+    durations = np.array([end - start for start, end, *_ in chunks], dtype=np.float64)
+    order = np.argsort(-durations, kind="stable").tolist()
+    return [order[i:i + batch_size] for i in range(0, len(order), batch_size)]
+
+
+def sequential_batches(n_chunks: int, batch_size: int) -> List[List[int]]:
+    """Batch di chunk consecutivi (il comportamento originale)."""
+    return [list(range(i, min(i + batch_size, n_chunks))) for i in range(0, n_chunks, batch_size)]
+
+
+def padding_report(chunks: Sequence[Tuple[float, float]], batches: Sequence[Sequence[int]]) -> Dict[str, float]:
+    """
+    Audio utile contro audio elaborato con il padding al chunk più lungo di ogni batch.
+    `batch_efficiency` = audio utile / audio elaborato, `padding_ratio` = 1 - batch_efficiency.
+    """
+    durations = np.array([end - start for start, end, *_ in chunks], dtype=np.float64)
+    audio_seconds = float(durations.sum())
+    padded_seconds = float(sum(len(batch) * durations[batch].max() for batch in batches if len(batch)))
+    efficiency = audio_seconds / padded_seconds if padded_seconds > 0 else 1.0
+    return {
+        "chunks": len(durations),
+        "batches": len(batches),
+        "audio_seconds": round(audio_seconds, 3),
+        "padded_seconds": round(padded_seconds, 3),
+        "padding_ratio": round(1.0 - efficiency, 4),
+        "batch_efficiency": round(efficiency, 4),
+    }
+
+
+def print_packing_report(raw_segments, chunks, batch_size: int) -> Dict[str, float]:
+    """Stampa l'effetto dell'impacchettamento rispetto ai batch consecutivi dei segmenti grezzi."""
+    before = padding_report(raw_segments, sequential_batches(len(raw_segments), batch_size))
+    after = padding_report(chunks, length_batches(chunks, batch_size))
+    print(f"[INFO] VAD: {before['chunks']} segmenti -> {after['chunks']} chunk, {after['batches']} batch da {batch_size}")
+    print(f"[INFO] Efficienza batch: {before['batch_efficiency']:.1%} -> {after['batch_efficiency']:.1%} "
+          f"(padding {before['padding_ratio']:.1%} -> {after['padding_ratio']:.1%})")
+    return after
+
+
+def _owned(item, chunk) -> bool:
+    if len(chunk) < 4:
+        return True
+    midpoint = (item[0] + item[1]) / 2
+    return chunk[2] <= midpoint < chunk[3]
+
+
+def restore_timeline(chunk_outputs: Dict[int, Tuple[list, list]], chunks: Sequence) -> Tuple[list, list]:
+    """
+    Segmenti e parole (in tempo assoluto) di ogni chunk, concatenati in ordine di timeline.
+    Per i `PackedChunk` tiene solo ciò che cade (per punto medio) nell'intervallo posseduto.
+    """
+    segments_result, words_result = [], []
+    for idx in sorted(chunk_outputs):
+        segments, words = chunk_outputs[idx]
+        segments_result.extend(seg for seg in segments if _owned(seg, chunks[idx]))
+        words_result.extend(w for w in words if _owned(w, chunks[idx]))
+    return segments_result, words_result
@@ -1,22 +1,106 @@
+import asyncio
+import base64
+import hashlib
+import json
 import logging
 import os
-import tempfile
-from typing import List, Literal, Any, Dict, Optional
+import shutil
+import subprocess
+import threading
+from typing import List, Literal, Any, Dict, Iterator, Optional, Tuple
 
+import numpy as np
 import torch
 import whisper
-from fastapi import FastAPI, HTTPException, Request
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
 from google.cloud import storage
 from pydantic import BaseModel, Field
 
+try:
+    from audio_cache import AudioCache  # nell'immagine Docker è copiato accanto a main.py
+    from batching import MicroBatcher
+except ImportError:
+    from prediction.audio_cache import AudioCache
+    from prediction.batching import MicroBatcher
+
 from contextlib import asynccontextmanager
 
 # --- Configurazione Iniziale ---
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
-device = "cuda"
+device = os.environ.get("WHISPER_DEVICE", "cuda")
+MODEL_NAME = os.environ.get("WHISPER_MODEL_NAME", "large-v2")
 logging.info(f"Forzando l'utilizzo del device: {device}")
 
-storage_client = storage.Client()
+# Modalità streaming
+SAMPLE_RATE = 16000
+CHUNK_SECONDS = 30          # finestra nativa di Whisper
+CUT_SEARCH_SECONDS = 2      # il taglio cade nel punto di minima energia degli ultimi secondi del chunk
+CUT_FRAME_SAMPLES = 320     # frame da 20 ms per il calcolo dell'energia
+PROMPT_CHARS = 200          # testo del chunk precedente passato come contesto
+READ_BLOCK_BYTES = 1 << 20
+
+# Micro-batching tra richieste (/predict_batched)
+BATCH_MAX_SIZE = int(os.environ.get("WHISPER_BATCH_MAX_SIZE", "16"))      # finestre da 30 s per batch
+BATCH_MAX_WAIT_MS = float(os.environ.get("WHISPER_BATCH_MAX_WAIT_MS", "20"))
+# Stesse soglie e temperature di whisper.transcribe (fallback e finestre senza parlato)
+NO_SPEECH_THRESHOLD = 0.6
+LOGPROB_THRESHOLD = -1.0
+COMPRESSION_RATIO_THRESHOLD = 2.4
+TEMPERATURES = (0.0, 0.2, 0.4, 0.6, 0.8, 1.0)
+
+
+class LocalStorageClient:
+    """
+    Sostituto locale di `storage.Client` per test senza GCS: gs://bucket/path viene letto da
+    <root>/bucket/path. Espone solo i metodi usati dall'endpoint.
+    """
+
+    class _Blob:
+        def __init__(self, path):
+            self.path = path
+
+        @property
+        def md5_hash(self):
+            # Come GCS: MD5 del contenuto in base64
+            md5 = hashlib.md5()
+            with open(self.path, "rb") as f:
+                for block in iter(lambda: f.read(READ_BLOCK_BYTES), b""):
+                    md5.update(block)
+            return base64.b64encode(md5.digest()).decode()
+
+        def download_to_filename(self, filename):
+            shutil.copyfile(self.path, filename)
+
+        def open(self, mode="rb"):
+            return open(self.path, mode)
+
+    class _Bucket:
+        def __init__(self, path):
+            self.path = path
+
+        def blob(self, blob_name):
+            return LocalStorageClient._Blob(os.path.join(self.path, blob_name))
+
+        def get_blob(self, blob_name):
+            path = os.path.join(self.path, blob_name)
+            return LocalStorageClient._Blob(path) if os.path.exists(path) else None
+
+    def __init__(self, root):
+        self.root = root
+
+    def bucket(self, bucket_name):
+        return LocalStorageClient._Bucket(os.path.join(self.root, bucket_name))
+
+
+# LOCAL_STORAGE_ROOT permette di provare l'endpoint in locale (es. su CPU con un checkpoint piccolo)
+if os.environ.get("LOCAL_STORAGE_ROOT"):
+    storage_client = LocalStorageClient(os.environ["LOCAL_STORAGE_ROOT"])
+else:
+    storage_client = storage.Client()
+
+# Audio decodificato condiviso tra richieste e backend (vedi prediction/audio_cache.py)
+audio_store = AudioCache()
 
 class PredictionRequest(BaseModel):
     instances: List[str] = Field(..., description="Lista di GCS URI degli audio da trascrivere.")
@@ -25,31 +109,255 @@ class PredictionRequest(BaseModel):
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Load the ML model
-    logging.info("Caricamento del modello Whisper 'large-v2' in corso...")
-    app.state.model = whisper.load_model("large-v2", device=device, download_root='./')
-    logging.info("Caricamento del modello Whisper 'large-v2' completato!")
+    logging.info(f"Caricamento del modello Whisper '{MODEL_NAME}' in corso...")
+    app.state.model = whisper.load_model(MODEL_NAME, device=device, download_root='./')
+    logging.info(f"Caricamento del modello Whisper '{MODEL_NAME}' completato!")
+    # Il thread del batcher è l'unico che usa il modello (gli hook della kv-cache di whisper sono
+    # sui moduli condivisi): anche /predict e /predict_stream passano da `batcher.call`
+    app.state.batcher = MicroBatcher(lambda windows: decode_windows(app.state.model, windows),
+                                     max_batch_size=BATCH_MAX_SIZE, max_wait_ms=BATCH_MAX_WAIT_MS, name="whisper-batch")
+    await app.state.batcher.start()
     yield # Lifespan is completed    
+    await app.state.batcher.stop()
     
 
 # --- Applicazione FastAPI ---
 app = FastAPI(title="Whisper Large V2 Transcription Service", lifespan=lifespan)
 
-# --- Funzioni di Supporto (invariata) ---
-def download_gcs_file(gcs_uri: str) -> str:    
+# --- Funzioni di Supporto ---
+def parse_gcs_uri(gcs_uri: str) -> Tuple[str, str]:
+    if not gcs_uri.startswith("gs://"):
+        raise ValueError("URI non valido, deve iniziare con 'gs://'")
+    bucket_name, blob_name = gcs_uri.replace("gs://", "").split("/", 1)
+    return bucket_name, blob_name
+
+def iter_pcm_blocks(gcs_uri: str, block_samples: int) -> Iterator[np.ndarray]:
+    """
+    Decodifica progressivamente l'audio di un oggetto GCS: i byte vengono passati a ffmpeg
+    mentre arrivano e il PCM mono a 16 kHz viene restituito a blocchi di `block_samples`,
+    senza scaricare il file né tenerlo tutto in memoria.
+    """
+    bucket_name, blob_name = parse_gcs_uri(gcs_uri)
+    blob = storage_client.bucket(bucket_name).blob(blob_name)
+    cmd = ["ffmpeg", "-nostdin", "-loglevel", "error", "-threads", "0", "-i", "pipe:0",
+           "-f", "s16le", "-ac", "1", "-acodec", "pcm_s16le", "-ar", str(SAMPLE_RATE), "pipe:1"]
+    process = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    def feed():
+        try:
+            with blob.open("rb") as reader:
+                while True:
+                    data = reader.read(READ_BLOCK_BYTES)
+                    if not data:
+                        break
+                    process.stdin.write(data)
+        except (BrokenPipeError, ValueError):
+            pass  # ffmpeg terminato prima della fine dell'input
+        except Exception as e:
+            logging.error(f"Errore durante la lettura da GCS {gcs_uri}: {e}")
+        finally:
+            try:
+                process.stdin.close()
+            except OSError:
+                pass
+
+    feeder = threading.Thread(target=feed, daemon=True)
+    feeder.start()
     try:
-        if not gcs_uri.startswith("gs://"):
-            raise ValueError("URI non valido, deve iniziare con 'gs://'")
-        bucket_name, blob_name = gcs_uri.replace("gs://", "").split("/", 1)
-        bucket = storage_client.bucket(bucket_name)
-        blob = bucket.blob(blob_name)
-        suffix = os.path.splitext(blob_name)[1] or ".tmp"
-        with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp_file:
-            blob.download_to_filename(tmp_file.name)
-            logging.info(f"File scaricato da {gcs_uri} a {tmp_file.name}")
-            return tmp_file.name
-    except Exception as e:
-        logging.error(f"Errore durante il download da GCS {gcs_uri}: {e}")
-        raise HTTPException(status_code=500, detail=f"Impossibile scaricare il file: {gcs_uri}")
+        block_bytes = block_samples * 2
+        while True:
+            data = process.stdout.read(block_bytes)
+            if not data:
+                break
+            yield np.frombuffer(data[:len(data) // 2 * 2], dtype=np.int16).astype(np.float32) / 32768.0
+        if process.wait() != 0:
+            raise RuntimeError(f"ffmpeg non è riuscito a decodificare {gcs_uri}: {process.stderr.read().decode(errors='replace')}")
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+        feeder.join(timeout=5)
+
+def find_energy_cut(audio: np.ndarray, window_samples: int, search_samples: int) -> int:
+    """Posizione di taglio nel frame a energia minima tra window-search e window."""
+    lo = max(0, window_samples - search_samples)
+    region = audio[lo:window_samples]
+    n_frames = len(region) // CUT_FRAME_SAMPLES
+    if n_frames == 0:
+        return window_samples
+    frames = region[:n_frames * CUT_FRAME_SAMPLES].reshape(n_frames, CUT_FRAME_SAMPLES)
+    quietest = int(np.argmin(np.square(frames).mean(axis=1)))
+    return lo + quietest * CUT_FRAME_SAMPLES + CUT_FRAME_SAMPLES // 2
+
+def iter_audio_chunks(blocks: Iterator[np.ndarray], chunk_seconds: float = CHUNK_SECONDS,
+                      cut_search_seconds: float = CUT_SEARCH_SECONDS) -> Iterator[Tuple[int, np.ndarray]]:
+    """
+    Raggruppa il PCM in chunk di al più `chunk_seconds`, tagliando nel punto più silenzioso
+    degli ultimi `cut_search_seconds` per non spezzare le parole. Restituisce (offset in
+    campioni, audio del chunk); in memoria resta al più un chunk più un blocco.
+    """
+    window = int(chunk_seconds * SAMPLE_RATE)
+    search = int(cut_search_seconds * SAMPLE_RATE)
+    buffer = np.zeros(0, dtype=np.float32)
+    offset = 0
+    for block in blocks:
+        buffer = np.concatenate([buffer, block])
+        while len(buffer) >= window:
+            cut = find_energy_cut(buffer, window, search)
+            yield offset, buffer[:cut]
+            buffer = buffer[cut:]
+            offset += cut
+    if len(buffer):
+        yield offset, buffer
+
+def _to_serializable(value):
+    if hasattr(value, "tolist"):
+        return value.tolist()
+    raise TypeError(f"Tipo non serializzabile: {type(value)}")
+
+def shift_segment(segment: Dict[str, Any], offset_sec: float, segment_id: int) -> Dict[str, Any]:
+    """Riporta tempi di segmento e parole sull'asse temporale dell'intero file."""
+    segment = dict(segment, id=segment_id)
+    segment["start"] = round(segment["start"] + offset_sec, 3)
+    segment["end"] = round(segment["end"] + offset_sec, 3)
+    if "words" in segment:
+        segment["words"] = [dict(w, start=round(w["start"] + offset_sec, 3), end=round(w["end"] + offset_sec, 3))
+                            for w in segment["words"]]
+    return segment
+
+def transcribe_stream(model, gcs_uri: str, language: str, chunk_seconds: float = CHUNK_SECONDS,
+                      call=None) -> Iterator[Dict[str, Any]]:
+    """
+    Trascrive un file chunk per chunk e restituisce i segmenti appena disponibili.
+    Il testo finale di ogni chunk viene passato come `initial_prompt` al successivo.
+    `call` esegue le chiamate al modello (es. `MicroBatcher.call`); di default sono dirette.
+    """
+    call = call or (lambda fn, *args, **kwargs: fn(*args, **kwargs))
+    prompt = None
+    segment_id = 0
+    block_samples = int(chunk_seconds * SAMPLE_RATE)
+    cached = audio_store.lookup_gcs(storage_client, gcs_uri)
+    if cached is not None:
+        # Audio già decodificato: i blocchi sono viste sul memmap della cache
+        blocks = (cached[i:i + block_samples] for i in range(0, len(cached), block_samples))
+    else:
+        blocks = iter_pcm_blocks(gcs_uri, block_samples)
+    for offset, audio in iter_audio_chunks(blocks, chunk_seconds):
+        result = call(model.transcribe, audio, language=language, word_timestamps=True, initial_prompt=prompt)
+        offset_sec = offset / SAMPLE_RATE
+        for segment in result["segments"]:
+            yield shift_segment(segment, offset_sec, segment_id)
+            segment_id += 1
+        text = result.get("text", "").strip()
+        if text:
+            prompt = text[-PROMPT_CHARS:]
+
+def split_windows(audio: np.ndarray, chunk_seconds: float = CHUNK_SECONDS,
+                  cut_search_seconds: float = CUT_SEARCH_SECONDS) -> Iterator[Tuple[int, np.ndarray]]:
+    """
+    Come `iter_audio_chunks` ma su un audio già in memoria: restituisce (offset in campioni,
+    vista sulla finestra) senza copiare l'audio.
+    """
+    window = int(chunk_seconds * SAMPLE_RATE)
+    search = int(cut_search_seconds * SAMPLE_RATE)
+    offset = 0
+    while len(audio) - offset >= window:
+        cut = find_energy_cut(audio[offset:offset + window], window, search)
+        yield offset, audio[offset:offset + cut]
+        offset += cut
+    if offset < len(audio):
+        yield offset, audio[offset:]
+
+def segments_from_tokens(tokenizer, result, duration: float) -> List[Dict[str, Any]]:
+    """
+    Segmenti (tempi relativi alla finestra) dai token di timestamp di un `DecodingResult`:
+    <|t0|> testo <|t1|><|t1|> testo <|t2|> ...; il testo senza timestamp finale arriva a fine finestra.
+    Come in whisper.transcribe la finestra è scartata se no_speech_prob supera la soglia e
+    avg_logprob non la supera.
+    """
+    if result.no_speech_prob > NO_SPEECH_THRESHOLD and result.avg_logprob <= LOGPROB_THRESHOLD:
+        return []
+    timestamp_begin = tokenizer.timestamp_begin
+    time_precision = 0.02
+    segments, text_tokens, start = [], [], None
+
+    def close(end):
+        text = tokenizer.decode(text_tokens)
+        if text.strip():
+            segments.append({"seek": 0, "start": start if start is not None else 0.0, "end": min(end, duration),
+                             "text": text, "tokens": list(text_tokens), "temperature": result.temperature,
+                             "avg_logprob": result.avg_logprob, "compression_ratio": result.compression_ratio,
+                             "no_speech_prob": result.no_speech_prob})
+
+    for token in result.tokens:
+        if token >= timestamp_begin:
+            time_sec = (token - timestamp_begin) * time_precision
+            if start is not None and text_tokens:
+                close(time_sec)
+                text_tokens, start = [], None
+            else:
+                start = time_sec
+        else:
+            text_tokens.append(token)
+    if text_tokens:
+        close(duration)
+    return segments
+
+def needs_fallback(result) -> bool:
+    """Stesso criterio di `decode_with_fallback` in whisper.transcribe."""
+    if result.no_speech_prob > NO_SPEECH_THRESHOLD and result.avg_logprob < LOGPROB_THRESHOLD:
+        return False  # silenzio: nessun nuovo tentativo
+    return result.compression_ratio > COMPRESSION_RATIO_THRESHOLD or result.avg_logprob < LOGPROB_THRESHOLD
+
+def decode_with_fallback(model, mel: torch.Tensor) -> list:
+    """
+    Decodifica in batch alle temperature di `TEMPERATURES`: dopo ogni passata vengono
+    ridecodificate insieme, alla temperatura successiva, solo le finestre troppo ripetitive
+    (compression_ratio) o poco probabili (avg_logprob).
+    """
+    results = [None] * len(mel)
+    pending = list(range(len(mel)))
+    for temperature in TEMPERATURES:
+        options = whisper.DecodingOptions(language='it', temperature=temperature, fp16=model.device.type == "cuda")
+        for idx, result in zip(pending, whisper.decode(model, mel[pending], options)):
+            results[idx] = result
+        pending = [idx for idx in pending if needs_fallback(results[idx])]
+        if not pending:
+            break
+    return results
+
+def decode_windows(model, windows: List[np.ndarray]) -> List[List[Dict[str, Any]]]:
+    """
+    Decodifica più finestre (<= 30 s, anche di richieste diverse) in un solo batch, con il
+    fallback di temperatura e i timestamp di parola (chiave "words") di `model.transcribe`:
+    i segmenti hanno lo stesso schema di /predict. L'unica differenza è che ogni finestra è
+    decodificata senza il testo precedente come prompt.
+    """
+    n_mels = model.dims.n_mels
+    mel = torch.stack([whisper.log_mel_spectrogram(whisper.pad_or_trim(np.ascontiguousarray(w)), n_mels, device=model.device)
+                       for w in windows])
+    results = decode_with_fallback(model, mel)
+    tokenizer = whisper.tokenizer.get_tokenizer(model.is_multilingual, num_languages=model.num_languages,
+                                                language='it', task="transcribe")
+    window_segments = []
+    for i, (result, w) in enumerate(zip(results, windows)):
+        segments = segments_from_tokens(tokenizer, result, len(w) / SAMPLE_RATE)
+        # Allineamento delle parole sulla finestra, come word_timestamps=True in /predict
+        whisper.timing.add_word_timestamps(segments=segments, model=model, tokenizer=tokenizer, mel=mel[i],
+                                           num_frames=len(w) // whisper.audio.HOP_LENGTH, last_speech_timestamp=0.0)
+        window_segments.append(segments)
+    return window_segments
+
+async def transcribe_batched(batcher: MicroBatcher, gcs_uri: str, chunk_seconds: float = CHUNK_SECONDS) -> List[Dict[str, Any]]:
+    """Trascrive un file accodando tutte le sue finestre al micro-batcher condiviso."""
+    audio = await asyncio.to_thread(audio_store.load_gcs, storage_client, gcs_uri)
+    windows = list(split_windows(audio, chunk_seconds))
+    window_segments = await batcher.submit_many([w for _, w in windows])
+    segments = []
+    for (offset, _), chunk_segments in zip(windows, window_segments):
+        for segment in chunk_segments:
+            segments.append(shift_segment(segment, offset / SAMPLE_RATE, len(segments)))
+    return segments
 
 # --- Endpoint ---
 @app.get("/health", status_code=200)
@@ -73,15 +381,16 @@ def predict(prediction_request: PredictionRequest, request: Request):
     lang_for_whisper = 'it'
 
     for instance_uri in prediction_request.instances:
-        temp_audio_path = None
         try:
-            temp_audio_path = download_gcs_file(instance_uri)            
-            
+            # Audio dalla cache condivisa (scaricato e decodificato solo al primo utilizzo)
+            audio = audio_store.load_gcs(storage_client, instance_uri)
+
             logging.info(f"Trascrizione di {instance_uri}")
             
-            # Trascrivi l'audio
+            # Trascrivi l'audio (sul thread del batcher, in serie con /predict_batched)
             model = request.app.state.model
-            result = model.transcribe(temp_audio_path, language=lang_for_whisper, word_timestamps=True)            
+            result = request.app.state.batcher.call(model.transcribe, audio, language=lang_for_whisper,
+                                                    word_timestamps=True)
                       
             logging.info(f"Trascrizione completata per {instance_uri}")
             
@@ -92,9 +401,62 @@ def predict(prediction_request: PredictionRequest, request: Request):
         except Exception as e:
             logging.error(f"Errore durante la predizione per {instance_uri}: {e}", exc_info=True)
             predictions.append({"error": str(e), "instance": instance_uri})
-            
-        finally:
-            if temp_audio_path and os.path.exists(temp_audio_path):
-                os.remove(temp_audio_path)
 
-    return {"predictions": predictions}
\ No newline at end of file
+    return {"predictions": predictions}
+
+@app.post("/predict_stream")
+def predict_stream(prediction_request: PredictionRequest, request: Request):
+    """
+    Come /predict, ma decodifica l'audio progressivamente e restituisce i segmenti in NDJSON
+    (una riga JSON per segmento) man mano che ogni chunk viene trascritto. Ogni istanza si
+    chiude con una riga `done` oppure `error`.
+    """
+    model = request.app.state.model
+    batcher = request.app.state.batcher
+    lang_for_whisper = 'it'
+    chunk_seconds = float(prediction_request.parameters.get("chunk_seconds", CHUNK_SECONDS))
+
+    def generate():
+        for instance_uri in prediction_request.instances:
+            num_segments = 0
+            try:
+                logging.info(f"Trascrizione in streaming di {instance_uri}")
+                for segment in transcribe_stream(model, instance_uri, lang_for_whisper, chunk_seconds,
+                                                 call=batcher.call):
+                    num_segments += 1
+                    yield json.dumps({"instance": instance_uri, "segment": segment}, ensure_ascii=False, default=_to_serializable) + "\n"
+                logging.info(f"Trascrizione completata per {instance_uri}")
+                yield json.dumps({"instance": instance_uri, "done": True, "num_segments": num_segments}) + "\n"
+            except Exception as e:
+                logging.error(f"Errore durante la predizione per {instance_uri}: {e}", exc_info=True)
+                yield json.dumps({"instance": instance_uri, "error": str(e)}, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+@app.post("/predict_batched")
+async def predict_batched(prediction_request: PredictionRequest, request: Request):
+    """
+    Come /predict, ma le finestre da 30 s di tutte le istanze e di tutte le richieste
+    concorrenti vengono decodificate insieme in batch (vedi prediction/batching.py).
+    I segmenti hanno lo stesso schema di /predict, parole ("words") comprese.
+    """
+    batcher = request.app.state.batcher
+    chunk_seconds = float(prediction_request.parameters.get("chunk_seconds", CHUNK_SECONDS))
+
+    async def run_instance(instance_uri):
+        try:
+            logging.info(f"Trascrizione a batch di {instance_uri}")
+            segments = await transcribe_batched(batcher, instance_uri, chunk_seconds)
+            logging.info(f"Trascrizione completata per {instance_uri}")
+            return {"result": segments}
+        except Exception as e:
+            logging.error(f"Errore durante la predizione per {instance_uri}: {e}", exc_info=True)
+            return {"error": str(e), "instance": instance_uri}
+
+    predictions = await asyncio.gather(*(run_instance(uri) for uri in prediction_request.instances))
+    return {"predictions": list(predictions)}
+
+@app.get("/batch_stats")
+async def batch_stats(request: Request):
+    """Profondità della coda, riempimento dei batch e percentili di latenza del micro-batcher."""
+    return request.app.state.batcher.stats()
@@ -1,17 +1,27 @@
+import asyncio
 import gc
 import json
 import logging
 import os
-import tempfile
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import asynccontextmanager
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional, Tuple
 
 import torch
 import whisperx
-from fastapi import FastAPI, HTTPException, Request
+from fastapi import FastAPI, Request
 from google.cloud import storage
 from pydantic import BaseModel, Field
 
+try:
+    from audio_cache import AudioCache  # nell'immagine Docker è copiato accanto a main.py
+    from batching import MicroBatcher
+except ImportError:
+    from prediction.audio_cache import AudioCache
+    from prediction.batching import MicroBatcher
+
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 DEVICE = "cuda"
@@ -19,8 +29,21 @@ BATCH_SIZE = 16
 COMPUTE_TYPE = "float16"
 LANGUAGE = "it"
 
+# Pipeline delle istanze
+PREFETCH_WORKERS = 2          # thread che scaricano e decodificano le istanze successive
+PREFETCH_DEPTH = 2            # istanze decodificate in attesa (limita la memoria occupata dall'audio)
+CACHE_FLUSH_WATERMARK = 0.85  # frazione di memoria GPU occupata oltre la quale si svuota la cache
+
+# Micro-batching tra richieste (/predict_batched)
+CHUNK_SIZE = 30               # secondi, come whisperx.transcribe
+BATCH_MAX_WAIT_MS = float(os.environ.get("WHISPERX_BATCH_MAX_WAIT_MS", "20"))
+SAMPLE_RATE = 16000
+
 storage_client = storage.Client()
 
+# Audio decodificato condiviso tra richieste e backend (vedi prediction/audio_cache.py)
+audio_store = AudioCache()
+
 class PredictionRequest(BaseModel):
     instances: List[str] = Field(..., description="Lista di GCS URI degli audio da trascrivere.")
     parameters: Dict[str, Any] = Field(default_factory=dict)
@@ -38,22 +61,63 @@ def convert_to_json_serializable(data: Any) -> Any:
         return data.item()
     return data
 
-def download_gcs_file(gcs_uri: str) -> str:
-    # (Funzione invariata, era già corretta)
-    try:
-        if not gcs_uri.startswith("gs://"):
-            raise ValueError("URI non valido, deve iniziare con 'gs://'")
-        bucket_name, blob_name = gcs_uri.replace("gs://", "").split("/", 1)
-        bucket = storage_client.bucket(bucket_name)
-        blob = bucket.blob(blob_name)
-        suffix = os.path.splitext(blob_name)[1] or ".tmp"
-        with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp_file:
-            blob.download_to_filename(tmp_file.name)
-            logging.info(f"File scaricato da {gcs_uri} a {tmp_file.name}")
-            return tmp_file.name
-    except Exception as e:
-        logging.error(f"Errore durante il download da GCS {gcs_uri}: {e}")
-        raise HTTPException(status_code=500, detail=f"Impossibile scaricare il file: {gcs_uri}")
+def load_instance(uri: str) -> Tuple[Any, Dict[str, float]]:
+    """
+    Legge l'audio di un'istanza dalla cache condivisa, scaricandolo e decodificandolo solo se
+    assente. Restituisce l'audio e i tempi delle fasi eseguite (download/decode solo se miss).
+    """
+    timings = {}
+    start = time.perf_counter()
+    audio = audio_store.load_gcs(storage_client, uri, timings)
+    timings["load"] = time.perf_counter() - start
+    return audio, timings
+
+
+def align_segments(segments, audio, model_a, metadata) -> Tuple[List[Dict[str, Any]], float]:
+    """Allinea i segmenti trascritti e li converte in tipi JSON-serializzabili."""
+    start = time.perf_counter()
+    aligned_transcription = whisperx.align(segments, model_a, metadata, audio, DEVICE, return_char_alignments=False)
+    return convert_to_json_serializable(aligned_transcription['segments']), time.perf_counter() - start
+
+
+def flush_cuda_cache_if_needed(watermark: float = CACHE_FLUSH_WATERMARK) -> bool:
+    """Svuota la cache CUDA solo se la memoria GPU occupata supera `watermark`."""
+    if not torch.cuda.is_available():
+        return False
+    free, total = torch.cuda.mem_get_info()
+    if 1 - free / total < watermark:
+        return False
+    gc.collect()
+    torch.cuda.empty_cache()
+    return True
+
+
+def vad_windows(whisper_model, audio) -> List[Dict[str, float]]:
+    """
+    Finestre VAD (<= CHUNK_SIZE secondi) di un audio, calcolate come in
+    `FasterWhisperPipeline.transcribe` di whisperx 3.4 ma senza trascriverle.
+    """
+    from whisperx.vads import Pyannote, Vad
+
+    if issubclass(type(whisper_model.vad_model), Vad):
+        waveform = whisper_model.vad_model.preprocess_audio(audio)
+        merge_chunks = whisper_model.vad_model.merge_chunks
+    else:
+        waveform = Pyannote.preprocess_audio(audio)
+        merge_chunks = Pyannote.merge_chunks
+    vad_segments = whisper_model.vad_model({"waveform": waveform, "sample_rate": SAMPLE_RATE})
+    return merge_chunks(vad_segments, CHUNK_SIZE,
+                        onset=whisper_model._vad_params["vad_onset"], offset=whisper_model._vad_params["vad_offset"])
+
+
+def transcribe_windows(whisper_model, windows: List[Any]) -> List[str]:
+    """Trascrive in un solo batch finestre audio anche di richieste diverse; un testo per finestra."""
+    texts = []
+    outputs = whisper_model(({"inputs": window} for window in windows), batch_size=len(windows), num_workers=0)
+    for out in outputs:
+        text = out["text"]
+        texts.append(text[0] if isinstance(text, list) else text)  # con batch da 1 la pipeline restituisce liste
+    return texts
 
 
 # --- Gestione del Ciclo di Vita dell'Applicazione ---
@@ -65,9 +129,18 @@ async def lifespan(app: FastAPI):
     
     app.state.model_a, app.state.metadata = whisperx.load_align_model(language_code=LANGUAGE, device=DEVICE)
     logging.info("Caricamento del modello di allineamento completato!")    
+
+    app.state.batcher = MicroBatcher(lambda windows: transcribe_windows(app.state.whisper_model, windows),
+                                     max_batch_size=BATCH_SIZE, max_wait_ms=BATCH_MAX_WAIT_MS, name="whisperx-batch")
+    await app.state.batcher.start()
+    # Unico thread che usa model_a: /predict e /predict_batched accodano qui tutti gli allineamenti
+    app.state.aligner = ThreadPoolExecutor(max_workers=1, thread_name_prefix="align")
     
     yield
     
+    await app.state.batcher.stop()
+    app.state.aligner.shutdown(wait=True)
+
     # Pulizia
     logging.info("Rilascio risorse dei modelli...")
     del app.state.whisper_model
@@ -95,46 +168,117 @@ async def liveness_probe():
 
 @app.post("/predict")
 def predict(prediction_request: PredictionRequest, request: Request):
-    predictions = []
-    
-    for uri in prediction_request.instances:
-        temp_audio_path = None
+    """
+    Trascrive le istanze con una pipeline a stadi: un pool di thread scarica e decodifica in
+    anticipo le istanze successive (al più PREFETCH_DEPTH in attesa), il thread principale
+    esegue la trascrizione e l'allineamento di un'istanza avviene mentre si trascrive la
+    successiva, sul thread di allineamento condiviso con /predict_batched. Ogni risultato
+    riporta i tempi delle singole fasi.
+    """
+    uris = list(prediction_request.instances)
+    predictions: List[Optional[Dict[str, Any]]] = [None] * len(uris)
+    whisper_model = request.app.state.whisper_model
+    model_a = request.app.state.model_a
+    metadata = request.app.state.metadata
+    aligner = request.app.state.aligner
+    cache_flushes = 0
+    request_start = time.perf_counter()
+
+    def finish_alignment(entry):
+        nonlocal cache_flushes
+        i, uri, future, timings = entry
+        try:
+            final_result, timings["align"] = future.result()
+            logging.info(f"Allineamento completato per {uri}")
+            predictions[i] = {"result": final_result, "timings": timings}
+        except Exception as e:
+            logging.error(f"Errore durante la predizione per {uri}: {e}", exc_info=True)
+            predictions[i] = {"error": str(e), "instance": uri}
+        if flush_cuda_cache_if_needed():
+            cache_flushes += 1
+
+    with ThreadPoolExecutor(max_workers=PREFETCH_WORKERS, thread_name_prefix="prefetch") as loader:
+        prefetched = deque()
+        next_to_load = 0
+        in_alignment = None
+
+        for i, uri in enumerate(uris):
+            # Mantiene la coda di prefetch piena
+            while next_to_load < len(uris) and len(prefetched) < PREFETCH_DEPTH:
+                prefetched.append(loader.submit(load_instance, uris[next_to_load]))
+                next_to_load += 1
+
+            try:
+                wait_start = time.perf_counter()
+                audio, timings = prefetched.popleft().result()
+                timings["queue_wait"] = time.perf_counter() - wait_start
+                logging.info(f"Trascrizione di {uri} in corso...")
+
+                start = time.perf_counter()
+                transcription = whisper_model.transcribe(audio, batch_size=BATCH_SIZE)
+                timings["transcribe"] = time.perf_counter() - start
+                logging.info(f"Trascrizione iniziale completata per {uri}")
+            except Exception as e:
+                logging.error(f"Errore durante la predizione per {uri}: {e}", exc_info=True)
+                # Restituisce un errore specifico per l'istanza che ha fallito
+                predictions[i] = {"error": str(e), "instance": uri}
+                continue
+
+            # L'allineamento precedente si è sovrapposto a questa trascrizione: si attende che
+            # finisca prima di accodare il nuovo, così resta in memoria al più un audio in allineamento
+            if in_alignment is not None:
+                finish_alignment(in_alignment)
+            in_alignment = (i, uri, aligner.submit(align_segments, transcription['segments'], audio, model_a, metadata), timings)
+
+        if in_alignment is not None:
+            finish_alignment(in_alignment)
+
+    return {
+        "predictions": predictions,
+        "timings": {"total": time.perf_counter() - request_start, "cache_flushes": cache_flushes},
+    }
+
+
+@app.post("/predict_batched")
+async def predict_batched(prediction_request: PredictionRequest, request: Request):
+    """
+    Come /predict, ma le finestre VAD di tutte le istanze e di tutte le richieste concorrenti
+    vengono trascritte insieme in batch da al più BATCH_SIZE (vedi prediction/batching.py).
+    L'allineamento resta per istanza, sul thread dedicato condiviso con /predict.
+    """
+    app_state = request.app.state
+    loop = asyncio.get_running_loop()
+    request_start = time.perf_counter()
+
+    async def run_instance(uri):
         try:
-            temp_audio_path = download_gcs_file(uri)
-            audio = whisperx.load_audio(temp_audio_path)
-            logging.info(f"Trascrizione di {uri} in corso...")
-
-            # --- Pipeline di trascrizione ---
-            
-            # 1. Trascrizione            
-            whisper_model = request.app.state.whisper_model
-            transcription = whisper_model.transcribe(audio, batch_size=BATCH_SIZE)
+            audio, timings = await asyncio.to_thread(load_instance, uri)
+
+            start = time.perf_counter()
+            windows = await asyncio.to_thread(vad_windows, app_state.whisper_model, audio)
+            timings["vad"] = time.perf_counter() - start
+
+            start = time.perf_counter()
+            texts = await app_state.batcher.submit_many(
+                [audio[int(w["start"] * SAMPLE_RATE):int(w["end"] * SAMPLE_RATE)] for w in windows])
+            timings["transcribe"] = time.perf_counter() - start
             logging.info(f"Trascrizione iniziale completata per {uri}")
-            
-            segments = transcription['segments']            
-            
-            # 3. Allineamento
-            model_a = request.app.state.model_a
-            metadata = request.app.state.metadata
-            aligned_transcription = whisperx.align(segments, model_a, metadata, audio, DEVICE, return_char_alignments=False)
-            logging.info(f"Allineamento completato per {uri}")  
-            
-            
-            # 5. Converti in tipi JSON-serializzabili
-            final_result = convert_to_json_serializable(aligned_transcription['segments'])
-            
-            # 6. Risultato finale
-            predictions.append({"result": final_result})
 
+            segments = [{"text": text, "start": round(w["start"], 3), "end": round(w["end"], 3)}
+                        for w, text in zip(windows, texts)]
+            final_result, timings["align"] = await loop.run_in_executor(
+                app_state.aligner, align_segments, segments, audio, app_state.model_a, app_state.metadata)
+            logging.info(f"Allineamento completato per {uri}")
+            return {"result": final_result, "timings": timings}
         except Exception as e:
             logging.error(f"Errore durante la predizione per {uri}: {e}", exc_info=True)
-            # Restituisce un errore specifico per l'istanza che ha fallito
-            predictions.append({"error": str(e), "instance": uri})
-        finally:
-            # Pulizia del file temporaneo e della cache CUDA per il prossimo ciclo
-            if temp_audio_path and os.path.exists(temp_audio_path):
-                os.remove(temp_audio_path)
-            gc.collect()
-            torch.cuda.empty_cache()
-
-    return {"predictions": predictions}
\ No newline at end of file
+            return {"error": str(e), "instance": uri}
+
+    predictions = await asyncio.gather(*(run_instance(uri) for uri in prediction_request.instances))
+    return {"predictions": list(predictions), "timings": {"total": time.perf_counter() - request_start}}
+
+
+@app.get("/batch_stats")
+async def batch_stats(request: Request):
+    """Profondità della coda, riempimento dei batch e percentili di latenza del micro-batcher."""
+    return request.app.state.batcher.stats()
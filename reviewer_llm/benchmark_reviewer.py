@@ -0,0 +1,140 @@
+"""
+Benchmark del reviewer contro lo stub locale (`stub_server.py`): throughput sequenziale (come i
+notebook, una richiesta alla volta) e concorrente, con errori 429/503 e risposte incomplete
+iniettati. Lo stub restituisce il testo ricevuto, quindi l'output deve coincidere con l'input;
+verifica anche che un secondo passaggio con lo stesso checkpoint non invii richieste e che,
+con la cache delle risposte, rivedere un SRT con il 5% dei sottotitoli modificati invii solo
+quelli.
+
+Uso:
+    python reviewer_llm/benchmark_reviewer.py --files 4 --subtitles 400 --latency-ms 300 --concurrency 16
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from reviewer_llm.response_cache import ResponseCache  # noqa: E402
+from reviewer_llm.reviewer import ChunkReviewer, LineReviewer, RestBackend  # noqa: E402
+from reviewer_llm.stub_server import LINE_MARKER, StubServer  # noqa: E402
+
+CHUNK_PROMPT = "Correggi i sottotitoli in {language}. Rispondi con un array JSON."
+LINE_PROMPT = "Correggi la frase in {language}.\n\n" + LINE_MARKER + "\n"
+
+
+def synthetic_files(n_files, n_subtitles):
+    return {f"file_{f}": [f"sottotitolo {i} del file {f}, è andato tutto bene?" for i in range(n_subtitles)]
+            for f in range(n_files)}
+
+
+async def review_all(reviewer, files, checkpoint_dir=None):
+    async def one(name, texts):
+        checkpoint = os.path.join(checkpoint_dir, f"{name}.jsonl") if checkpoint_dir else None
+        return name, await reviewer.review_texts(texts, checkpoint)
+
+    return dict(await asyncio.gather(*(one(name, texts) for name, texts in files.items())))
+
+
+def edited(files, fraction, seed=0):
+    """Copia dei file con una frazione dei sottotitoli modificata (es. dopo una ristandardizzazione)."""
+    rng = random.Random(seed)
+    return {name: [text.replace("bene", "benissimo") if rng.random() < fraction else text for text in texts]
+            for name, texts in files.items()}
+
+
+def run_case(label, reviewer_cls, files, backend, concurrency, rps, checkpoint_dir=None, **kwargs):
+    prompt = CHUNK_PROMPT if reviewer_cls is ChunkReviewer else LINE_PROMPT
+    reviewer = reviewer_cls(backend, "stub-model", prompt, concurrency=concurrency, requests_per_second=rps,
+                            backoff_base=0.05, backoff_cap=1.0, **kwargs)
+    t0 = time.perf_counter()
+    out = asyncio.run(review_all(reviewer, files, checkpoint_dir))
+    elapsed = time.perf_counter() - t0
+    assert out == files, f"{label}: output diverso dall'input"
+    n = sum(len(texts) for texts in files.values())
+    s = reviewer.stats
+    print(f"  {label:<34} {elapsed:6.2f} s  {n / elapsed:7.1f} sottotitoli/s  richieste={s['requests']} "
+          f"retry_api={s['api_retries']} retry_validazione={s['validation_retries']} fallback={s['fallbacks']} "
+          f"da_checkpoint={s['checkpointed']}")
+    return elapsed, reviewer
+
+
+def run(n_files, n_subtitles, latency_ms, error_rate, mismatch_rate, concurrency, rps):
+    server = StubServer(latency_ms=latency_ms, jitter_ms=latency_ms / 3, error_rate=error_rate,
+                        mismatch_rate=mismatch_rate).start()
+    backend = RestBackend(server.base_url, max_workers=concurrency)
+    files = synthetic_files(n_files, n_subtitles)
+    line_files = {name: texts[:n_subtitles // 8] for name, texts in files.items()}
+    print(f"[INFO] Stub {server.base_url}: latenza {latency_ms:.0f} ms, errori {error_rate:.0%}, "
+          f"risposte incomplete {mismatch_rate:.0%}")
+    try:
+        print(f"[INFO] Chunk (Gemini): {n_files} file x {n_subtitles} sottotitoli, 40 per richiesta")
+        t_seq, _ = run_case("sequenziale (come il notebook)", ChunkReviewer, files, backend, 1, None)
+        t_conc, _ = run_case(f"concorrente ({concurrency}, {rps} req/s)", ChunkReviewer, files, backend,
+                             concurrency, rps)
+        print(f"  speedup x{t_seq / t_conc:.1f}")
+
+        print(f"[INFO] Riga singola (Gemma): {n_files} file x {n_subtitles // 8} sottotitoli")
+        t_seq, _ = run_case("sequenziale (come il notebook)", LineReviewer, line_files, backend, 1, None)
+        t_conc, _ = run_case(f"concorrente ({concurrency}, {rps} req/s)", LineReviewer, line_files, backend,
+                             concurrency, rps)
+        print(f"  speedup x{t_seq / t_conc:.1f}")
+
+        print("[INFO] Ripresa da checkpoint")
+        with tempfile.TemporaryDirectory() as checkpoint_dir:
+            run_case("primo passaggio", ChunkReviewer, files, backend, concurrency, rps, checkpoint_dir)
+            _, reviewer = run_case("secondo passaggio", ChunkReviewer, files, backend, concurrency, rps,
+                                   checkpoint_dir)
+            assert reviewer.stats["requests"] == 0, "il secondo passaggio non dovrebbe inviare richieste"
+
+        print("[INFO] Cache delle risposte: revisione di un SRT con il 5% dei sottotitoli modificati")
+        with tempfile.TemporaryDirectory() as cache_dir:
+            changed_files = edited(files, 0.05)
+            changed_lines = edited(line_files, 0.05)
+            n_changed = sum(a != b for name in files for a, b in zip(files[name], changed_files[name]))
+            n_changed_lines = sum(a != b for name in line_files
+                                  for a, b in zip(line_files[name], changed_lines[name]))
+            for label, reviewer_cls, before, after, n in (
+                    ("chunk", ChunkReviewer, files, changed_files, n_changed),
+                    ("riga singola", LineReviewer, line_files, changed_lines, n_changed_lines)):
+                cache = ResponseCache(os.path.join(cache_dir, f"{label}.sqlite"), max_entries=100_000)
+                t_full, _ = run_case(f"{label}: prima revisione", reviewer_cls, before, backend, concurrency, rps,
+                                     cache=cache)
+                t_diff, reviewer = run_case(f"{label}: dopo le modifiche ({n} cambiati)", reviewer_cls, after,
+                                            backend, concurrency, rps, cache=cache)
+                assert reviewer.stats["cache_hits"] == sum(len(t) for t in after.values()) - n
+                print(f"  {label}: x{t_full / t_diff:.1f}, cache {cache.stats()}")
+
+        # Eviction LRU: oltre il limite restano le voci usate più di recente
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache = ResponseCache(os.path.join(cache_dir, "lru.sqlite"), max_entries=3)
+            for i in range(3):
+                cache.put_many({f"k{i}": "x"})
+                time.sleep(0.01)
+            cache.get_many(["k0"])
+            cache.put_many({"k3": "x"})
+            assert set(cache.get_many(["k0", "k1", "k2", "k3"])) == {"k0", "k2", "k3"}
+            cache.max_entries, cache.max_bytes = None, 2
+            cache.put_many({"k4": "xy"})
+            assert len(cache) == 1 and cache.evictions == 4
+        print(f"[INFO] Stub: {server.stats}")
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, default=4)
+    parser.add_argument("--subtitles", type=int, default=400)
+    parser.add_argument("--latency-ms", type=float, default=300.0)
+    parser.add_argument("--error-rate", type=float, default=0.05)
+    parser.add_argument("--mismatch-rate", type=float, default=0.05)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--rps", type=float, default=50.0)
+    args = parser.parse_args()
+    run(args.files, args.subtitles, args.latency_ms, args.error_rate, args.mismatch_rate, args.concurrency,
+        args.rps)
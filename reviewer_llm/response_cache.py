@@ -0,0 +1,110 @@
+"""
+Cache persistente delle correzioni del reviewer LLM (SQLite).
+
+Chiave: sha1 di modalità, modello, hash del prompt, temperatura e testo del sottotitolo
+normalizzato (spazi compattati). La cache è per sottotitolo anche in modalità chunk: rivedendo
+un SRT ristandardizzato vengono inviati solo i sottotitoli cambiati, raggruppati in nuovi chunk.
+
+Le voci sono limitate per numero (`max_entries`) e/o dimensione dei testi (`max_bytes`): oltre
+il limite vengono eliminate quelle usate meno di recente (LRU, `last_used` aggiornato a ogni hit).
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from typing import Dict, Optional, Sequence
+
+REVIEWER_CACHE_PATH = "../data/cache/reviewer_llm.sqlite"
+
+
+def normalize_text(text: str) -> str:
+    return " ".join(text.split())
+
+
+def prompt_hash(prompt: str) -> str:
+    return hashlib.sha1(prompt.encode("utf-8")).hexdigest()
+
+
+def response_key(mode: str, model: str, prompt_sha: str, temperature: float, text: str) -> str:
+    payload = json.dumps([mode, model, prompt_sha, float(temperature), normalize_text(text)], ensure_ascii=False)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    Args:
+        path: file SQLite della cache.
+        max_entries: numero massimo di voci (None: nessun limite).
+        max_bytes: dimensione massima dei testi in cache, in byte UTF-8 (None: nessun limite).
+    """
+
+    def __init__(self, path: str = REVIEWER_CACHE_PATH, max_entries: Optional[int] = None,
+                 max_bytes: Optional[int] = None):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.connection = sqlite3.connect(path)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, response TEXT NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+        self.connection.commit()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_many(self, keys: Sequence[str]) -> Dict[str, str]:
+        found = {}
+        keys = list(dict.fromkeys(keys))
+        for i in range(0, len(keys), 500):  # limite di parametri per query di SQLite
+            chunk = keys[i:i + 500]
+            query = f"SELECT key, response FROM responses WHERE key IN ({','.join('?' * len(chunk))})"
+            found.update(self.connection.execute(query, chunk).fetchall())
+        if found:
+            now = time.time()
+            self.connection.executemany("UPDATE responses SET last_used = ? WHERE key = ?",
+                                        [(now, key) for key in found])
+            self.connection.commit()
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, items: Dict[str, str]):
+        now = time.time()
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO responses (key, response, size, last_used) VALUES (?, ?, ?, ?)",
+            [(key, response, len(response.encode("utf-8")), now) for key, response in items.items()])
+        self.evict()
+        self.connection.commit()
+
+    def evict(self):
+        """Elimina le voci meno recenti oltre `max_entries` o `max_bytes`."""
+        if self.max_entries is None and self.max_bytes is None:
+            return
+        max_entries = self.max_entries if self.max_entries is not None else -1
+        max_bytes = self.max_bytes if self.max_bytes is not None else -1
+        cursor = self.connection.execute(
+            "DELETE FROM responses WHERE key IN ("
+            " SELECT key FROM ("
+            "  SELECT key,"
+            "   ROW_NUMBER() OVER (ORDER BY last_used DESC, key) AS rank,"
+            "   SUM(size) OVER (ORDER BY last_used DESC, key) AS kept_bytes"
+            "  FROM responses)"
+            " WHERE (? >= 0 AND rank > ?) OR (? >= 0 AND kept_bytes > ?))",
+            (max_entries, max_entries, max_bytes, max_bytes))
+        self.evictions += cursor.rowcount
+
+    def stats(self) -> Dict[str, float]:
+        entries, size = self.connection.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        lookups = self.hits + self.misses
+        return {"entries": entries, "bytes": size, "hits": self.hits, "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None, "evictions": self.evictions}
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def close(self):
+        self.connection.close()
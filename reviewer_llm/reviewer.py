@@ -0,0 +1,443 @@
+"""
+Reviewer LLM dei sottotitoli con richieste concorrenti (asyncio).
+
+Le due modalità dei notebook:
+- `ChunkReviewer` (reviewer_llm.ipynb, Gemini): chunk di `max_sub_for_request` sottotitoli
+  inviati come array JSON, con risposta JSON validata sul numero di elementi e richiesta di
+  correzione in caso di mismatch;
+- `LineReviewer` (reviewer_llm_gemma.ipynb, Gemma): una richiesta per sottotitolo.
+
+I chunk (o le righe) di uno o più file sono inviati in parallelo, entro `concurrency` richieste
+in volo e `requests_per_second` (token bucket). Gli errori temporanei dell'API (429, 5xx, errori
+di rete) vengono ritentati con backoff esponenziale e jitter. Ogni unità completata viene
+aggiunta a un checkpoint JSONL: rieseguendo lo stesso file le unità già fatte (con lo stesso
+input) non vengono reinviate. Con una `ResponseCache` (response_cache.py) le correzioni sono
+salvate per sottotitolo e una nuova revisione invia solo i sottotitoli cambiati.
+
+Il trasporto è separato: `GenaiBackend` usa `google.genai` (client.aio), `RestBackend` parla
+direttamente l'API REST `generateContent` (solo libreria standard, usato con lo stub locale di
+`stub_server.py`).
+"""
+import asyncio
+import hashlib
+import json
+import os
+import random
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from copy import deepcopy
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from reviewer_llm.response_cache import ResponseCache, prompt_hash, response_key
+
+RETRIABLE_STATUS = {408, 429, 500, 502, 503, 504}
+
+# Schema della risposta in modalità chunk: [{"index": int, "sottotitolo_corretto": str}, ...]
+CORRECTIONS_SCHEMA = {
+    "type": "ARRAY",
+    "items": {
+        "type": "OBJECT",
+        "properties": {"index": {"type": "INTEGER"}, "sottotitolo_corretto": {"type": "STRING"}},
+        "required": ["index", "sottotitolo_corretto"],
+    },
+}
+
+
+class ReviewerAPIError(Exception):
+    """Errore dell'API; `status` è None per gli errori di rete."""
+
+    def __init__(self, message: str, status: Optional[int] = None):
+        super().__init__(message)
+        self.status = status
+
+    @property
+    def retriable(self) -> bool:
+        return self.status is None or self.status in RETRIABLE_STATUS
+
+
+# --- Trasporto ---
+# I messaggi sono tuple (role, text) e la configurazione un dict con chiavi temperature,
+# system_instruction, json_schema (schema della risposta JSON o None) e thinking_budget.
+
+class GenaiBackend:
+    """Chiamate tramite `google.genai.Client` (API asincrona `client.aio`)."""
+
+    def __init__(self, client):
+        self.client = client
+
+    async def generate(self, model: str, messages: Sequence[Tuple[str, str]], config: Dict[str, Any]) -> str:
+        from google.genai import errors, types
+
+        contents = [types.Content(role=role, parts=[types.Part.from_text(text=text)]) for role, text in messages]
+        genai_config = {"temperature": config.get("temperature", 0)}
+        if config.get("system_instruction"):
+            genai_config["system_instruction"] = config["system_instruction"]
+        if config.get("json_schema"):
+            genai_config["response_mime_type"] = "application/json"
+            genai_config["response_schema"] = config["json_schema"]
+        if config.get("thinking_budget") is not None:
+            genai_config["thinking_config"] = {"include_thoughts": False, "thinking_budget": config["thinking_budget"]}
+        try:
+            response = await self.client.aio.models.generate_content(model=model, contents=contents, config=genai_config)
+        except errors.APIError as e:
+            raise ReviewerAPIError(str(e), e.code) from e
+        return response.text or ""
+
+
+class RestBackend:
+    """Chiamate REST dirette a `{base_url}/v1beta/models/{model}:generateContent`."""
+
+    def __init__(self, base_url: str, api_key: str = "", timeout: float = 120.0, max_workers: int = 64):
+        self.base_url = base_url.rstrip("/")
+        self.api_key = api_key
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="reviewer-http")
+
+    @staticmethod
+    def payload(messages: Sequence[Tuple[str, str]], config: Dict[str, Any]) -> Dict[str, Any]:
+        generation_config = {"temperature": config.get("temperature", 0)}
+        if config.get("json_schema"):
+            generation_config["responseMimeType"] = "application/json"
+            generation_config["responseSchema"] = config["json_schema"]
+        if config.get("thinking_budget") is not None:
+            generation_config["thinkingConfig"] = {"includeThoughts": False, "thinkingBudget": config["thinking_budget"]}
+        body = {
+            "contents": [{"role": role, "parts": [{"text": text}]} for role, text in messages],
+            "generationConfig": generation_config,
+        }
+        if config.get("system_instruction"):
+            body["systemInstruction"] = {"parts": [{"text": config["system_instruction"]}]}
+        return body
+
+    def _post(self, model: str, body: bytes) -> str:
+        request = urllib.request.Request(
+            f"{self.base_url}/v1beta/models/{model}:generateContent", data=body, method="POST",
+            headers={"Content-Type": "application/json", "x-goog-api-key": self.api_key})
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                data = json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            raise ReviewerAPIError(f"HTTP {e.code}: {e.read()[:200]!r}", e.code) from e
+        except (urllib.error.URLError, OSError) as e:
+            raise ReviewerAPIError(f"Errore di rete: {e}") from e
+        candidates = data.get("candidates") or [{}]
+        parts = candidates[0].get("content", {}).get("parts", [])
+        return "".join(part.get("text", "") for part in parts)
+
+    async def generate(self, model: str, messages: Sequence[Tuple[str, str]], config: Dict[str, Any]) -> str:
+        body = json.dumps(self.payload(messages, config), ensure_ascii=False).encode("utf-8")
+        return await asyncio.get_running_loop().run_in_executor(self._executor, self._post, model, body)
+
+
+# --- Limiti e retry ---
+
+class TokenBucket:
+    """Limita le richieste a `rate` al secondo, con raffiche fino a `capacity`."""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, tokens: float = 1.0):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                await asyncio.sleep((tokens - self.tokens) / self.rate)
+
+
+def backoff_delay(attempt: int, base: float = 1.0, cap: float = 60.0, rng: random.Random = random) -> float:
+    """Backoff esponenziale con full jitter: uniforme in [0, min(cap, base * 2^attempt)]."""
+    return rng.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def text_hash(value: Any) -> str:
+    return hashlib.sha1(json.dumps(value, ensure_ascii=False, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class Checkpoint:
+    """
+    Checkpoint JSONL delle unità completate: una riga {"unit", "input_hash", "output"} per
+    unità. Un'unità è considerata fatta solo se l'hash dell'input coincide.
+    """
+
+    def __init__(self, path: Optional[str]):
+        self.path = path
+        self.done: Dict[int, Tuple[str, Any]] = {}
+        if path and os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # riga troncata da un'interruzione
+                    self.done[record["unit"]] = (record["input_hash"], record["output"])
+
+    def get(self, unit: int, input_hash: str):
+        record = self.done.get(unit)
+        return record[1] if record is not None and record[0] == input_hash else None
+
+    def add(self, unit: int, input_hash: str, output: Any):
+        self.done[unit] = (input_hash, output)
+        if not self.path:
+            return
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"unit": unit, "input_hash": input_hash, "output": output}, ensure_ascii=False) + "\n")
+
+
+# --- Reviewer ---
+
+class SubtitleReviewer:
+    """
+    Parte comune: concorrenza, rate limit, retry con backoff, checkpoint, cache e statistiche.
+
+    Args:
+        backend: `GenaiBackend` o `RestBackend`.
+        model: nome del modello.
+        system_prompt: prompt con segnaposto {language}.
+        concurrency: richieste in volo al massimo.
+        requests_per_second: limite del token bucket (None: nessun limite).
+        max_api_retries: tentativi per gli errori temporanei dell'API.
+        cache: `ResponseCache` delle correzioni per sottotitolo (None: nessuna cache).
+    """
+
+    mode = ""
+
+    def __init__(self, backend, model: str, system_prompt: str, language: str = "italiano", concurrency: int = 8,
+                 requests_per_second: Optional[float] = None, max_api_retries: int = 5,
+                 backoff_base: float = 1.0, backoff_cap: float = 60.0, temperature: float = 0,
+                 cache: Optional[ResponseCache] = None):
+        self.backend = backend
+        self.model = model
+        self.system_prompt = system_prompt.format(language=language)
+        self.prompt_sha = prompt_hash(self.system_prompt)
+        self.temperature = temperature
+        self.cache = cache
+        self.max_api_retries = max_api_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.limiter = TokenBucket(requests_per_second) if requests_per_second else None
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self.stats = {"requests": 0, "api_errors": 0, "api_retries": 0, "validation_retries": 0,
+                      "fallbacks": 0, "units": 0, "checkpointed": 0, "cache_hits": 0}
+
+    async def call(self, messages: Sequence[Tuple[str, str]], config: Dict[str, Any]) -> str:
+        """Una chiamata al modello con rate limit e retry degli errori temporanei."""
+        attempt = 0
+        while True:
+            if self.limiter is not None:
+                await self.limiter.acquire()
+            async with self._semaphore:
+                self.stats["requests"] += 1
+                try:
+                    return await self.backend.generate(self.model, messages, config)
+                except ReviewerAPIError as e:
+                    self.stats["api_errors"] += 1
+                    if not e.retriable or attempt >= self.max_api_retries:
+                        raise
+                    error = e
+            delay = backoff_delay(attempt, self.backoff_base, self.backoff_cap)
+            print(f"[WARN] {error} (tentativo {attempt + 1}/{self.max_api_retries}), nuovo tentativo tra {delay:.1f} s")
+            self.stats["api_retries"] += 1
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    def units(self, texts: List[str]) -> List[List[str]]:
+        raise NotImplementedError
+
+    async def review_unit(self, unit: List[str], indices: Optional[List[int]] = None) -> Optional[List[str]]:
+        """
+        Testi corretti di un'unità (stessa lunghezza); None se la correzione non è riuscita.
+        `indices` sono le posizioni 1-based dei testi nel file (default: 1..len(unit)).
+        """
+        raise NotImplementedError
+
+    def cache_key(self, text: str) -> str:
+        return response_key(self.mode, self.model, self.prompt_sha, self.temperature, text)
+
+    async def review_texts(self, texts: List[str], checkpoint_path: Optional[str] = None) -> List[str]:
+        """
+        Corregge una lista di testi, un'unità per richiesta, con tutte le unità in parallelo.
+        Con la cache vengono inviati solo i testi non in cache. Le unità non riuscite restano
+        invariate e non finiscono né in checkpoint né in cache (vengono ritentate alla prossima
+        esecuzione).
+        """
+        corrected = list(texts)
+        todo = list(range(len(texts)))
+        if self.cache is not None:
+            keys = [self.cache_key(text) for text in texts]
+            cached = self.cache.get_many(keys)
+            todo = [i for i, key in enumerate(keys) if key not in cached]
+            for i, key in enumerate(keys):
+                if key in cached:
+                    corrected[i] = cached[key]
+            self.stats["cache_hits"] += len(texts) - len(todo)
+            print(f"[INFO] Cache reviewer: {len(texts)} sottotitoli, {len(texts) - len(todo)} in cache, "
+                  f"{len(todo)} da correggere")
+
+        checkpoint = Checkpoint(checkpoint_path)
+        offsets = []
+        units = self.units([texts[i] for i in todo])
+
+        async def run(k, unit, indices):
+            input_hash = text_hash([self.mode, self.model, self.system_prompt, self.temperature, unit])
+            output = checkpoint.get(k, input_hash)
+            if output is not None:
+                self.stats["checkpointed"] += 1
+            else:
+                output = await self.review_unit(unit, indices)
+                if output is None:
+                    return list(unit)
+                checkpoint.add(k, input_hash, output)
+                self.stats["units"] += 1
+            if self.cache is not None:
+                self.cache.put_many({self.cache_key(text): fixed for text, fixed in zip(unit, output)})
+            return output
+
+        start = 0
+        for unit in units:
+            offsets.append(start)
+            start += len(unit)
+        # Indici 1-based dei sottotitoli nel file, come in `correct_subs` (41..80 per il secondo chunk da 40)
+        outputs = await asyncio.gather(*(run(k, unit, [todo[offset + j] + 1 for j in range(len(unit))])
+                                         for k, (offset, unit) in enumerate(zip(offsets, units))))
+        for offset, output in zip(offsets, outputs):
+            for j, text in enumerate(output):
+                corrected[todo[offset + j]] = text
+        return corrected
+
+    async def review(self, subtitles, checkpoint_path: Optional[str] = None):
+        """Come `review_texts`, su oggetti con `.text`: restituisce copie con il testo corretto."""
+        corrected = await self.review_texts([sub.text for sub in subtitles], checkpoint_path)
+        out = []
+        for sub, text in zip(subtitles, corrected):
+            new_sub = deepcopy(sub)
+            new_sub.text = text
+            out.append(new_sub)
+        return out
+
+
+class ChunkReviewer(SubtitleReviewer):
+    """Modalità di `correct_subs` (reviewer_llm.ipynb): chunk JSON con validazione del numero di elementi."""
+
+    mode = "chunk"
+
+    def __init__(self, *args, max_sub_for_request: int = 40, max_retries: int = 3,
+                 thinking_budget: Optional[int] = 0, json_schema=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.max_sub_for_request = max_sub_for_request
+        self.max_retries = max_retries
+        self.config = {"temperature": self.temperature, "system_instruction": self.system_prompt,
+                       "json_schema": json_schema or CORRECTIONS_SCHEMA, "thinking_budget": thinking_budget}
+
+    def units(self, texts):
+        return [texts[i:i + self.max_sub_for_request] for i in range(0, len(texts), self.max_sub_for_request)]
+
+    @staticmethod
+    def parse_corrections(response_text: str) -> List[Tuple[int, str]]:
+        try:
+            response_data = json.loads(response_text)
+        except json.JSONDecodeError:
+            print(f"[WARN] Risposta non JSON: {response_text[:300]!r}")
+            return []
+        if not isinstance(response_data, list):
+            return []
+        return [(entry["index"], entry["sottotitolo_corretto"]) for entry in response_data
+                if isinstance(entry, dict) and "index" in entry and "sottotitolo_corretto" in entry]
+
+    async def review_unit(self, unit, indices=None):
+        indices = indices or range(1, len(unit) + 1)
+        request = [{"index": idx, "sottotitolo": text} for idx, text in zip(indices, unit)]
+        request_text = json.dumps(request, ensure_ascii=False)
+        messages = [("user", request_text)]
+        try:
+            for retry in range(self.max_retries):
+                response_text = await self.call(messages, self.config)
+                corrections = self.parse_corrections(response_text)
+                if len(corrections) == len(unit):
+                    return [fixed.strip() if fixed else original for original, (_, fixed) in zip(unit, corrections)]
+                print(f"[WARN] Errore di validazione: chunk size atteso={len(unit)}, ricevuto={len(corrections)}. "
+                      f"Retry {retry + 1}/{self.max_retries}")
+                self.stats["validation_retries"] += 1
+                messages = messages + [("model", response_text), ("user", (
+                    f"!!! ERRORE !!!\n"
+                    f"La correzione effettuata ha restituito {len(corrections)} sottotitoli, ma ne erano attesi {len(unit)}.\n"
+                    f"Correggi nuovamente i sottotitoli **mantenendo lo stesso numero di elementi**.\n"
+                    f"Rispondi SOLO con JSON (array) e non aggiungere testo libero.\n\n"
+                    f"Questi sono i sottotitoli da correggere:\n{request_text}"))]
+            print("[WARN] Max retries raggiunti per un chunk: verranno mantenuti i sottotitoli originali.")
+        except ReviewerAPIError as e:
+            print(f"[ERRORE] Chunk non corretto (mantengo i sottotitoli originali): {e}")
+        self.stats["fallbacks"] += 1
+        return None
+
+
+class LineReviewer(SubtitleReviewer):
+    """Modalità di `correct_single_subtitle` (reviewer_llm_gemma.ipynb): una richiesta per sottotitolo."""
+
+    mode = "line"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Gemma non supporta le system instruction: il prompt precede il testo nel messaggio utente
+        self.config = {"temperature": self.temperature}
+
+    def units(self, texts):
+        return [[text] for text in texts]
+
+    @staticmethod
+    def clean_response(corrected_text: str, original_text: str) -> str:
+        corrected_text = corrected_text.strip()
+        # Rimuovi eventuali markdown o formattazioni extra
+        if corrected_text.startswith('```'):
+            lines = corrected_text.split('\n')
+            corrected_text = '\n'.join(lines[1:-1]) if len(lines) > 2 else corrected_text
+        # Se la risposta è vuota o troppo diversa (possibile allucinazione), usa l'originale
+        if not corrected_text or len(corrected_text) > len(original_text) * 2:
+            print(f"[WARN] Risposta sospetta per '{original_text[:50]}...': '{corrected_text[:50]}...'. Uso originale.")
+            return original_text
+        return corrected_text
+
+    async def review_unit(self, unit, indices=None):
+        subtitle_text = unit[0]
+        if not subtitle_text or not subtitle_text.strip():
+            return [subtitle_text]
+        original_text = subtitle_text.strip()
+        try:
+            response_text = await self.call([("user", self.system_prompt + original_text)], self.config)
+        except ReviewerAPIError as e:
+            print(f"[ERRORE] Max retries raggiunti per '{original_text[:50]}...' ({e}). Mantengo testo originale.")
+            self.stats["fallbacks"] += 1
+            return None
+        return [self.clean_response(response_text, original_text)]
+
+
+def convert_ms_to_str(ms: int) -> str:
+    h = ms // 3600000
+    ms = ms % 3600000
+    m = ms // 60000
+    ms = ms % 60000
+    s = ms // 1000
+    ms = ms % 1000
+    return f"{h:02}:{m:02}:{s:02},{ms:03}"
+
+
+def write_srt(subtitles, path: str):
+    """Scrive i sottotitoli (oggetti con start_time/end_time in ms e text) in formato SRT."""
+    with open(path, "w", encoding="utf-8") as f:
+        for idx, sub in enumerate(subtitles, start=1):
+            f.write(f"{idx}\n")
+            f.write(f"{convert_ms_to_str(sub.start_time)} --> {convert_ms_to_str(sub.end_time)}\n")
+            f.write(f"{sub.text}\n\n")
@@ -0,0 +1,161 @@
+"""
+Server HTTP locale che imita `POST /v1beta/models/{model}:generateContent` dell'API Gemini,
+per misurare throughput e comportamento sotto errori del reviewer senza chiamare l'API reale.
+
+Le risposte restituiscono il testo ricevuto senza modifiche:
+- richiesta JSON (array di {"index", "sottotitolo"}): array di {"index", "sottotitolo_corretto"};
+- altrimenti: il testo dopo "Frase da correggere:" (modalità Gemma), o l'intero messaggio.
+
+Latenza (media e jitter), frequenza degli errori (429/503) e frequenza delle risposte con un
+elemento mancante (per provare i retry di validazione) sono configurabili.
+
+Uso:
+    python reviewer_llm/stub_server.py --port 8765 --latency-ms 800 --jitter-ms 300 --error-rate 0.05
+Il reviewer vi si collega con `RestBackend("http://127.0.0.1:8765")`, oppure con
+`genai.Client(api_key="stub", http_options={"base_url": "http://127.0.0.1:8765"})`.
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_PATH = re.compile(r"^/v1(?:beta)?/models/([^/:]+):generateContent")
+_TRAILING_ARRAY = re.compile(r"(\[\s*\{.*\])\s*$", re.S)
+LINE_MARKER = "Frase da correggere:"
+
+
+def echo_response(text: str, rng: random.Random, mismatch_rate: float):
+    """Testo della risposta del modello finto e se manca un elemento."""
+    # Nei retry di validazione l'array da correggere è in fondo al messaggio
+    match = _TRAILING_ARRAY.search(text)
+    try:
+        request = json.loads(match.group(1)) if match else None
+    except json.JSONDecodeError:
+        request = None
+    if isinstance(request, list):
+        corrections = [{"index": item["index"], "sottotitolo_corretto": item["sottotitolo"]} for item in request]
+        mismatch = bool(corrections) and rng.random() < mismatch_rate
+        if mismatch:
+            corrections.pop(rng.randrange(len(corrections)))
+        return json.dumps(corrections, ensure_ascii=False), mismatch
+    if LINE_MARKER in text:
+        return text.rsplit(LINE_MARKER, 1)[1].strip(), False
+    return text, False
+
+
+class StubServer:
+    """
+    Args:
+        latency_ms: latenza media di una risposta.
+        jitter_ms: ampiezza della variazione uniforme della latenza (±).
+        error_rate: probabilità di rispondere con un errore 429 o 503.
+        mismatch_rate: probabilità (richieste JSON) di omettere un elemento della risposta.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency_ms: float = 500.0, jitter_ms: float = 0.0,
+                 error_rate: float = 0.0, mismatch_rate: float = 0.0, seed: int = 0):
+        self.latency = latency_ms / 1000.0
+        self.jitter = jitter_ms / 1000.0
+        self.error_rate = error_rate
+        self.mismatch_rate = mismatch_rate
+        self.rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.stats = {"requests": 0, "errors": 0, "mismatches": 0, "max_in_flight": 0}
+        self._in_flight = 0
+        self.httpd = ThreadingHTTPServer((host, port), self._handler())
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, payload):
+                body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json; charset=UTF-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                match = _PATH.match(self.path)
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if not match:
+                    self._send(404, {"error": {"code": 404, "message": f"Percorso sconosciuto: {self.path}",
+                                               "status": "NOT_FOUND"}})
+                    return
+                status, payload = server.handle(match.group(1), json.loads(body or b"{}"))
+                self._send(status, payload)
+
+        return Handler
+
+    def handle(self, model: str, request: dict):
+        with self._lock:
+            self.stats["requests"] += 1
+            self._in_flight += 1
+            self.stats["max_in_flight"] = max(self.stats["max_in_flight"], self._in_flight)
+            delay = max(0.0, self.latency + self.rng.uniform(-self.jitter, self.jitter))
+            failure = self.rng.random() < self.error_rate
+            status = self.rng.choice([429, 503]) if failure else 200
+        try:
+            time.sleep(delay)
+            if failure:
+                with self._lock:
+                    self.stats["errors"] += 1
+                message = "Resource has been exhausted" if status == 429 else "The model is overloaded"
+                return status, {"error": {"code": status, "message": message,
+                                          "status": "RESOURCE_EXHAUSTED" if status == 429 else "UNAVAILABLE"}}
+            # L'ultimo messaggio utente è quello da correggere
+            user_turns = [c for c in request.get("contents", []) if c.get("role", "user") == "user"]
+            text = "".join(part.get("text", "") for part in user_turns[-1]["parts"]) if user_turns else ""
+            with self._lock:
+                answer, mismatch = echo_response(text, self.rng, self.mismatch_rate)
+                self.stats["mismatches"] += mismatch
+            return 200, {
+                "candidates": [{"content": {"role": "model", "parts": [{"text": answer}]}, "finishReason": "STOP",
+                                "index": 0}],
+                "usageMetadata": {"promptTokenCount": len(text) // 4, "candidatesTokenCount": len(answer) // 4,
+                                  "totalTokenCount": (len(text) + len(answer)) // 4},
+                "modelVersion": model,
+            }
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+    def start(self) -> "StubServer":
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="stub-server", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=500.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--mismatch-rate", type=float, default=0.0)
+    args = parser.parse_args()
+    server = StubServer(args.host, args.port, args.latency_ms, args.jitter_ms, args.error_rate, args.mismatch_rate)
+    print(f"[INFO] Stub in ascolto su {server.base_url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
@@ -0,0 +1,405 @@
+"""
+Standardizzazione delle predizioni ASR (come standardization_asr_predictions.ipynb), in un solo
+passaggio per episodio.
+
+Formati per modello (`MODEL_FORMATS`):
+- "whisper" (whisper_large, whisperx): risposta dell'endpoint {"predictions": [{"result": [...]}]};
+  il JSON viene riscritto con la sola lista dei segmenti della prima predizione. Un JSON già
+  standardizzato (lista di segmenti) produce solo testo e SRT;
+- "segments" (parakeet): lista di segmenti in secondi, il JSON resta invariato;
+- "assemblyai": lista di frasi con tempi in millisecondi (interi), anche per le parole; il JSON
+  viene riscritto in secondi. Un JSON già convertito (tempi float) produce solo testo e SRT.
+
+Ogni segmento viene letto una volta e scritto subito nei tre output (JSON, testo, SRT), con
+scritture bufferizzate su file temporanei sostituiti alla fine. I JSON sotto `STREAM_MIN_BYTES`
+sono letti con `json.load` (parser C, più veloce); quelli più grandi, con `ijson` installato, un
+segmento alla volta senza caricare l'intero file. Gli output sono identici a quelli del notebook
+(SRT numerati da 0, testo con uno spazio dopo ogni segmento, JSON con indent=2).
+
+`standardize_all` distribuisce gli episodi su un pool di processi e salta quelli invariati:
+un manifest registra mtime, dimensione e sha1 del JSON standardizzato, quindi un file già
+standardizzato (anche solo "toccato") non viene rielaborato.
+"""
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from json.encoder import encode_basestring
+from typing import Dict, Iterator, List, Optional, Tuple
+
+try:
+    import ijson
+except ImportError:  # parsing iterativo opzionale: senza ijson si usa json.load
+    ijson = None
+
+# Versione della standardizzazione: cambiarla invalida il manifest
+STANDARDIZATION_VERSION = 1
+MANIFEST_PATH = "../data/cache/asr_standardization.json"
+MODEL_FORMATS = {
+    "whisper_large": "whisper",
+    "whisperx": "whisper",
+    "parakeet": "segments",
+    "assemblyai": "assemblyai",
+}
+_BUFFER_SIZE = 1 << 20
+# Sotto questa dimensione json.load è più veloce del parsing iterativo e la memoria non è un problema
+STREAM_MIN_BYTES = 256 << 20
+
+
+def ms_to_srt_time(ms: int) -> str:
+    hours = ms // 3600000
+    minutes = (ms % 3600000) // 60000
+    seconds = (ms % 60000) // 1000
+    milliseconds = ms % 1000
+    return f"{hours:02}:{minutes:02}:{seconds:02},{milliseconds:03}"
+
+
+# --- Lettura ---
+
+def _first_char(path: str) -> str:
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(4096), b""):
+            stripped = chunk.lstrip()
+            if stripped:
+                return chr(stripped[0])
+    return ""
+
+
+def _streaming(path: str) -> bool:
+    """Vero se il file va letto in streaming con ijson (installato e file oltre `STREAM_MIN_BYTES`)."""
+    return ijson is not None and os.path.getsize(path) >= STREAM_MIN_BYTES
+
+
+def _iter_json_items(path: str, prefix: str) -> Iterator:
+    """Elementi dell'array JSON in `prefix` ("item": radice, "predictions.item": chiave predictions)."""
+    if _streaming(path):
+        with open(path, "rb") as f:
+            yield from ijson.items(f, prefix, use_float=True)
+        return
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    if prefix == "predictions.item":
+        data = data.get("predictions") if isinstance(data, dict) else None
+    yield from data if isinstance(data, list) else []
+
+
+def _iter_array(events: Iterator, prefix: str) -> Iterator:
+    """Elementi dell'array in `prefix` costruiti uno alla volta dagli eventi di `ijson.parse`."""
+    for event_prefix, event, value in events:
+        if event_prefix == prefix and event == "end_array":
+            return
+        builder = ijson.ObjectBuilder()
+        builder.event(event, value)
+        depth = event in ("start_map", "start_array")
+        while depth:
+            event_prefix, event, value = next(events)
+            builder.event(event, value)
+            if event in ("start_map", "start_array"):
+                depth += 1
+            elif event in ("end_map", "end_array"):
+                depth -= 1
+        yield builder.value
+
+
+def _iter_endpoint_predictions(path: str) -> Iterator[Tuple[int, Iterator]]:
+    """
+    Come `iter_predictions` per la risposta dell'endpoint, in streaming con ijson: i segmenti
+    di ogni predizione ("predictions.item.result.item") vengono letti uno alla volta.
+    """
+    with open(path, "rb") as f:
+        events = ijson.parse(f, use_float=True)
+        k, has_result = -1, False
+        for prefix, event, value in events:
+            if prefix == "predictions.item.result" and event == "start_array":
+                has_result = True
+                segments = _iter_array(events, prefix)
+                yield k, segments
+                for _ in segments:  # segmenti non consumati dal chiamante
+                    pass
+            elif prefix != "predictions.item" or event == "map_key":
+                continue
+            elif event == "start_map":
+                k, has_result = k + 1, False
+            elif event != "end_map" or not has_result:
+                # Predizione senza "result" (o che non è un oggetto): se è la prima il formato
+                # non è riconosciuto, altrimenti è un errore come `prediction["result"]`
+                index = k if event == "end_map" else k + 1
+                if index == 0:
+                    return
+                raise KeyError(f"'result' mancante nella predizione {index}")
+
+
+def iter_predictions(path: str) -> Iterator[Tuple[int, list]]:
+    """
+    (indice della predizione, segmenti) del formato dell'endpoint, oppure (0, segmenti) per un
+    JSON già standardizzato. In streaming i segmenti sono un iteratore letto dal file man mano.
+    """
+    if _first_char(path) == "{" and _streaming(path):
+        yield from _iter_endpoint_predictions(path)
+    elif _first_char(path) == "{":
+        for k, prediction in enumerate(_iter_json_items(path, "predictions.item")):
+            if k == 0 and not (isinstance(prediction, dict) and "result" in prediction):
+                return
+            yield k, prediction["result"]
+    else:
+        yield 0, _iter_json_items(path, "item")
+
+
+# --- Scrittura ---
+
+def _float_str(value: float) -> str:
+    if value != value:
+        return "NaN"
+    if value in (float("inf"), float("-inf")):
+        return "Infinity" if value > 0 else "-Infinity"
+    return float.__repr__(value)
+
+
+def encode_indented(value, newline: str = "\n") -> str:
+    """
+    Come `json.dumps(value, ensure_ascii=False, indent=2)` (`newline` è "\n" più l'indentazione
+    corrente). Con `indent` json usa l'encoder Python puro: qui i valori scalari passano dalle
+    funzioni C e restano solo i cicli su dizionari e liste.
+    """
+    if isinstance(value, str):
+        return encode_basestring(value)
+    if value is None:
+        return "null"
+    if value is True:
+        return "true"
+    if value is False:
+        return "false"
+    if isinstance(value, int):
+        return int.__repr__(value)
+    if isinstance(value, float):
+        return _float_str(value)
+    inner = newline + "  "
+    if isinstance(value, dict):
+        if not value:
+            return "{}"
+        if not all(isinstance(key, str) for key in value):
+            return json.dumps(value, ensure_ascii=False, indent=2).replace("\n", newline)
+        return "{" + inner + ("," + inner).join(
+            encode_basestring(key) + ": " + encode_indented(item, inner) for key, item in value.items()) + newline + "}"
+    if isinstance(value, (list, tuple)):
+        if not value:
+            return "[]"
+        return "[" + inner + ("," + inner).join(encode_indented(item, inner) for item in value) + newline + "]"
+    return json.dumps(value, ensure_ascii=False, indent=2).replace("\n", newline)
+
+
+class JsonListWriter:
+    """Scrive una lista JSON un elemento alla volta, con lo stesso output di `json.dump(..., indent=2)`."""
+
+    def __init__(self, f):
+        self.f = f
+        self.count = 0
+
+    def add(self, item):
+        self.f.write(("[\n  " if self.count == 0 else ",\n  ") + encode_indented(item, "\n  "))
+        self.count += 1
+
+    def close(self):
+        self.f.write("\n]" if self.count else "[]")
+
+
+class PredictionWriters:
+    """
+    Output di un episodio su file temporanei, sostituiti ai definitivi solo con `commit`.
+
+    Args:
+        json_path: JSON standardizzato da scrivere (None: JSON invariato).
+        text_path, srt_path: testo e SRT.
+    """
+
+    def __init__(self, json_path: Optional[str], text_path: str, srt_path: str):
+        self.paths = [path for path in (json_path, text_path, srt_path) if path]
+        for path in self.paths:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+        self._files = {path: open(path + ".tmp", "w", encoding="utf-8", buffering=_BUFFER_SIZE)
+                       for path in self.paths}
+        self.json = JsonListWriter(self._files[json_path]) if json_path else None
+        self.text = self._files[text_path]
+        self.srt = self._files[srt_path]
+        self.count = 0
+
+    def add_subtitle(self, start_ms: int, end_ms: int, text: str):
+        self.text.write(f"{text} ")
+        self.srt.write(f"{self.count}\n{ms_to_srt_time(start_ms)} --> {ms_to_srt_time(end_ms)}\n{text}\n\n")
+        self.count += 1
+
+    def commit(self):
+        if self.json is not None:
+            self.json.close()
+        for path, f in self._files.items():
+            f.close()
+            os.replace(path + ".tmp", path)
+
+    def abort(self):
+        for path, f in self._files.items():
+            f.close()
+            os.remove(path + ".tmp")
+
+
+# --- Standardizzazione di un episodio ---
+
+def _is_milliseconds(segment: dict) -> bool:
+    return isinstance(segment.get("start"), int) and not isinstance(segment.get("start"), bool)
+
+
+def _to_seconds(segment: dict) -> dict:
+    """Frase AssemblyAI con i tempi (anche delle parole) da millisecondi a secondi."""
+    segment["start"] = segment["start"] / 1000
+    segment["end"] = segment["end"] / 1000
+    for word in segment["words"]:
+        word["start"] = word["start"] / 1000
+        word["end"] = word["end"] / 1000
+    return segment
+
+
+def file_sha1(path: str) -> str:
+    sha1 = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(_BUFFER_SIZE), b""):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def standardize_file(model_format: str, json_path: str, text_path: str, srt_path: str) -> Dict:
+    """
+    Standardizza un episodio: riscrive il JSON se necessario e scrive testo e SRT.
+    Restituisce {"status": "ok" | "skip" | "error", "segments", "rewritten", "mtime_ns", "size", "sha1"}.
+    """
+    writers = None
+    try:
+        predictions = iter_predictions(json_path)
+        first = next(predictions, None)
+        if first is None:
+            return {"status": "skip", "message": "formato non riconosciuto"}
+        _, segments = first
+        segments = iter(segments)
+        head = next(segments, None)
+
+        if model_format == "whisper":
+            rewrite = _first_char(json_path) == "{"
+        elif model_format == "assemblyai":
+            rewrite = head is not None and _is_milliseconds(head)
+        else:
+            rewrite = False
+        writers = PredictionWriters(json_path if rewrite else None, text_path, srt_path)
+
+        def emit(segment, write_json):
+            if model_format == "assemblyai" and rewrite:
+                start_ms, end_ms = segment["start"], segment["end"]
+                _to_seconds(segment)
+            else:
+                start_ms, end_ms = int(segment["start"] * 1000), int(segment["end"] * 1000)
+            if write_json and writers.json is not None:
+                writers.json.add(segment)
+            writers.add_subtitle(start_ms, end_ms, segment["text"].strip())
+
+        if head is not None:
+            emit(head, True)
+        for segment in segments:
+            emit(segment, True)
+        # Predizioni successive alla prima: solo testo e SRT (il JSON tiene la prima, come nel notebook)
+        for _, more_segments in predictions:
+            for segment in more_segments:
+                emit(segment, False)
+        writers.commit()
+        stat = os.stat(json_path)
+        return {"status": "ok", "segments": writers.count, "rewritten": rewrite, "mtime_ns": stat.st_mtime_ns,
+                "size": stat.st_size, "sha1": file_sha1(json_path)}
+    except Exception as e:
+        if writers is not None:
+            writers.abort()
+        return {"status": "error", "message": f"{type(e).__name__}: {e}"}
+
+
+# --- Tutti gli episodi ---
+
+def _load_manifest(path: str) -> Dict:
+    if path and os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest.get("version") == STANDARDIZATION_VERSION:
+            return manifest
+    return {"version": STANDARDIZATION_VERSION, "files": {}}
+
+
+def _save_manifest(path: str, manifest: Dict):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+def _unchanged(entry: Optional[Dict], json_path: str, outputs: List[str]) -> bool:
+    """Vero se il JSON coincide con quello registrato (stat, poi sha1) e gli output esistono."""
+    if entry is None or not all(os.path.exists(path) for path in outputs):
+        return False
+    stat = os.stat(json_path)
+    if (stat.st_mtime_ns, stat.st_size) == (entry["mtime_ns"], entry["size"]):
+        return True
+    if stat.st_size == entry["size"] and file_sha1(json_path) == entry["sha1"]:
+        entry["mtime_ns"] = stat.st_mtime_ns  # solo toccato
+        return True
+    return False
+
+
+def standardize_all(models: List[str], files: List[str], data_dir: str = "../data", workers: Optional[int] = None,
+                    manifest_path: Optional[str] = MANIFEST_PATH, force: bool = False) -> Dict[str, Dict]:
+    """
+    Standardizza tutti gli episodi di tutti i modelli in parallelo.
+
+    Args:
+        workers: processi del pool (default: numero di CPU; 1 per elaborare nel processo corrente).
+        manifest_path: manifest degli episodi già standardizzati (None: nessuno, rielabora tutto).
+        force: ignora il manifest.
+
+    Returns:
+        risultato di ogni episodio, per chiave "modello/file".
+    """
+    manifest = _load_manifest(manifest_path) if manifest_path else {"version": STANDARDIZATION_VERSION, "files": {}}
+    tasks, results = {}, {}
+    for model in models:
+        model_format = MODEL_FORMATS.get(model, "segments")
+        for file in files:
+            key = f"{model}/{file}"
+            json_path = f"{data_dir}/{model}/json/{file}.json"
+            text_path = f"{data_dir}/{model}/text/{file}.txt"
+            srt_path = f"{data_dir}/{model}/srt/{file}.srt"
+            if not os.path.exists(json_path):
+                print(f"[SKIP] {json_path} non trovato")
+                results[key] = {"status": "skip", "message": "JSON non trovato"}
+                continue
+            if not force and _unchanged(manifest["files"].get(key), json_path, [text_path, srt_path]):
+                results[key] = {"status": "unchanged"}
+                continue
+            tasks[key] = (model_format, json_path, text_path, srt_path)
+
+    print(f"[INFO] {len(tasks)} episodi da standardizzare, "
+          f"{sum(r['status'] == 'unchanged' for r in results.values())} invariati")
+    if workers == 1:
+        done = ((key, standardize_file(*args)) for key, args in tasks.items())
+    else:
+        executor = ProcessPoolExecutor(max_workers=workers)
+        futures = {executor.submit(standardize_file, *args): key for key, args in tasks.items()}
+        done = ((futures[future], future.result()) for future in as_completed(futures))
+    try:
+        for key, result in done:
+            results[key] = result
+            if result["status"] == "ok":
+                manifest["files"][key] = {name: result[name] for name in ("mtime_ns", "size", "sha1")}
+            elif result["status"] == "error":
+                print(f"[ERRORE] Check {tasks[key][1]} because i didn't success in saving: {result['message']}")
+    finally:
+        if workers != 1:
+            executor.shutdown()
+        if manifest_path:
+            _save_manifest(manifest_path, manifest)
+    return results
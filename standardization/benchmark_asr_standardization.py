@@ -0,0 +1,243 @@
+"""
+Benchmark di `asr_standardization` rispetto alle celle di standardization_asr_predictions.ipynb
+(copiate qui sotto) su una cartella data sintetica: Whisper e WhisperX nel formato dell'endpoint,
+Parakeet come lista di segmenti, AssemblyAI con tempi in millisecondi.
+
+Verifica che JSON, testo e SRT coincidano byte per byte con quelli del notebook, che una seconda
+esecuzione salti tutti gli episodi (anche se i file vengono solo toccati) e che modificando un
+JSON venga rielaborato solo quello. Con ijson installato misura anche la lettura in streaming
+(forzata con STREAM_MIN_BYTES = 0), che di default si usa solo per i JSON molto grandi.
+
+Uso:
+    python standardization/benchmark_asr_standardization.py --files 10 --minutes 60 --workers 4
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from standardization import asr_standardization  # noqa: E402
+from utils.names import get_file_names, get_model_names  # noqa: E402
+
+WORDS = ["allora", "città", "perché", "governo", "anno", "Roma", "sì", "è", "stato", "detto", "che", "non"]
+
+
+# --- Copia di standardization_asr_predictions.ipynb ---
+
+class Subtitle():
+    def __init__(self, start, end, text):
+        self.start = start
+        self.end = end
+        self.text = text
+
+
+def save_json(predictions, json_path):
+    with open(json_path, 'w', encoding='utf-8') as f:
+        json.dump(predictions, f, ensure_ascii=False, indent=2)
+
+
+def save_text_file(transcriptions, path):
+    hp_text = ""
+    for subtitle in transcriptions:
+        hp_text += f"{subtitle.text} "
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(hp_text)
+
+
+def ms_to_srt_time(ms):
+    hours = ms // 3600000
+    minutes = (ms % 3600000) // 60000
+    seconds = (ms % 60000) // 1000
+    milliseconds = ms % 1000
+    return f"{hours:02}:{minutes:02}:{seconds:02},{milliseconds:03}"
+
+
+def save_srt_file(transcriptions, path):
+    with open(path, 'w', encoding='utf-8') as f:
+        for id, subtitle in enumerate(transcriptions):
+            f.write(f"{id}\n")
+            f.write(f"{ms_to_srt_time(subtitle.start)} --> {ms_to_srt_time(subtitle.end)}\n")
+            f.write(f"{subtitle.text}\n\n")
+
+
+def process_whisper_json(predictions):
+    transcriptions = []
+    for prediction in predictions['predictions']:
+        for segment in prediction["result"]:
+            transcriptions.append(Subtitle(text=segment["text"].strip(), start=int(segment["start"] * 1000),
+                                           end=int(segment["end"] * 1000)))
+    return transcriptions
+
+
+def process_parakeet_json(predictions):
+    return [Subtitle(text=segment["text"].strip(), start=int(segment["start"] * 1000), end=int(segment["end"] * 1000))
+            for segment in predictions]
+
+
+def legacy_run(data_dir, models, files):
+    for model in models:
+        for file in files:
+            json_path = f"{data_dir}/{model}/json/{file}.json"
+            with open(json_path, 'r', encoding='utf-8') as f:
+                predictions = json.load(f)
+            if (isinstance(predictions, dict) and "predictions" in predictions
+                    and isinstance(predictions["predictions"], list) and len(predictions["predictions"]) > 0
+                    and "result" in predictions["predictions"][0]):
+                save_json(predictions["predictions"][0]['result'], json_path)
+                predictions = process_whisper_json(predictions)
+                save_text_file(predictions, f"{data_dir}/{model}/text/{file}.txt")
+                save_srt_file(predictions, f"{data_dir}/{model}/srt/{file}.srt")
+    for file in files:
+        assemblyai_path = f"{data_dir}/assemblyai/json/{file}.json"
+        with open(assemblyai_path, 'r', encoding='utf-8') as f:
+            predictions = json.load(f)
+        # Il notebook non scrive testo e SRT di AssemblyAI: qui sono ricavati dai millisecondi originali
+        subtitles = [Subtitle(s["start"], s["end"], s["text"].strip()) for s in predictions]
+        save_text_file(subtitles, f"{data_dir}/assemblyai/text/{file}.txt")
+        save_srt_file(subtitles, f"{data_dir}/assemblyai/srt/{file}.srt")
+        for segment in predictions:
+            segment["start"] = segment["start"] / 1000
+            segment["end"] = segment["end"] / 1000
+            for word in segment["words"]:
+                word["start"] = word["start"] / 1000
+                word["end"] = word["end"] / 1000
+        with open(assemblyai_path, 'w', encoding='utf-8') as f:
+            json.dump(predictions, f, ensure_ascii=False, indent=2)
+    for file in files:
+        json_path = f"{data_dir}/parakeet/json/{file}.json"
+        with open(json_path, 'r', encoding='utf-8') as f:
+            predictions = json.load(f)
+        predictions = process_parakeet_json(predictions)
+        save_text_file(predictions, f"{data_dir}/parakeet/text/{file}.txt")
+        save_srt_file(predictions, f"{data_dir}/parakeet/srt/{file}.srt")
+
+
+# --- Dati sintetici ---
+
+def synthetic_segments(minutes, rng, milliseconds=False):
+    segments, t = [], 0.0
+    while t < minutes * 60:
+        words, start = [], t
+        for _ in range(rng.randint(1, 20)):
+            duration = rng.uniform(0.1, 0.6)
+            words.append({"word": rng.choice(WORDS), "start": round(t, 3), "end": round(t + duration, 3),
+                          "score": round(rng.random(), 3)})
+            t += duration + rng.uniform(0.0, 0.2)
+        text = " " + " ".join(w["word"] for w in words) + rng.choice(["", ".", "?"])
+        segment = {"start": round(start, 3), "end": round(t, 3), "text": text, "words": words}
+        if milliseconds:
+            segment = {"text": text.strip(), "start": int(start * 1000), "end": int(t * 1000),
+                       "confidence": round(rng.random(), 4),
+                       "words": [{"text": w["word"], "start": int(w["start"] * 1000), "end": int(w["end"] * 1000),
+                                  "confidence": w["score"], "speaker": None} for w in words]}
+        segments.append(segment)
+        t += rng.uniform(0.0, 1.5)
+    return segments
+
+
+def build_data_dir(data_dir, models, files, minutes):
+    for m, model in enumerate(models):
+        for kind in ("json", "text", "srt"):
+            os.makedirs(f"{data_dir}/{model}/{kind}", exist_ok=True)
+        for f, file in enumerate(files):
+            rng = random.Random(m * 1000 + f)
+            if model == "parakeet":
+                data = synthetic_segments(minutes, rng)
+            elif model == "assemblyai":
+                data = synthetic_segments(minutes, rng, milliseconds=True)
+            else:
+                data = {"predictions": [{"result": synthetic_segments(minutes, rng)}]}
+            with open(f"{data_dir}/{model}/json/{file}.json", "w", encoding="utf-8") as out:
+                json.dump(data, out, ensure_ascii=False)
+
+
+def compare_dirs(a, b, models, files):
+    for model in models:
+        for file in files:
+            for kind, ext in (("json", "json"), ("text", "txt"), ("srt", "srt")):
+                with open(f"{a}/{model}/{kind}/{file}.{ext}", "rb") as fa, open(f"{b}/{model}/{kind}/{file}.{ext}", "rb") as fb:
+                    assert fa.read() == fb.read(), f"{model}/{kind}/{file}.{ext}: output diverso dal notebook"
+
+
+def run(n_files, minutes, workers):
+    models, files = get_model_names(), get_file_names()[:n_files]
+    print(f"[INFO] parser JSON: json.load sotto {asr_standardization.STREAM_MIN_BYTES >> 20} MB, oltre "
+          f"{'ijson' if asr_standardization.ijson is not None else 'json.load (ijson non installato)'}")
+    with tempfile.TemporaryDirectory() as tmp:
+        source, legacy, new = f"{tmp}/source", f"{tmp}/legacy", f"{tmp}/new"
+        build_data_dir(source, models, files, minutes)
+        shutil.copytree(source, legacy)
+        shutil.copytree(source, new)
+        size = sum(os.path.getsize(f"{source}/{m}/json/{f}.json") for m in models for f in files) / 1e6
+
+        t0 = time.perf_counter()
+        legacy_run(legacy, models, files)
+        t_legacy = time.perf_counter() - t0
+
+        manifest = f"{tmp}/manifest.json"
+        t0 = time.perf_counter()
+        results = asr_standardization.standardize_all(models, files, new, workers=1, manifest_path=manifest)
+        t_single = time.perf_counter() - t0
+        assert all(r["status"] == "ok" for r in results.values()), results
+        compare_dirs(legacy, new, models, files)
+
+        t_stream = None
+        if asr_standardization.ijson is not None:
+            shutil.rmtree(new)
+            shutil.copytree(source, new)
+            default_min_bytes = asr_standardization.STREAM_MIN_BYTES
+            asr_standardization.STREAM_MIN_BYTES = 0
+            try:
+                t0 = time.perf_counter()
+                asr_standardization.standardize_all(models, files, new, workers=1, manifest_path=None)
+                t_stream = time.perf_counter() - t0
+            finally:
+                asr_standardization.STREAM_MIN_BYTES = default_min_bytes
+            compare_dirs(legacy, new, models, files)
+
+        shutil.rmtree(new)
+        shutil.copytree(source, new)
+        t0 = time.perf_counter()
+        asr_standardization.standardize_all(models, files, new, workers=workers, manifest_path=None)
+        t_pool = time.perf_counter() - t0
+        compare_dirs(legacy, new, models, files)
+
+        # Seconda esecuzione con il manifest della prima (stessa cartella ricreata con gli stessi output)
+        shutil.rmtree(new)
+        shutil.copytree(legacy, new)
+        t0 = time.perf_counter()
+        results = asr_standardization.standardize_all(models, files, new, workers=workers, manifest_path=manifest)
+        t_rerun = time.perf_counter() - t0
+        assert all(r["status"] == "unchanged" for r in results.values())
+
+        changed = f"{new}/parakeet/json/{files[0]}.json"
+        with open(changed, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        data[0]["text"] = " testo modificato"
+        with open(changed, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        results = asr_standardization.standardize_all(models, files, new, workers=workers, manifest_path=manifest)
+        assert [k for k, r in results.items() if r["status"] == "ok"] == [f"parakeet/{files[0]}"]
+
+    n = len(models) * len(files)
+    print(f"[INFO] {n} episodi ({size:.0f} MB di JSON): output identico al notebook")
+    print(f"  notebook {t_legacy:.2f} s   modulo (1 processo) {t_single:.2f} s (x{t_legacy / t_single:.1f})   "
+          f"modulo ({workers} processi) {t_pool:.2f} s (x{t_legacy / t_pool:.1f})")
+    if t_stream is not None:
+        print(f"  modulo in streaming con ijson (1 processo) {t_stream:.2f} s (x{t_legacy / t_stream:.1f})")
+    print(f"  seconda esecuzione (tutti invariati) {t_rerun:.2f} s; dopo la modifica di un JSON rielaborato solo quello")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, default=10)
+    parser.add_argument("--minutes", type=float, default=60)
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+    run(args.files, args.minutes, args.workers)
@@ -0,0 +1,96 @@
+"""
+Benchmark del parser SRT incrementale (`srt_parser` + `read_track`) rispetto al parsing con
+regex sull'intero file usato in origine da `preprocess`.
+
+Ogni misura gira in un sottoprocesso separato, così il picco di RSS (ru_maxrss) non è
+influenzato dalle misure precedenti.
+
+Uso:
+    python standardization/benchmark_srt_parser.py --hours 2 10 50
+"""
+import argparse
+import json
+import os
+import random
+import re
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from standardization import standardization_utils  # noqa: E402
+from standardization.srt_parser import ms_to_srt_time  # noqa: E402
+
+WORDS = ["allora", "città", "perché", "governo", "l'anno", "Roma,", "sì?", "è", "stato", "detto", "che", "non"]
+
+
+def legacy_preprocess(srt_text):
+    """Copia del `preprocess` originale: regex sull'intero testo + split delle stringhe dei tempi."""
+    pattern = re.compile(r'(\d+)\s+([\d:,]+) --> ([\d:,]+)\s+([\s\S]*?)(?=\n\d+\n|\Z)', re.MULTILINE)
+    subtitles = []
+    for match in pattern.finditer(srt_text):
+        start_time = standardization_utils.convert_str_to_ms(match.group(2).strip())
+        end_time = standardization_utils.convert_str_to_ms(match.group(3).strip())
+        text = match.group(4).strip()
+        if text:
+            subtitles.append(standardization_utils.Subtitle(start_time, end_time, text))
+    return subtitles
+
+
+def write_synthetic_srt(path, hours, seed=0):
+    """Scrive un SRT sintetico di `hours` ore con blocchi di 1-6 secondi su una o due righe."""
+    rng = random.Random(seed)
+    total_ms = int(hours * 3600 * 1000)
+    t = 0
+    idx = 1
+    with open(path, "w", encoding="utf-8") as f:
+        while t < total_ms:
+            start = t + rng.randint(40, 400)
+            end = start + rng.randint(1000, 6000)
+            lines = [" ".join(rng.choice(WORDS) for _ in range(rng.randint(2, 6))) for _ in range(rng.randint(1, 2))]
+            f.write(f"{idx}\n{ms_to_srt_time(start)} --> {ms_to_srt_time(end)}\n" + "\n".join(lines) + "\n\n")
+            t = end
+            idx += 1
+    return idx - 1
+
+
+def _worker(mode, path):
+    base_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    t0 = time.perf_counter()
+    if mode == "legacy":
+        with open(path, "r", encoding="utf-8") as f:
+            subtitles = legacy_preprocess(f.read())
+    else:
+        subtitles = standardization_utils.read_track(path)
+    elapsed = time.perf_counter() - t0
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps({"segments": len(subtitles), "seconds": elapsed, "peak_rss_kb": peak_rss - base_rss}))
+
+
+def run(hours_list):
+    with tempfile.TemporaryDirectory() as tmp:
+        for hours in hours_list:
+            path = os.path.join(tmp, f"synthetic_{hours}h.srt")
+            n_blocks = write_synthetic_srt(path, hours)
+            size_mb = os.path.getsize(path) / 1e6
+            print(f"[INFO] {hours} ore: {n_blocks} blocchi, {size_mb:.1f} MB")
+            for mode in ("legacy", "streaming"):
+                out = subprocess.run([sys.executable, __file__, "--worker", mode, path],
+                                     capture_output=True, text=True, check=True)
+                result = json.loads(out.stdout)
+                print(f"  {mode:<10} {result['seconds']:.3f} s   picco RSS +{result['peak_rss_kb'] / 1024:.1f} MB"
+                      f"   ({result['segments']} segmenti)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--hours", type=float, nargs="+", default=[2, 10, 50])
+    parser.add_argument("--worker", nargs=2, metavar=("MODE", "PATH"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.worker:
+        _worker(*args.worker)
+    else:
+        run(args.hours)
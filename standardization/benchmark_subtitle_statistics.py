@@ -0,0 +1,172 @@
+"""
+Benchmark di `subtitle_statistics` rispetto a `build_statistics_dataset` originale (copiato qui
+sotto: ciclo Python per traccia e dizionario di dizionari) da 30 a 3000 episodi sintetici.
+
+Per ogni dimensione verifica che la tabella coincida con quella originale e riporta i tempi di
+costruzione del frame lungo, della tabella e dell'aggregazione con le violazioni RAI (che
+l'originale non calcola); le violazioni sono ricontrollate con un ciclo per sottotitolo.
+Verifica inoltre che un episodio senza sottotitoli abbia metriche a 0 (l'originale usava
+`num_chars` non definito) e confronta la lettura degli SRT da disco, sequenziale e in parallelo.
+
+Uso:
+    python standardization/benchmark_subtitle_statistics.py --episodes 30 300 3000 --workers 4
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from standardization import standardization_utils, subtitle_statistics  # noqa: E402
+from standardization.srt_parser import ms_to_srt_time  # noqa: E402
+from standardization.standardization_utils import SubtitleTrack  # noqa: E402
+
+MODELS = ["srt", "parakeet", "whisper_large", "whisperx", "assemblyai"]
+
+
+# --- Copia di standardization_utils.build_statistics_dataset ---
+
+def legacy_build_statistics_dataset(all_subtitles, duration_path):
+    program_names = sorted(set(fn.replace(".srt", "") for _, fn, _ in all_subtitles))
+    model_names = sorted(set(model for model, _, _ in all_subtitles))
+    stats = {prog: {} for prog in program_names}
+    with open(duration_path, "r", encoding="utf-8") as f:
+        duration_data = json.load(f)
+    for model_name, filename, subtitles in all_subtitles:
+        prog = filename.replace(".srt", "")
+        durata_min = duration_data[prog] / 60
+        num_segments = len(subtitles)
+        if num_segments == 0:
+            cps = 0
+            mean_segment_duration = 0
+        else:
+            total_duration_ms = int(subtitles.end_times[-1] - subtitles.start_times[0])
+            total_duration_sec = total_duration_ms / 1000 if total_duration_ms > 0 else 1
+            num_chars = int(subtitles.char_counts().sum())
+            cps = num_chars / total_duration_sec if total_duration_sec > 0 else 0
+            mean_segment_duration = int(subtitles.durations().sum()) / num_segments / 1000
+        stats[prog]["DURATION"] = round(durata_min, 2)
+        stats[prog][f"{model_name}_NUM_SEGMENTS"] = round(num_segments, 2)
+        stats[prog][f"{model_name}_NUM_CHARS_SEGMENTS"] = round(num_chars/num_segments, 2)
+        stats[prog][f"{model_name}_CPS"] = round(cps, 2)
+        stats[prog][f"{model_name}_MEAN_SEGMENT_DURATION"] = round(mean_segment_duration, 2)
+    ordered_columns = ["DURATION"] + [f"{model}_NUM_SEGMENTS" for model in model_names] + [f"{model}_CPS" for model in model_names] + [f"{model}_MEAN_SEGMENT_DURATION" for model in model_names] + [f"{model}_NUM_CHARS_SEGMENTS" for model in model_names]
+    df = pd.DataFrame.from_dict(stats, orient="index")
+    df = df.reindex(columns=ordered_columns)
+    return df
+
+
+# --- Episodi sintetici ---
+
+def synthetic_track(rng, minutes):
+    """Sottotitoli di 0.3-7 s con 5-90 caratteri e pause brevi: una parte esce dai limiti RAI."""
+    n = int(minutes * 60 / 3.5)
+    durations = rng.integers(300, 7000, n)
+    gaps = rng.integers(0, 800, n)
+    starts = np.cumsum(gaps + np.concatenate(([0], durations[:-1])))
+    lengths = rng.integers(5, 90, n)
+    offsets = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    return SubtitleTrack(starts, starts + durations, "x" * int(offsets[-1]), offsets)
+
+
+def synthetic_subtitles(n_episodes, minutes, seed=0):
+    rng = np.random.default_rng(seed)
+    n_programs = max(1, n_episodes // len(MODELS))
+    programs = [f"PROGRAMMA_{p:05d}" for p in range(n_programs)]
+    all_subtitles = [(model, f"{program}.srt", synthetic_track(rng, minutes)) for program in programs
+                     for model in MODELS]
+    durations = {program: minutes * 60 + float(rng.uniform(0, 120)) for program in programs}
+    return all_subtitles, durations
+
+
+def best_of(fn, repeat=3):
+    """Tempo minimo su `repeat` esecuzioni (la prima paga l'allocazione della memoria) e risultato."""
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def check_violations(all_subtitles, stats):
+    for model, filename, track in all_subtitles[:20]:
+        row = stats.loc[(model, filename.replace(".srt", ""))]
+        counts = {"CPS": 0, "NCS": 0, "MSD": 0}
+        for sub in track:
+            seconds = (sub.end_time - sub.start_time) / 1000
+            values = {"CPS": len(sub.text) / seconds if seconds > 0 else 0, "NCS": len(sub.text), "MSD": seconds}
+            for name, (low, high) in subtitle_statistics.RAI_BOUNDS.items():
+                counts[name] += not (low <= values[name] <= high)
+        assert all(row[f"{name}_VIOLATIONS"] == count for name, count in counts.items()), (model, filename)
+
+
+def check_empty_track(duration_path, durations):
+    program = next(iter(durations))
+    all_subtitles = [("srt", f"{program}.srt", SubtitleTrack.from_records([])),
+                     ("parakeet", f"{program}.srt", SubtitleTrack.from_records([(0, 2000, "ciao a tutti")]))]
+    table = standardization_utils.build_statistics_dataset(all_subtitles, duration_path)
+    assert table.loc[program, "srt_NUM_SEGMENTS"] == 0 and table.loc[program, "srt_NUM_CHARS_SEGMENTS"] == 0
+    assert table.loc[program, "parakeet_NUM_CHARS_SEGMENTS"] == 12
+
+
+def write_srt(path, track):
+    with open(path, "w", encoding="utf-8") as f:
+        for i, sub in enumerate(track, start=1):
+            f.write(f"{i}\n{ms_to_srt_time(sub.start_time)} --> {ms_to_srt_time(sub.end_time)}\n{sub.text}\n\n")
+
+
+def run(episode_counts, minutes, workers, disk_episodes):
+    with tempfile.TemporaryDirectory() as tmp:
+        duration_path = os.path.join(tmp, "program_duration.json")
+        print(f"[INFO] Episodi da {minutes:.0f} minuti, {len(MODELS)} modelli")
+        for n_episodes in episode_counts:
+            all_subtitles, durations = synthetic_subtitles(n_episodes, minutes)
+            with open(duration_path, "w", encoding="utf-8") as f:
+                json.dump(durations, f)
+            n_rows = sum(len(track) for _, _, track in all_subtitles)
+
+            t_legacy, legacy = best_of(lambda: legacy_build_statistics_dataset(all_subtitles, duration_path))
+            t_frame, frame = best_of(lambda: subtitle_statistics.frame_from_tracks(
+                (model, filename.replace(".srt", ""), track) for model, filename, track in all_subtitles))
+            t_table, table = best_of(lambda: subtitle_statistics.statistics_table(
+                frame, duration_path, metrics=subtitle_statistics.METRICS))
+            pd.testing.assert_frame_equal(table, legacy, check_dtype=False)
+            t_full, stats = best_of(lambda: subtitle_statistics.aggregate_statistics(frame))
+            check_violations(all_subtitles, stats)
+            print(f"  {len(all_subtitles):5d} episodi ({n_rows:8d} sottotitoli): originale {t_legacy:6.3f} s   "
+                  f"frame {t_frame:6.3f} s   tabella {t_table:6.3f} s   metriche + violazioni {t_full:6.3f} s")
+        print("[INFO] Tabelle identiche all'originale, violazioni RAI verificate sottotitolo per sottotitolo")
+
+        check_empty_track(duration_path, durations)
+        print("[INFO] Episodio senza sottotitoli: metriche a 0")
+
+        all_subtitles, _ = synthetic_subtitles(disk_episodes, minutes, seed=1)
+        folders = {}
+        for model, filename, track in all_subtitles:
+            folder = folders.setdefault(model, os.path.join(tmp, "data", model, "srt"))
+            os.makedirs(folder, exist_ok=True)
+            write_srt(os.path.join(folder, filename), track)
+        t_serial, serial = best_of(lambda: subtitle_statistics.load_subtitle_frame(folders, workers=1), 1)
+        t_parallel, parallel = best_of(lambda: subtitle_statistics.load_subtitle_frame(folders, workers=workers), 1)
+        pd.testing.assert_frame_equal(serial, parallel)
+        print(f"[INFO] Lettura di {len(all_subtitles)} SRT: sequenziale {t_serial:.2f} s   "
+              f"{workers} processi {t_parallel:.2f} s (x{t_serial / t_parallel:.1f}, {os.cpu_count()} CPU disponibili)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--episodes", type=int, nargs="+", default=[30, 300, 3000])
+    parser.add_argument("--minutes", type=float, default=60)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--disk-episodes", type=int, default=100)
+    args = parser.parse_args()
+    run(args.episodes, args.minutes, args.workers, args.disk_episodes)
@@ -0,0 +1,210 @@
+"""
+Parser SRT incrementale condiviso.
+
+Legge un file SRT riga per riga (da path, file binario, mmap o bytes) e restituisce i blocchi
+uno alla volta, senza caricare il file in memoria né usare regex con backtracking sull'intero
+testo. I timestamp ben formati (HH:MM:SS,mmm --> HH:MM:SS,mmm) vengono decodificati leggendo
+i byte a offset fissi; gli altri passano da una regex più permissiva.
+"""
+import io
+import mmap
+import os
+import re
+from typing import Iterator, NamedTuple, Optional, Tuple
+
+
+class SrtBlock(NamedTuple):
+    index: int
+    start_time: int  # ms
+    end_time: int    # ms
+    text: str
+
+
+class SrtFormatError(ValueError):
+    """Blocco SRT malformato. Il messaggio è lo stesso stampato da `check_srt_correctness`."""
+
+    def __init__(self, message: str, block_number: int):
+        super().__init__(message)
+        self.block_number = block_number
+
+
+# "HH:MM:SS,mmm --> HH:MM:SS,mmm" senza le cifre
+_FAST_TIME_SKELETON = b"::, --> ::,"
+_FAST_TIME_LEN = 29
+_DIGITS = b"0123456789"
+
+# Formato accettato da check_srt_correctness (modalità strict)
+_STRICT_TIME_LINE = re.compile(rb'(\d{2}):(\d{2}):(\d{2}),(\d{3})\s+-->\s+(\d{2}):(\d{2}):(\d{2}),(\d{3})')
+# Formato accettato da preprocess (modalità permissiva)
+_LENIENT_TIME_LINE = re.compile(rb'\s*(\d+):(\d+):(\d+),(\d+)\s*-->\s*(\d+):(\d+):(\d+),(\d+)')
+
+
+def _fast_timestamps(line: bytes) -> Optional[Tuple[int, int]]:
+    """Decodifica una riga di tempi ben formata leggendo le cifre a offset fissi."""
+    if (len(line) < _FAST_TIME_LEN
+            or line[:_FAST_TIME_LEN].translate(None, _DIGITS) != _FAST_TIME_SKELETON
+            or line[2] != 58 or line[5] != 58 or line[8] != 44 or line[12:17] != b" --> "
+            or line[19] != 58 or line[22] != 58 or line[25] != 44):
+        return None
+    # Le cifre ASCII valgono 48 + cifra: 528 = 48*11, 5328 = 48*111
+    start = (((line[0] * 10 + line[1] - 528) * 60 + line[3] * 10 + line[4] - 528) * 60
+             + line[6] * 10 + line[7] - 528) * 1000 + line[9] * 100 + line[10] * 10 + line[11] - 5328
+    end = (((line[17] * 10 + line[18] - 528) * 60 + line[20] * 10 + line[21] - 528) * 60
+           + line[23] * 10 + line[24] - 528) * 1000 + line[26] * 100 + line[27] * 10 + line[28] - 5328
+    return start, end
+
+
+def _regex_timestamps(line: bytes, pattern) -> Optional[Tuple[int, int]]:
+    match = pattern.match(line)
+    if not match:
+        return None
+    h1, m1, s1, ms1, h2, m2, s2, ms2 = (int(g) for g in match.groups())
+    return ((h1 * 3600 + m1 * 60 + s1) * 1000 + ms1,
+            (h2 * 3600 + m2 * 60 + s2) * 1000 + ms2)
+
+
+def parse_time_line(line: bytes, strict: bool = False) -> Optional[Tuple[int, int]]:
+    """Restituisce (start_ms, end_ms) per una riga di tempi, None se non è valida."""
+    times = _fast_timestamps(line)
+    if times is None:
+        times = _regex_timestamps(line, _STRICT_TIME_LINE if strict else _LENIENT_TIME_LINE)
+    return times
+
+
+def _iter_lines(source) -> Iterator[bytes]:
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as f:
+            yield from f
+    elif isinstance(source, (bytes, bytearray, memoryview)):
+        yield from io.BytesIO(source)
+    elif isinstance(source, mmap.mmap):
+        yield from iter(source.readline, b"")
+    else:
+        # file object, binario o testuale
+        for line in source:
+            yield line.encode("utf-8") if isinstance(line, str) else line
+
+
+def iter_srt_blocks(source, strict: bool = False, encoding: str = "utf-8", errors: str = "strict") -> Iterator[SrtBlock]:
+    """
+    Restituisce i blocchi di un file SRT uno alla volta.
+
+    Args:
+        source: path, file object (binario o testuale), mmap o bytes.
+        strict: se True solleva `SrtFormatError` al primo blocco malformato, con gli stessi
+            controlli di `check_srt_correctness`; altrimenti i blocchi malformati vengono saltati.
+        encoding, errors: decodifica del testo dei sottotitoli.
+
+    Il testo di ogni blocco mantiene gli a capo interni ed è ripulito dagli spazi iniziali e
+    finali. Un blocco termina alla prima riga vuota oppure, se manca la riga vuota, quando una
+    riga numerica è seguita da una riga di tempi.
+    """
+    lines = _iter_lines(source)
+    pushback = []
+
+    def next_line():
+        if pushback:
+            return pushback.pop()
+        return next(lines, None)
+
+    block_number = 0
+    prev_end = None
+    while True:
+        line = next_line()
+        while line is not None and not line.strip():
+            line = next_line()
+        if line is None:
+            return
+        block_number += 1
+
+        id_line = line.strip()
+        time_line = next_line()
+        if time_line is None or not time_line.strip():
+            if strict:
+                raise SrtFormatError(f"Errore: blocco {block_number} incompleto.", block_number)
+            continue
+
+        try:
+            block_id = int(id_line)
+        except ValueError:
+            if strict:
+                raise SrtFormatError(f"Errore: identificatore non numerico nel blocco {block_number}.", block_number)
+            block_id = None
+        if strict and block_id != block_number:
+            raise SrtFormatError(
+                f"Errore: identificatore non consecutivo nel blocco {block_number} "
+                f"(trovato {block_id}, atteso {block_number}).", block_number)
+
+        times = parse_time_line(time_line.strip(), strict=strict)
+        if times is None:
+            if strict:
+                raise SrtFormatError(f"Errore: formato tempo non valido nel blocco {block_number}.", block_number)
+            # Riga spuria: si riparte dalla riga successiva per riallinearsi ai blocchi
+            pushback.append(time_line)
+            continue
+
+        text_lines = []
+        line = next_line()
+        while line is not None and line.strip():
+            if line.strip().isdigit():
+                following = next_line()
+                if following is not None and parse_time_line(following.strip(), strict=strict) is not None:
+                    # Nuovo blocco senza riga vuota di separazione
+                    pushback.append(following)
+                    pushback.append(line)
+                    break
+                if following is not None:
+                    pushback.append(following)
+            text_lines.append(line.rstrip(b"\r\n"))
+            line = next_line()
+
+        if block_id is None:
+            continue
+
+        start_ms, end_ms = times
+        if strict:
+            if end_ms <= start_ms:
+                raise SrtFormatError(
+                    f"Errore: tempo di fine non successivo a quello di inizio nel blocco {block_number}.", block_number)
+            if prev_end is not None and start_ms <= prev_end:
+                raise SrtFormatError(
+                    f"Errore: inizio del blocco {block_number} non successivo alla fine del blocco precedente.",
+                    block_number)
+        prev_end = end_ms
+
+        text = b"\n".join(text_lines).decode(encoding, errors).strip()
+        yield SrtBlock(block_id, start_ms, end_ms, text)
+
+
+def iter_srt_text(srt_text: str, strict: bool = False) -> Iterator[SrtBlock]:
+    """Come `iter_srt_blocks`, per un contenuto SRT già letto come stringa."""
+    return iter_srt_blocks(srt_text.encode("utf-8", "surrogatepass"), strict=strict, errors="surrogatepass")
+
+
+def check_srt_correctness(source) -> bool:
+    """
+    Controlla la correttezza di un file .srt. Stampa messaggi di errore per gli errori segnalati.
+
+    Args:
+        source: il testo del file .srt, oppure file object/mmap/bytes
+
+    Returns:
+        bool: True se il file .srt è corretto, False altrimenti.
+    """
+    blocks = iter_srt_text(source, strict=True) if isinstance(source, str) else iter_srt_blocks(source, strict=True)
+    try:
+        for _ in blocks:
+            pass
+    except SrtFormatError as e:
+        print(e)
+        return False
+    return True
+
+
+def ms_to_srt_time(ms: int) -> str:
+    """Converte millisecondi nel formato SRT HH:MM:SS,mmm."""
+    hours = ms // 3600000
+    minutes = (ms % 3600000) // 60000
+    seconds = (ms % 60000) // 1000
+    milliseconds = ms % 1000
+    return f"{hours:02}:{minutes:02}:{seconds:02},{milliseconds:03}"
@@ -1,7 +1,10 @@
-import json
+import hashlib
+import mmap
 import os
-import re
-import pandas as pd
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from standardization import srt_parser
 
 class Subtitle:
     def __init__(self, start_time: str, end_time: str, text: str):        
@@ -9,70 +12,187 @@ class Subtitle:
         self.end_time = end_time
         self.text = text
 
+class SubtitleTrack:
+    """
+    Traccia di sottotitoli in formato colonnare.
+
+    I tempi di inizio/fine (ms) sono array int64, i testi sono concatenati in un unico
+    buffer e `offsets` (lunghezza n+1) indica dove inizia e finisce ciascun testo.
+    L'accesso per indice restituisce un `Subtitle` costruito al momento, quindi la traccia
+    può sostituire le liste di `Subtitle` nel codice che le scorre elemento per elemento.
+    """
+    __slots__ = ("start_times", "end_times", "offsets", "buffer")
+
+    def __init__(self, start_times, end_times, buffer: str, offsets):
+        self.start_times = np.asarray(start_times, dtype=np.int64)
+        self.end_times = np.asarray(end_times, dtype=np.int64)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.buffer = buffer
+        if not (len(self.start_times) == len(self.end_times) == len(self.offsets) - 1):
+            raise ValueError("start_times, end_times e offsets hanno lunghezze incompatibili")
+
+    @classmethod
+    def from_records(cls, records):
+        """Costruisce la traccia da un iterabile di tuple (start_ms, end_ms, text)."""
+        starts, ends, texts = [], [], []
+        for start_time, end_time, text in records:
+            starts.append(start_time)
+            ends.append(end_time)
+            texts.append(text)
+        offsets = np.zeros(len(texts) + 1, dtype=np.int64)
+        np.cumsum([len(t) for t in texts], out=offsets[1:])
+        return cls(starts, ends, "".join(texts), offsets)
+
+    @classmethod
+    def from_subtitles(cls, subtitles):
+        """Converte una lista di `Subtitle` in una traccia colonnare."""
+        return cls.from_records((sub.start_time, sub.end_time, sub.text) for sub in subtitles)
+
+    def __len__(self):
+        return len(self.start_times)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self._item(i)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                return SubtitleTrack.from_records(
+                    (int(self.start_times[i]), int(self.end_times[i]), self.text(i)) for i in range(start, stop, step)
+                )
+            stop = max(start, stop)
+            lo, hi = int(self.offsets[start]), int(self.offsets[stop])
+            return SubtitleTrack(
+                self.start_times[start:stop], self.end_times[start:stop],
+                self.buffer[lo:hi], self.offsets[start:stop + 1] - lo
+            )
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("indice del sottotitolo fuori dalla traccia")
+        return self._item(index)
+
+    def _item(self, i):
+        return Subtitle(int(self.start_times[i]), int(self.end_times[i]), self.text(i))
+
+    def text(self, i):
+        """Testo dell'i-esimo sottotitolo, letto dal buffer condiviso."""
+        return self.buffer[self.offsets[i]:self.offsets[i + 1]]
+
+    @property
+    def texts(self):
+        return [self.text(i) for i in range(len(self))]
+
+    def durations(self):
+        """Durata di ogni sottotitolo in ms."""
+        return self.end_times - self.start_times
+
+    def char_counts(self):
+        """Numero di caratteri di ogni sottotitolo."""
+        return np.diff(self.offsets)
+
+    def cps(self):
+        """Caratteri al secondo di ogni sottotitolo (0 per durate nulle o negative)."""
+        durations_sec = self.durations() / 1000
+        chars = self.char_counts()
+        out = np.zeros(len(self), dtype=np.float64)
+        np.divide(chars, durations_sec, out=out, where=durations_sec > 0)
+        return out
+
+    def save(self, path):
+        """Salva la traccia in un file .npz (testo in UTF-8, offset in caratteri)."""
+        np.savez(path, start_times=self.start_times, end_times=self.end_times, offsets=self.offsets,
+                 buffer=np.frombuffer(self.buffer.encode("utf-8", "surrogatepass"), dtype=np.uint8))
+
+    @classmethod
+    def load(cls, path):
+        """Carica una traccia salvata con `save`."""
+        with np.load(path) as data:
+            return cls(data["start_times"], data["end_times"],
+                       data["buffer"].tobytes().decode("utf-8", "surrogatepass"), data["offsets"])
+
 def convert_str_to_ms(time: str):
     # time format: HH:MM:SS,mmm
     h, m, s_ms = time.split(':')
     s, ms = s_ms.split(',')
     return (int(h)*3600 + int(m)*60 + int(s))*1000 + int(ms)
 
+def _iter_srt_records(blocks):
+    for block in blocks:
+        if block.text:
+            yield block.start_time, block.end_time, block.text
+
 def preprocess(srt_text):    
-    pattern = re.compile(r'(\d+)\s+([\d:,]+) --> ([\d:,]+)\s+([\s\S]*?)(?=\n\d+\n|\Z)', re.MULTILINE)
     subtitles = []    
-    for match in pattern.finditer(srt_text):
-        start_time = convert_str_to_ms(match.group(2).strip())
-        end_time = convert_str_to_ms(match.group(3).strip())
-        text = match.group(4).strip()
-        if text:               
-            subtitles.append(Subtitle(start_time, end_time, text))            
+    for start_time, end_time, text in _iter_srt_records(srt_parser.iter_srt_text(srt_text)):
+        subtitles.append(Subtitle(start_time, end_time, text))            
     return subtitles
 
-def load_all_subtitles(folders: list):
-    all_subtitles = []
-    for folder in folders:        
-        for filename in os.listdir(folder):            
-            with open(f"{folder}/{filename}", 'r', encoding='utf-8') as f:
-                srt_content = f.read()
-                subtitles = preprocess(srt_content)
-                all_subtitles.append((folder.split('/')[2], filename, subtitles))
-    
-    return all_subtitles
-
-def build_statistics_dataset(all_subtitles):    
-    # Ricava tutti i nomi dei programmi e dei modelli
-    program_names = sorted(set(fn.replace(".srt", "") for _, fn, _ in all_subtitles))
-    model_names = sorted(set(model for model, _, _ in all_subtitles))
-
-    # Crea dizionario per raccogliere i dati
-    stats = {prog: {} for prog in program_names}
-
-    with open("program_duration.json", "r", encoding="utf-8") as f:
-        duration_data = json.load(f)
-
-    for model_name, filename, subtitles in all_subtitles:
-        prog = filename.replace(".srt", "")       
-        
-        durata_min = duration_data[prog] / 60           
-
-        num_segments = len(subtitles)
-        if num_segments == 0:
-            cps = 0
-            mean_segment_duration = 0
-        else:
-            total_duration_ms = subtitles[-1].end_time - subtitles[0].start_time
-            total_duration_sec = total_duration_ms / 1000 if total_duration_ms > 0 else 1
-            num_chars = sum(len(sub.text) for sub in subtitles)
-            cps = num_chars / total_duration_sec if total_duration_sec > 0 else 0
-            mean_segment_duration = (
-                sum((sub.end_time - sub.start_time) for sub in subtitles) / num_segments / 1000
-            )
-        stats[prog]["DURATION"] = round(durata_min, 2)
-        stats[prog][f"{model_name}_NUM_SEGMENTS"] = round(num_segments, 2)
-        stats[prog][f"{model_name}_NUM_CHARS_SEGMENTS"] = round(num_chars/num_segments, 2)
-        stats[prog][f"{model_name}_CPS"] = round(cps, 2)
-        stats[prog][f"{model_name}_MEAN_SEGMENT_DURATION"] = round(mean_segment_duration, 2)
-
-    # Ordina le colonne: prima tutti i CPS, poi tutte le MEAN SEGMENT DURATION
-    ordered_columns = ["DURATION"] + [f"{model}_NUM_SEGMENTS" for model in model_names] + [f"{model}_CPS" for model in model_names] + [f"{model}_MEAN_SEGMENT_DURATION" for model in model_names] + [f"{model}_NUM_CHARS_SEGMENTS" for model in model_names]
-    df = pd.DataFrame.from_dict(stats, orient="index")
-    df = df.reindex(columns=ordered_columns)
-    return df
+def preprocess_track(srt_text):
+    """Come `preprocess`, ma restituisce una `SubtitleTrack` invece di una lista di `Subtitle`."""
+    return SubtitleTrack.from_records(_iter_srt_records(srt_parser.iter_srt_text(srt_text)))
+
+def read_track(path, errors="strict"):
+    """Legge un file SRT in streaming (mmap) e restituisce una `SubtitleTrack`."""
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return SubtitleTrack.from_records([])
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return SubtitleTrack.from_records(_iter_srt_records(srt_parser.iter_srt_blocks(mm, errors=errors)))
+
+def read_track_cached(path, cache_dir, errors="replace"):
+    """
+    Come `read_track`, con una cache su disco delle tracce già analizzate.
+    La chiave è l'hash del contenuto del file, quindi una traccia modificata viene rianalizzata
+    e file identici con nomi diversi condividono la stessa voce.
+    """
+    with open(path, "rb") as f:
+        content = f.read()
+    key = hashlib.sha1(content).hexdigest()
+    cache_path = os.path.join(cache_dir, f"{key}.npz")
+    if os.path.exists(cache_path):
+        return SubtitleTrack.load(cache_path)
+
+    track = preprocess_track(content.decode("utf-8", errors))
+    os.makedirs(cache_dir, exist_ok=True)
+    # Scrittura atomica: più worker possono analizzare lo stesso file contemporaneamente
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix=".npz.tmp")
+    with os.fdopen(fd, "wb") as f:
+        track.save(f)
+    os.replace(tmp_path, cache_path)
+    return track
+
+def _read_track_job(path):
+    return read_track(path)
+
+def load_all_subtitles(folders: list, workers=None):
+    """
+    Legge tutti gli SRT delle cartelle come tuple (modello, nome file, traccia).
+    I file sono letti su un pool di processi (`workers`, default: tutte le CPU); l'ordine resta
+    quello di `os.listdir`.
+    """
+    jobs = [(folder.split('/')[2], filename, f"{folder}/{filename}")
+            for folder in folders for filename in os.listdir(folder)]
+    if workers is None:
+        workers = os.cpu_count() or 1
+    paths = [path for _, _, path in jobs]
+    if workers > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(jobs))) as executor:
+            tracks = list(executor.map(_read_track_job, paths, chunksize=max(1, len(jobs) // (workers * 4))))
+    else:
+        tracks = [read_track(path) for path in paths]
+    return [(model, filename, track) for (model, filename, _), track in zip(jobs, tracks)]
+
+def build_statistics_dataset(all_subtitles, duration_path="program_duration.json"):
+    """
+    Tabella per programma con DURATION e, per ogni modello, NUM_SEGMENTS, CPS,
+    MEAN_SEGMENT_DURATION e NUM_CHARS_SEGMENTS (vedi `subtitle_statistics`).
+    Le tracce vuote hanno tutte le metriche a 0.
+    """
+    from standardization import subtitle_statistics
+
+    frame = subtitle_statistics.frame_from_tracks(
+        (model, filename.replace(".srt", ""), subtitles) for model, filename, subtitles in all_subtitles)
+    return subtitle_statistics.statistics_table(frame, duration_path, metrics=subtitle_statistics.METRICS)
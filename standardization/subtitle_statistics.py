@@ -0,0 +1,198 @@
+"""
+Statistiche di leggibilità dei sottotitoli su tutti i modelli x programmi.
+
+Le tracce vengono lette in parallelo in un unico DataFrame in formato lungo, una riga per
+sottotitolo: (model, program, start, end, nchars), tempi in ms. Un episodio senza sottotitoli
+è una sola riga con start/end NaN e nchars 0, così compare comunque nelle statistiche (con
+valori a 0) invece di sparire.
+
+Tutte le metriche per (model, program) sono una sola aggregazione `groupby`:
+- NUM_SEGMENTS: numero di sottotitoli;
+- CPS: caratteri totali / secondi tra l'inizio del primo e la fine dell'ultimo sottotitolo;
+- MEAN_SEGMENT_DURATION: durata media di un sottotitolo in secondi;
+- NUM_CHARS_SEGMENTS: caratteri medi per sottotitolo (NCS);
+- CPS/NCS/MSD_VIOLATIONS: sottotitoli fuori dai limiti RAI (`RAI_BOUNDS`), calcolati sul
+  singolo sottotitolo nello stesso passaggio.
+"""
+import functools
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from standardization import standardization_utils
+
+PROGRAM_DURATION_PATH = "program_duration.json"
+# Limiti RAI per sottotitolo: caratteri al secondo, caratteri per blocco, durata in secondi
+RAI_BOUNDS = {"CPS": (9.0, 15.0), "NCS": (30, 74), "MSD": (1.33, 6.0)}
+METRICS = ["NUM_SEGMENTS", "CPS", "MEAN_SEGMENT_DURATION", "NUM_CHARS_SEGMENTS"]
+VIOLATIONS = [f"{name}_VIOLATIONS" for name in RAI_BOUNDS]
+FRAME_COLUMNS = ["model", "program", "start", "end", "nchars"]
+
+
+def model_name(folder: str) -> str:
+    """Nome del modello dalla cartella, come in `load_all_subtitles` ("../data/parakeet/srt" -> "parakeet")."""
+    return folder.split('/')[2]
+
+
+def _read_columns(path: str, cache_dir: Optional[str] = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    if cache_dir:
+        track = standardization_utils.read_track_cached(path, cache_dir)
+    else:
+        track = standardization_utils.read_track(path)
+    return track.start_times, track.end_times, track.char_counts()
+
+
+def _read_columns_star(args):
+    return _read_columns(*args)
+
+
+def frame_from_tracks(tracks: Iterable[Tuple[str, str, Sequence]]) -> pd.DataFrame:
+    """
+    DataFrame lungo da tuple (modello, programma, colonne), dove le colonne sono
+    (start, end, nchars) oppure una traccia (`SubtitleTrack` o lista di `Subtitle`).
+    """
+    models, programs, lengths, starts, ends, nchars = [], [], [], [], [], []
+    for model, program, columns in tracks:
+        if not isinstance(columns, tuple):
+            track = columns
+            if not isinstance(track, standardization_utils.SubtitleTrack):
+                track = standardization_utils.SubtitleTrack.from_subtitles(track)
+            columns = (track.start_times, track.end_times, track.char_counts())
+        start, end, chars = columns
+        if len(start) == 0:
+            start, end, chars = np.array([np.nan]), np.array([np.nan]), np.zeros(1, dtype=np.int64)
+        models.append(model)
+        programs.append(program)
+        lengths.append(len(start))
+        starts.append(np.asarray(start, dtype=np.float64))
+        ends.append(np.asarray(end, dtype=np.float64))
+        nchars.append(np.asarray(chars, dtype=np.int64))
+    if not lengths:
+        return pd.DataFrame({column: [] for column in FRAME_COLUMNS})
+    return pd.DataFrame({
+        "model": _repeat_categorical(models, lengths),
+        "program": _repeat_categorical(programs, lengths),
+        "start": np.concatenate(starts),
+        "end": np.concatenate(ends),
+        "nchars": np.concatenate(nchars),
+    })
+
+
+def _repeat_categorical(values, lengths):
+    """Colonna categoriale con `values[i]` ripetuto `lengths[i]` volte, costruita dai codici."""
+    categories = sorted(set(values))
+    index = {value: code for code, value in enumerate(categories)}
+    codes = np.repeat(np.fromiter((index[value] for value in values), dtype=np.int32, count=len(values)), lengths)
+    return pd.Categorical.from_codes(codes, categories=categories)
+
+
+def load_subtitle_frame(folders: Union[Sequence[str], Dict[str, str]], workers: Optional[int] = None,
+                        cache_dir: Optional[str] = None) -> pd.DataFrame:
+    """
+    Legge tutti gli SRT delle cartelle su un pool di processi e li unisce nel DataFrame lungo.
+    `folders`: lista di cartelle (modello ricavato con `model_name`) o dizionario modello -> cartella.
+    `cache_dir`: se indicata, le tracce passano dalla cache di `read_track_cached`.
+    """
+    if not isinstance(folders, dict):
+        folders = {model_name(folder): folder for folder in folders}
+    jobs = [(model, filename.replace(".srt", ""), os.path.join(folder, filename))
+            for model, folder in folders.items() for filename in sorted(os.listdir(folder))]
+    if workers is None:
+        workers = os.cpu_count() or 1
+    args = [(path, cache_dir) for _, _, path in jobs]
+    if workers > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(jobs))) as executor:
+            columns = list(executor.map(_read_columns_star, args, chunksize=max(1, len(jobs) // (workers * 4))))
+    else:
+        columns = [_read_columns(*a) for a in args]
+    return frame_from_tracks((model, program, cols) for (model, program, _), cols in zip(jobs, columns))
+
+
+@functools.lru_cache(maxsize=8)
+def _load_durations(path: str, mtime: float) -> Dict[str, float]:
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def load_program_durations(path: str = PROGRAM_DURATION_PATH) -> Dict[str, float]:
+    """Durata dei programmi in secondi; il file viene riletto solo se è cambiato."""
+    return _load_durations(os.path.abspath(path), os.path.getmtime(path))
+
+
+def aggregate_statistics(frame: pd.DataFrame, bounds: Dict[str, Tuple[float, float]] = RAI_BOUNDS) -> pd.DataFrame:
+    """
+    Metriche e violazioni per (model, program) con una sola `groupby`, in formato lungo.
+    I valori non sono arrotondati.
+    """
+    start = frame["start"].to_numpy()
+    end = frame["end"].to_numpy()
+    nchars = frame["nchars"].to_numpy()
+    duration_ms = end - start
+    duration_sec = duration_ms / 1000
+    cps = np.zeros(len(frame), dtype=np.float64)
+    np.divide(nchars, duration_sec, out=cps, where=duration_sec > 0)
+    present = ~np.isnan(start)
+
+    def outside(values, name):
+        low, high = bounds[name]
+        return present & ((values < low) | (values > high))
+
+    # Chiave intera della traccia (modello x programma): la groupby lavora su un solo array di codici
+    model = pd.Categorical(frame["model"])
+    program = pd.Categorical(frame["program"])
+    key = model.codes.astype(np.int64) * len(program.categories) + program.codes
+    rows = pd.DataFrame({
+        "start": start, "end": end, "nchars": nchars, "duration_ms": duration_ms,
+        "CPS_VIOLATIONS": outside(cps, "CPS"), "NCS_VIOLATIONS": outside(nchars, "NCS"),
+        "MSD_VIOLATIONS": outside(duration_sec, "MSD"),
+    })
+    grouped = rows.groupby(key, sort=True).agg(
+        NUM_SEGMENTS=("start", "count"), chars=("nchars", "sum"), first_start=("start", "first"),
+        last_end=("end", "last"), total_ms=("duration_ms", "sum"), CPS_VIOLATIONS=("CPS_VIOLATIONS", "sum"),
+        NCS_VIOLATIONS=("NCS_VIOLATIONS", "sum"), MSD_VIOLATIONS=("MSD_VIOLATIONS", "sum"),
+    )
+    codes = grouped.index.to_numpy()
+    grouped.index = pd.MultiIndex.from_arrays(
+        [model.categories[codes // len(program.categories)], program.categories[codes % len(program.categories)]],
+        names=["model", "program"])
+
+    n = grouped["NUM_SEGMENTS"].to_numpy()
+    chars = grouped["chars"].to_numpy(dtype=np.float64)
+    span_ms = (grouped["last_end"] - grouped["first_start"]).to_numpy()
+    span_sec = np.where(span_ms > 0, span_ms / 1000, 1.0)
+    has_segments = n > 0
+    safe_n = np.maximum(n, 1)
+    grouped["CPS"] = np.where(has_segments, chars / span_sec, 0.0)
+    grouped["MEAN_SEGMENT_DURATION"] = np.where(has_segments, grouped["total_ms"].to_numpy() / safe_n / 1000, 0.0)
+    grouped["NUM_CHARS_SEGMENTS"] = np.where(has_segments, chars / safe_n, 0.0)
+    return grouped[METRICS + VIOLATIONS].astype({name: np.int64 for name in ["NUM_SEGMENTS"] + VIOLATIONS})
+
+
+def statistics_table(frame: pd.DataFrame, duration_path: Optional[str] = PROGRAM_DURATION_PATH,
+                     bounds: Dict[str, Tuple[float, float]] = RAI_BOUNDS,
+                     metrics: Sequence[str] = METRICS + VIOLATIONS) -> pd.DataFrame:
+    """
+    Tabella larga come `build_statistics_dataset`: una riga per programma, colonne DURATION
+    (minuti) e `{modello}_{metrica}` raggruppate per metrica, valori arrotondati a 2 decimali.
+    """
+    stats = aggregate_statistics(frame, bounds)
+    wide = stats[list(metrics)].unstack("model")
+    models = list(stats.index.get_level_values("model").unique().sort_values())
+    wide.columns = [f"{model}_{metric}" for metric, model in wide.columns]
+    columns = [f"{model}_{metric}" for metric in metrics for model in models]
+    wide = wide.reindex(columns=columns)
+    wide.index = wide.index.astype(str)
+    wide.index.name = None
+    if duration_path is not None:
+        durations = load_program_durations(duration_path)
+        wide.insert(0, "DURATION", [durations[program] / 60 for program in wide.index])
+        columns = ["DURATION"] + columns
+    # round di Python su ogni valore, come il notebook (np.round può differire all'ultima cifra)
+    for column in wide.columns:
+        if wide[column].dtype.kind == "f":
+            wide[column] = [round(value, 2) for value in wide[column].tolist()]
+    return wide
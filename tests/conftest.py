@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Import dalla radice del repository (`from prediction... import`), come negli script di benchmark
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,97 @@
+"""`MicroBatcher`: ogni richiesta riceve i propri risultati e il modello è usato da un solo thread."""
+import asyncio
+import threading
+import time
+
+import pytest
+
+from prediction.batching import MicroBatcher
+
+
+class ExclusiveModel:
+    """Modello fittizio che registra quante chiamate sono in corso contemporaneamente."""
+
+    def __init__(self, seconds: float = 0.005):
+        self.seconds = seconds
+        self.active = 0
+        self.max_active = 0
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _enter(self):
+        with self._lock:
+            self.active += 1
+            self.calls += 1
+            self.max_active = max(self.max_active, self.active)
+
+    def _exit(self):
+        with self._lock:
+            self.active -= 1
+
+    def __call__(self, windows):
+        self._enter()
+        try:
+            time.sleep(self.seconds)
+            return [f"testo {client}-{window}" for client, window in windows]
+        finally:
+            self._exit()
+
+    def transcribe(self, name):
+        return self([(name, "intero")])[0]
+
+
+def test_results_are_routed_to_their_request():
+    model = ExclusiveModel()
+
+    async def main():
+        batcher = MicroBatcher(model, max_batch_size=8, max_wait_ms=5)
+        await batcher.start()
+        try:
+            return await asyncio.gather(*(batcher.submit_many([(c, w) for w in range(10)]) for c in range(6))), \
+                batcher.stats()
+        finally:
+            await batcher.stop()
+
+    results, stats = asyncio.run(main())
+    assert results == [[f"testo {c}-{w}" for w in range(10)] for c in range(6)]
+    assert stats["items"] == 60 and stats["errors"] == 0
+    assert model.calls < 60  # le finestre di richieste diverse sono state raggruppate
+
+
+def test_batch_errors_reach_every_request_of_the_batch():
+    def broken(windows):
+        raise ValueError("GPU esaurita")
+
+    async def main():
+        batcher = MicroBatcher(broken, max_batch_size=4, max_wait_ms=5)
+        await batcher.start()
+        try:
+            return await batcher.submit_many(["a", "b"], return_exceptions=True)
+        finally:
+            await batcher.stop()
+
+    assert all(isinstance(result, ValueError) for result in asyncio.run(main()))
+
+
+def test_call_is_serialized_with_batches():
+    model = ExclusiveModel()
+
+    async def main():
+        batcher = MicroBatcher(model, max_batch_size=4, max_wait_ms=1)
+        await batcher.start()
+        try:
+            # Richieste sincrone (come /predict nel threadpool di FastAPI) insieme ai batch
+            direct = [asyncio.to_thread(batcher.call, model.transcribe, f"file{k}") for k in range(8)]
+            batched = [batcher.submit_many([(c, w) for w in range(6)]) for c in range(4)]
+            return await asyncio.gather(*direct, *batched)
+        finally:
+            await batcher.stop()
+
+    results = asyncio.run(main())
+    assert results[:8] == [f"testo file{k}-intero" for k in range(8)]
+    assert model.max_active == 1
+
+
+def test_call_requires_started_batcher():
+    with pytest.raises(RuntimeError):
+        MicroBatcher(ExclusiveModel()).call(len, "x")
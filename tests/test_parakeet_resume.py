@@ -0,0 +1,103 @@
+"""
+Ripresa di `transcribe_chunks_resumable` da una cache interrotta, con un modello fittizio
+(una "parola" per secondo di audio, in tempo relativo al chunk).
+"""
+import json
+import os
+from types import SimpleNamespace
+
+import numpy as np
+
+from prediction.parakeet.parakeet_pipeline import SAMPLE_RATE, transcribe_chunks_resumable
+from prediction.parakeet.vad_packing import length_batches, pack_segments
+
+
+class SecondsModel:
+    def __init__(self):
+        self.seconds = 0.0
+
+    def transcribe(self, inputs, batch_size=1, timestamps=False):
+        outputs = []
+        for audio in inputs:
+            n = int(len(audio) // SAMPLE_RATE)
+            self.seconds += len(audio) / SAMPLE_RATE
+            words = [{"start": k + 0.1, "end": k + 0.9, "word": "w"} for k in range(n)]
+            outputs.append(SimpleNamespace(timestamp={"segment": [{"start": 0.0, "end": float(n), "segment": "s"}],
+                                                      "word": words}))
+        return outputs
+
+
+def raw_timeline():
+    """100 segmenti VAD grezzi da 4 s separati da pause di 1 s: 500 s di episodio."""
+    return [(5.0 * k, 5.0 * k + 4.0) for k in range(100)]
+
+
+def run(cache_dir, tmp_path, chunks, model):
+    return transcribe_chunks_resumable(
+        "episodio.wav", chunks, str(cache_dir), "fittizio", str(tmp_path / "segments.json"),
+        str(tmp_path / "words.json"), cleanup_on_success=False, asr_model=model,
+        audio=np.zeros(500 * SAMPLE_RATE, dtype=np.float32), batches=length_batches(chunks, 8))
+
+
+def write_legacy_cache(cache_dir, tmp_path, raw, processed):
+    """Cache del notebook: segmenti grezzi trascritti in ordine fino a `processed`."""
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(cache_dir / "segments.json", "w", encoding="utf-8") as f:
+        json.dump({"segments": raw}, f)
+    with open(cache_dir / "progress.json", "w", encoding="utf-8") as f:
+        json.dump({"processed_chunks": processed}, f)
+    words = [[start + k + 0.1, start + k + 0.9, "old"] for start, end in raw[:processed] for k in range(4)]
+    with open(tmp_path / "words.json", "w", encoding="utf-8") as f:
+        json.dump(words, f)
+    with open(tmp_path / "segments.json", "w", encoding="utf-8") as f:
+        json.dump([[start, end, "old"] for start, end in raw[:processed]], f)
+
+
+def test_legacy_progress_counts_raw_segments(tmp_path):
+    raw = raw_timeline()
+    chunks = pack_segments(raw, target_duration=30.0)
+    cache_dir = tmp_path / "cache"
+    write_legacy_cache(cache_dir, tmp_path, raw, processed=20)
+
+    model = SecondsModel()
+    _, words, _ = run(cache_dir, tmp_path, chunks, model)
+
+    # Trascritto di nuovo solo ciò che segue i primi 100 s, e la timeline è completa fino a 500 s
+    assert 380 <= model.seconds <= 420
+    assert words[-1][1] > 495
+    old = [w for w in words if w[2] == "old"]
+    assert old and max(w[1] for w in old) <= 100
+    starts = [w[0] for w in words]
+    assert starts == sorted(starts) and len(starts) == len(set(starts))
+
+
+def test_legacy_progress_without_manifest_restarts(tmp_path):
+    raw = raw_timeline()
+    chunks = pack_segments(raw, target_duration=30.0)
+    cache_dir = tmp_path / "cache"
+    write_legacy_cache(cache_dir, tmp_path, raw, processed=20)
+    os.remove(cache_dir / "segments.json")
+
+    model = SecondsModel()
+    _, words, _ = run(cache_dir, tmp_path, chunks, model)
+    assert model.seconds >= sum(chunk.end - chunk.start for chunk in chunks) - 1e-6
+    assert not any(w[2] == "old" for w in words)
+
+
+def test_state_of_other_packing_is_ignored(tmp_path):
+    raw = raw_timeline()
+    cache_dir = tmp_path / "cache"
+    os.makedirs(cache_dir)
+    run(cache_dir, tmp_path, pack_segments(raw, target_duration=30.0), SecondsModel())
+
+    chunks = pack_segments(raw, target_duration=20.0)
+    model = SecondsModel()
+    _, words, _ = run(cache_dir, tmp_path, chunks, model)
+    assert model.seconds >= sum(chunk.end - chunk.start for chunk in chunks) - 1e-6
+    starts = [w[0] for w in words]
+    assert starts == sorted(starts) and len(starts) == len(set(starts))
+
+    # Stessa lista di chunk: niente da rifare
+    again = SecondsModel()
+    _, words_again, _ = run(cache_dir, tmp_path, chunks, again)
+    assert again.seconds == 0 and [list(w) for w in words_again] == [list(w) for w in words]
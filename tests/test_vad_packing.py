@@ -0,0 +1,110 @@
+"""`vad_packing` su timeline VAD sintetiche."""
+import numpy as np
+import pytest
+
+from prediction.parakeet.vad_packing import (PackedChunk, length_batches, pack_segments, restore_timeline,
+                                             sequential_batches)
+
+
+def random_timeline(n_segments, seed):
+    """Segmenti con durate log-normali (anche oltre il minuto) e pause esponenziali, anche brevissime."""
+    rng = np.random.default_rng(seed)
+    durations = np.clip(rng.lognormal(mean=1.1, sigma=1.0, size=n_segments), 0.2, 120.0)
+    gaps = rng.exponential(0.8, size=n_segments)
+    starts = np.cumsum(gaps + np.concatenate([[0.0], durations[:-1]]))
+    return list(zip(starts.tolist(), (starts + durations).tolist()))
+
+
+def covered(segments, time_sec):
+    return any(start <= time_sec <= end for start, end in segments)
+
+
+def test_gaps_shorter_than_min_gap_are_fused():
+    segments = [(0.0, 1.0), (1.2, 2.0), (2.6, 3.0)]
+    chunks = pack_segments(segments, target_duration=30.0, min_gap=0.3, max_merge_gap=0.0)
+    # 0.2 s < min_gap: stessa regione; 0.6 s >= min_gap e max_merge_gap=0: chunk separato
+    assert [(c.start, c.end) for c in chunks] == [(0.0, 2.0), (2.6, 3.0)]
+
+
+def test_fused_region_longer_than_target_is_split_with_overlap():
+    # 50 segmenti da 1 s separati da 0.1 s: un'unica regione di 54.9 s
+    segments = [(1.1 * k, 1.1 * k + 1.0) for k in range(50)]
+    chunks = pack_segments(segments, target_duration=30.0, min_gap=0.3, overlap=1.0)
+    assert len(chunks) == 2
+    assert chunks[0].start == 0.0 and chunks[-1].end == pytest.approx(54.9)
+    assert chunks[0].end - chunks[1].start == pytest.approx(1.0)
+
+
+def test_split_pieces_have_equal_length_and_overlap():
+    chunks = pack_segments([(0.0, 70.0)], target_duration=30.0, overlap=1.0)
+    assert [(c.start, c.end) for c in chunks] == [(0.0, 24.0), (23.0, 47.0), (46.0, 70.0)]
+    # I confini di possesso cadono a metà delle sovrapposizioni
+    assert [c.keep_start for c in chunks[1:]] == [23.5, 46.5]
+
+
+def test_short_regions_are_merged_up_to_target_and_max_merge_gap():
+    segments = [(0.0, 10.0), (11.0, 20.0), (21.0, 29.0), (30.0, 35.0), (40.0, 45.0)]
+    chunks = pack_segments(segments, target_duration=30.0, max_merge_gap=2.0)
+    assert [(c.start, c.end) for c in chunks] == [(0.0, 29.0), (30.0, 35.0), (40.0, 45.0)]
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("target_duration, overlap", [(30.0, 1.0), (15.0, 0.5), (8.0, 0.0)])
+def test_chunks_respect_max_length_and_cover_the_speech(seed, target_duration, overlap):
+    segments = random_timeline(300, seed)
+    chunks = pack_segments(segments, target_duration=target_duration, overlap=overlap)
+    assert all(0 < chunk.duration <= target_duration + 1e-9 for chunk in chunks)
+    assert all(a.start < b.start for a, b in zip(chunks, chunks[1:]))
+    # Possesso contiguo e senza buchi, e ogni istante di parlato cade in un chunk
+    assert all(a.keep_end == b.keep_start for a, b in zip(chunks, chunks[1:]))
+    assert all(chunk.keep_start <= chunk.start + chunk.duration / 2 < chunk.keep_end for chunk in chunks)
+    for start, end in segments:
+        for time_sec in np.linspace(start, end, 5):
+            assert covered([(c.start, c.end) for c in chunks], time_sec)
+
+
+def test_invalid_overlap():
+    with pytest.raises(ValueError):
+        pack_segments([(0.0, 10.0)], target_duration=5.0, overlap=5.0)
+
+
+@pytest.mark.parametrize("batch_size", [1, 3, 8, 1000])
+def test_length_batches_cover_every_chunk_exactly_once(batch_size):
+    chunks = pack_segments(random_timeline(200, 1), target_duration=30.0)
+    batches = length_batches(chunks, batch_size)
+    flat = [idx for batch in batches for idx in batch]
+    assert sorted(flat) == list(range(len(chunks)))
+    assert all(0 < len(batch) <= batch_size for batch in batches)
+    durations = [chunks[idx].duration for idx in flat]
+    assert durations == sorted(durations, reverse=True)
+    assert [idx for batch in sequential_batches(len(chunks), batch_size) for idx in batch] == list(range(len(chunks)))
+
+
+def transcribe(chunk, words):
+    """Trascrizione ideale di un chunk: le parole (start, end, testo) che cadono nel suo audio."""
+    inside = [w for w in words if chunk.start <= w[0] and w[1] <= chunk.end]
+    segment = [(inside[0][0], inside[-1][1], " ".join(w[2] for w in inside))] if inside else []
+    return segment, inside
+
+
+def test_restore_timeline_drops_words_duplicated_in_overlaps():
+    # Parole da 0.3 s ogni 0.5 s su 100 s di parlato continuo: chunk sovrapposti di 2 s
+    words = [(0.5 * k, 0.5 * k + 0.3, f"w{k}") for k in range(200)]
+    chunks = pack_segments([(0.0, 100.0)], target_duration=30.0, overlap=2.0)
+    outputs = {idx: transcribe(chunk, words) for idx, chunk in enumerate(chunks)}
+    assert sum(len(out[1]) for out in outputs.values()) > len(words)  # duplicati nelle sovrapposizioni
+
+    # In qualunque ordine arrivino gli output dei chunk
+    shuffled = {idx: outputs[idx] for idx in reversed(range(len(chunks)))}
+    segments, restored = restore_timeline(shuffled, chunks)
+    assert restored == words
+    assert [s[0] for s in segments] == sorted(s[0] for s in segments)
+
+
+def test_restore_timeline_keeps_everything_for_plain_segments():
+    chunks = [(0.0, 5.0), (4.0, 9.0)]
+    outputs = {1: ([(4.0, 9.0, "b")], [(4.5, 5.0, "x")]), 0: ([(0.0, 5.0, "a")], [(4.5, 5.0, "x")])}
+    segments, words = restore_timeline(outputs, chunks)
+    assert segments == [(0.0, 5.0, "a"), (4.0, 9.0, "b")]
+    assert words == [(4.5, 5.0, "x"), (4.5, 5.0, "x")]
+    assert isinstance(pack_segments(chunks)[0], PackedChunk)
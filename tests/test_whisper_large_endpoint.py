@@ -0,0 +1,191 @@
+"""
+Endpoint whisper_large su CPU: storage locale (LOCAL_STORAGE_ROOT) e un modello Whisper con
+l'architettura reale ma dimensioni minime e pesi casuali, così encoder, decoder e hook della
+kv-cache girano davvero senza scaricare un checkpoint. /predict_stream usa invece un modello
+fittizio, per controllare chunk, offset e contesto tra chunk.
+"""
+import importlib
+import json
+import os
+import shutil
+import threading
+import wave
+
+import numpy as np
+import pytest
+
+torch = pytest.importorskip("torch")
+whisper = pytest.importorskip("whisper")
+pytest.importorskip("fastapi")
+pytest.importorskip("httpx")
+pytest.importorskip("google.cloud.storage")
+if shutil.which("ffmpeg") is None:
+    pytest.skip("ffmpeg non disponibile", allow_module_level=True)
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+from prediction.audio_cache import AudioCache  # noqa: E402
+
+SAMPLE_RATE = 16000
+BUCKET = "bucket-test"
+
+
+def tiny_random_whisper():
+    from whisper.model import ModelDimensions, Whisper
+
+    torch.manual_seed(0)
+    dims = ModelDimensions(n_mels=80, n_audio_ctx=1500, n_audio_state=64, n_audio_head=2, n_audio_layer=1,
+                           n_vocab=51865, n_text_ctx=448, n_text_state=64, n_text_head=2, n_text_layer=1)
+    model = Whisper(dims).eval()
+    tokenizer = whisper.tokenizer.get_tokenizer(True, num_languages=model.num_languages, language="it")
+    with torch.no_grad():
+        model.decoder.positional_embedding.normal_(0, 0.02)  # creato con torch.empty
+        # Uscita del decoder costante e fine testo come token più probabile: ogni finestra si
+        # chiude dopo pochi passi (con pesi casuali la decodifica arriverebbe a 224 token)
+        direction = torch.randn(dims.n_text_state)
+        model.decoder.ln.weight.zero_()
+        model.decoder.ln.bias.copy_(direction)
+        model.decoder.token_embedding.weight[tokenizer.eot] = direction * 10 / direction.norm()
+    return model
+
+
+class ConcurrencyProbe:
+    """Conta i forward di encoder e decoder in corso contemporaneamente, da qualunque thread."""
+
+    def __init__(self, model):
+        self.active = 0
+        self.max_active = 0
+        self.threads = set()
+        self._lock = threading.Lock()
+        for module in (model.encoder, model.decoder):
+            module.forward = self._wrap(module.forward)
+
+    def _wrap(self, forward):
+        def probed(*args, **kwargs):
+            with self._lock:
+                self.active += 1
+                self.max_active = max(self.max_active, self.active)
+                self.threads.add(threading.current_thread().name)
+            try:
+                return forward(*args, **kwargs)
+            finally:
+                with self._lock:
+                    self.active -= 1
+        return probed
+
+
+def write_wav(path, seconds, seed=0):
+    """Parlato simulato: tratti di rumore e toni separati da pause quasi silenziose."""
+    rng = np.random.default_rng(seed)
+    audio = rng.standard_normal(int(seconds * SAMPLE_RATE)) * 0.01
+    t = np.arange(len(audio)) / SAMPLE_RATE
+    voiced = (t % 4.0) < 3.0
+    audio[voiced] += 0.3 * np.sin(2 * np.pi * 220 * t[voiced]) + 0.1 * rng.standard_normal(voiced.sum())
+    pcm = np.clip(audio * 32767, -32768, 32767).astype("<i2")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with wave.open(path, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(SAMPLE_RATE)
+        f.writeframes(pcm.tobytes())
+    return len(pcm)
+
+
+@pytest.fixture
+def endpoint(tmp_path, monkeypatch):
+    """Modulo dell'endpoint importato con storage locale e modello `model` (da impostare prima del client)."""
+    monkeypatch.setenv("LOCAL_STORAGE_ROOT", str(tmp_path / "gcs"))
+    monkeypatch.setenv("WHISPER_DEVICE", "cpu")
+    module = importlib.reload(importlib.import_module("prediction.whisper_large.whisper_large_endpoint"))
+    monkeypatch.setattr(module, "audio_store", AudioCache(str(tmp_path / "audio_cache")))
+    return module
+
+
+def client_with_model(monkeypatch, endpoint, model):
+    monkeypatch.setattr(whisper, "load_model", lambda *args, **kwargs: model)
+    return TestClient(endpoint.app)
+
+
+def test_predict_and_predict_batched_share_one_model_thread(tmp_path, monkeypatch, endpoint):
+    for k in range(3):
+        write_wav(str(tmp_path / "gcs" / BUCKET / f"episodio{k}.wav"), seconds=35, seed=k)
+    model = tiny_random_whisper()
+    probe = ConcurrencyProbe(model)
+    responses = {}
+
+    with client_with_model(monkeypatch, endpoint, model) as client:
+        def send(name, route, k):
+            body = {"instances": [f"gs://{BUCKET}/episodio{k}.wav"], "parameters": {"chunk_seconds": 10}}
+            responses[name] = client.post(route, json=body)
+
+        threads = [threading.Thread(target=send, args=(f"{route}-{k}", route, k))
+                   for k in range(3) for route in ("/predict", "/predict_batched")]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    assert len(responses) == 6
+    for name, response in responses.items():
+        assert response.status_code == 200, name
+        prediction = response.json()["predictions"][0]
+        assert "result" in prediction, (name, prediction)
+        for segment in prediction["result"]:
+            assert "words" in segment and 0 <= segment["start"] <= segment["end"]
+    # Nessun forward sovrapposto: un solo thread (quello del batcher) ha usato il modello
+    assert probe.max_active == 1
+    assert len(probe.threads) == 1 and next(iter(probe.threads)).startswith("whisper-batch")
+
+
+class StubModel:
+    """Sostituto di `model.transcribe`: un segmento per chunk lungo quanto l'audio ricevuto."""
+
+    def __init__(self):
+        self.calls = []
+
+    def transcribe(self, audio, language=None, word_timestamps=False, initial_prompt=None):
+        k = len(self.calls)
+        self.calls.append({"samples": len(audio), "initial_prompt": initial_prompt, "language": language})
+        duration = len(audio) / SAMPLE_RATE
+        text = f" chunk numero {k}"
+        return {"text": text, "segments": [{"id": 0, "start": 0.0, "end": duration, "text": text,
+                                            "words": [{"word": " chunk", "start": 0.0, "end": duration / 2}]}]}
+
+
+def test_predict_stream_reads_local_storage_in_chunks(tmp_path, monkeypatch, endpoint):
+    total_samples = write_wav(str(tmp_path / "gcs" / BUCKET / "episodio.wav"), seconds=35)
+    model = StubModel()
+    uris = [f"gs://{BUCKET}/episodio.wav", f"gs://{BUCKET}/mancante.wav"]
+
+    with client_with_model(monkeypatch, endpoint, model) as client:
+        response = client.post("/predict_stream", json={"instances": uris, "parameters": {"chunk_seconds": 10}})
+
+    # NDJSON: una riga JSON per segmento, poi `done` per l'istanza (o `error`)
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    assert response.text.endswith("\n")
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    segments = [line["segment"] for line in lines if "segment" in line]
+    assert all(line["instance"] == uris[0] for line in lines[:-1])
+    assert lines[-2] == {"instance": uris[0], "done": True, "num_segments": len(segments)}
+    assert lines[-1]["instance"] == uris[1] and "error" in lines[-1]
+
+    # I chunk coprono tutto l'audio, ognuno al più di chunk_seconds, e i tempi sono riportati
+    # sull'asse dell'intero file sommando gli offset dei chunk precedenti
+    samples = [call["samples"] for call in model.calls]
+    assert len(samples) == len(segments) >= 4
+    assert sum(samples) == total_samples
+    assert all(n <= 10 * SAMPLE_RATE for n in samples)
+    offset = 0
+    for k, (segment, n) in enumerate(zip(segments, samples)):
+        assert segment["id"] == k
+        assert segment["start"] == round(offset / SAMPLE_RATE, 3)
+        assert segment["end"] == round((offset + n) / SAMPLE_RATE, 3)
+        assert segment["words"][0]["start"] == segment["start"]
+        offset += n
+
+    # Il testo di ogni chunk è il contesto (`initial_prompt`) del successivo
+    assert model.calls[0]["initial_prompt"] is None
+    for k in range(1, len(model.calls)):
+        assert model.calls[k]["initial_prompt"] == f"chunk numero {k - 1}"
+    assert all(call["language"] == "it" for call in model.calls)